@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+#
+# bench_decoder.py
+# 202610181300
+#
+# micro benchmark of the attribute decoder
+# compares the table driven decoder in winix_decode.py with the decode winix-02 used before it, which looked up
+# every code with list(TABLE.keys())[list(TABLE.values()).index(code)], building two lists per lookup
+#
+# usage : python3 benchmark/bench_decoder.py [--number 100000]
+#
+
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIRECTORY))
+
+from winix_decode import decode_status
+
+# the tables and decode as they were in winix-02.py
+POWER = {"COMMAND" : "A02", "ON" : "1", "OFF" : "0"}
+OPERATION_MODE = {"COMMAND" : "A03", "AUTO" : "01", "MANUAL" : "02"}
+PLASMAWAVE = {"COMMAND" : "A07", "ON" : "1", "OFF" : "0"}
+FAN_SPEED = {"COMMAND" : "A04", "100" : "05", "75" : "03", "50" : "02", "25" : "01", "SLEEP" : "06"}
+AIR_QUALITY = {"COMMAND" : "S07", "GOOD" : "01", "FAIR" : "02", "POOR" : "03"}
+
+def legacy_decode_status(unit_data) :
+    unit_attributes_json = unit_data.get("attributes")
+    unit_power_ordinal = unit_attributes_json.get("A02")
+    unit_power_text = list(POWER.keys())[list(POWER.values()).index(unit_power_ordinal)]
+    unit_is_off = unit_power_text == "OFF"
+
+    if unit_is_off :
+        air_quality_ordinal = "-1"
+        air_quality_text = "UNKNOWN"
+        air_quality_value = "-1"
+        unit_sleeping_text = "UNKNOWN"
+        unit_plasmawave_ordinal = "-1"
+        unit_plasmawave_text = "UNKNOWN"
+        unit_mode_ordinal = "-1"
+        unit_mode_text = "UNKNOWN"
+        unit_fan_speed_ordinal = "-1"
+        unit_fan_speed_text = "UNKNOWN"
+        unit_filter_hours = "-1"
+        unit_ambient_light = "-1"
+    else :
+        air_quality_ordinal = unit_attributes_json.get("S07")
+        air_quality_text = list(AIR_QUALITY.keys())[list(AIR_QUALITY.values()).index(air_quality_ordinal)]
+        air_quality_value = unit_attributes_json.get("S08")
+        if unit_attributes_json.get("A04") == "06" :
+            unit_sleeping_text = "YES"
+        else :
+            unit_sleeping_text = "NO"
+        unit_plasmawave_ordinal = unit_attributes_json.get("A07")
+        unit_plasmawave_text = list(PLASMAWAVE.keys())[list(PLASMAWAVE.values()).index(unit_plasmawave_ordinal)]
+        unit_mode_ordinal = unit_attributes_json.get("A03")
+        unit_mode_text = list(OPERATION_MODE.keys())[list(OPERATION_MODE.values()).index(unit_mode_ordinal)]
+        unit_fan_speed_ordinal = unit_attributes_json.get("A04")
+        unit_fan_speed_text = list(FAN_SPEED.keys())[list(FAN_SPEED.values()).index(unit_fan_speed_ordinal)]
+        unit_filter_hours = unit_attributes_json.get("A21")
+        unit_ambient_light = unit_attributes_json.get("S14")
+
+    if unit_sleeping_text == "YES" :
+        unit_plasmawave_ordinal = "-1"
+        unit_plasmawave_text = "UNKNOWN"
+        unit_mode_ordinal = "-1"
+        unit_mode_text = "UNKNOWN"
+        unit_fan_speed_ordinal = "-1"
+        unit_fan_speed_text = "UNKNOWN"
+
+    message = {}
+    message["unit_power_ordinal"] = str(int(unit_power_ordinal))
+    message["power_text"] = unit_power_text
+    message["unit_sleeping_text"] = unit_sleeping_text
+    message["air_quality_ordinal"] = str(int(air_quality_ordinal))
+    message["air_quality_text"] = air_quality_text
+    message["air_quality_value"] = air_quality_value
+    message["unit_plasmawave_ordinal"] = str(int(unit_plasmawave_ordinal))
+    message["unit_plasmawave_text"] = unit_plasmawave_text
+    message["unit_mode_ordinal"] = str(int(unit_mode_ordinal))
+    message["unit_mode_text"] = unit_mode_text
+    message["unit_fan_speed_ordinal"] = str(int(unit_fan_speed_ordinal))
+    message["unit_fan_speed_text"] = unit_fan_speed_text
+    message["unit_filter_hours"] = unit_filter_hours
+    message["unit_ambient_light"] = unit_ambient_light
+    message["unit_rssi"] = unit_data.get("rssi")
+    return message
+
+# the sample response, plus the same unit sleeping and powered off
+def sample_units() :
+    sample = json.loads((REPO_DIRECTORY / "sample-retrieve.json").read_text())
+    unit_on = sample["body"]["data"][0]
+    unit_sleeping = json.loads(json.dumps(unit_on))
+    unit_sleeping["attributes"]["A04"] = "06"
+    unit_off = json.loads(json.dumps(unit_on))
+    unit_off["attributes"]["A02"] = "0"
+    return {"on" : unit_on, "sleeping" : unit_sleeping, "off" : unit_off}
+
+def main() :
+    parser = argparse.ArgumentParser(description="winix attribute decoder micro benchmark")
+    parser.add_argument("--number", type=int, default=100000, help="decodes per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best is reported")
+    args = parser.parse_args()
+
+    units = sample_units()
+
+    # both decoders have to agree before their speed means anything
+    for name, unit_data in units.items() :
+        if legacy_decode_status(unit_data) != decode_status(unit_data) :
+            print("decoders disagree for the " + name + " unit")
+            sys.exit(1)
+
+    print("{:<10} {:>14} {:>14} {:>10}".format("unit", "legacy us", "table us", "speedup"))
+    for name, unit_data in units.items() :
+        legacy = min(timeit.repeat(lambda : legacy_decode_status(unit_data), number=args.number, repeat=args.repeat))
+        table = min(timeit.repeat(lambda : decode_status(unit_data), number=args.number, repeat=args.repeat))
+        print("{:<10} {:>14.3f} {:>14.3f} {:>9.2f}x".format(name, legacy * 1e6 / args.number, table * 1e6 / args.number, legacy / table))
+
+    # an attribute code the tables don't know, the legacy decode raises and the unit is never published
+    unknown = json.loads(json.dumps(units["on"]))
+    unknown["attributes"]["S07"] = "04"
+    try :
+        legacy_decode_status(unknown)
+        legacy_result = "decoded"
+    except ValueError :
+        legacy_result = "ValueError"
+    print("unknown air quality code : legacy " + legacy_result + ", table " + decode_status(unknown)["air_quality_text"])
+
+if __name__ == '__main__':
+    main()
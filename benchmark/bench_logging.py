@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+#
+# bench_logging.py
+# 202610181600
+#
+# hot path cost of logging in winix-02, per unit status fetch
+#
+# before : root logger always at DEBUG, messages built with str() and + whether or not they are written,
+#          file and syslog handlers writing synchronously on the calling thread
+# after  : root logger at the lowest handler level, %s arguments formatted only for records that are written,
+#          file and syslog writes done by a QueueListener background thread
+#
+# each is measured with debug_level INFO, the normal setting, and DEBUG. the time is what the fetch thread spends
+# in logging calls, the I/O the background thread does afterwards is not on the hot path
+#
+# usage : python3 benchmark/bench_logging.py [--fetches 20000]
+#
+
+import argparse
+import json
+import logging
+import logging.handlers
+import queue
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+
+# the log lines written for one unit status fetch, as winix-02 had them
+def fetch_before(logger, unit_url, unit_raw_json, topic, message_to_publish) :
+    logger.debug("Requested URL : " + unit_url)
+    logger.debug("Returned data : " + str(unit_raw_json))
+    logger.debug("publishing on topic : |" + topic + "|")
+    logger.debug("publishing message : |" + str(message_to_publish) + "|")
+
+# and as they are now
+def fetch_after(logger, unit_url, unit_raw_json, topic, message_to_publish) :
+    logger.debug("Requested URL : %s", unit_url)
+    logger.debug("Returned data : %s", unit_raw_json)
+    logger.debug("publishing on topic : |%s|", topic)
+    logger.debug("publishing message : |%s|", message_to_publish)
+
+def make_handlers(directory, level) :
+    formatter = logging.Formatter(fmt='%(asctime)s %(levelname)-8s bench %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    handler_file = logging.handlers.RotatingFileHandler(str(Path(directory) / "bench.log"), maxBytes=10 * 1024 * 1024, backupCount=2)
+    handler_file.setFormatter(formatter)
+    handler_file.setLevel(level)
+    # nobody listens on this port, a udp send doesn't care
+    handler_rsyslog = logging.handlers.SysLogHandler(address=("127.0.0.1", 55514))
+    handler_rsyslog.setFormatter(formatter)
+    handler_rsyslog.setLevel(logging.INFO)
+    return [handler_file, handler_rsyslog]
+
+def run(variant, debug_level, fetches, sample) :
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers) :
+        root_logger.removeHandler(handler)
+    logger = logging.getLogger("bench")
+
+    with tempfile.TemporaryDirectory() as directory :
+        handlers = make_handlers(directory, debug_level)
+        listener = None
+        if variant == "before" :
+            for handler in handlers :
+                root_logger.addHandler(handler)
+            root_logger.setLevel(logging.DEBUG)
+            fetch = fetch_before
+        else :
+            log_queue = queue.SimpleQueue()
+            root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+            listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            listener.start()
+            root_logger.setLevel(min(handler.level for handler in handlers))
+            fetch = fetch_after
+
+        unit_url = "https://us.api.winix-iot.com/common/event/sttus/devices/xxxxxxxxx_yyyyyyyyyy"
+        message_to_publish = json.dumps(sample)
+        start = time.perf_counter()
+        for i in range(fetches) :
+            fetch(logger, unit_url, sample, "winix/aa:bb:cc:dd:ee:ff", message_to_publish)
+        elapsed = time.perf_counter() - start
+
+        if listener is not None :
+            listener.stop()
+        for handler in list(root_logger.handlers) :
+            root_logger.removeHandler(handler)
+        for handler in handlers :
+            handler.close()
+
+    return elapsed * 1e6 / fetches
+
+def main() :
+    parser = argparse.ArgumentParser(description="winix-02 logging hot path cost per unit fetch")
+    parser.add_argument("--fetches", type=int, default=20000, help="unit fetches to log per measurement")
+    args = parser.parse_args()
+
+    sample = json.loads((REPO_DIRECTORY / "sample-retrieve.json").read_text())
+
+    print("{:<12} {:>14} {:>14} {:>10}".format("debug_level", "before us", "after us", "speedup"))
+    for name, level in (("INFO", logging.INFO), ("DEBUG", logging.DEBUG)) :
+        before = run("before", level, args.fetches, sample)
+        after = run("after", level, args.fetches, sample)
+        print("{:<12} {:>14.2f} {:>14.2f} {:>9.1f}x".format(name, before, after, before / after))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+#
+# bench_main_loop.py
+# 202610181000
+#
+# compare the old winix-02 main loop, which polled the update queue and slept 1 second when it was empty,
+# with the event driven loop that blocks on the queue until work arrives or the next deadline is due
+#
+# two measurements for each loop :
+#   latency  : time from a control message queueing an update request to the main loop dispatching it
+#   idle     : cpu time and number of wakeups while nothing is queued
+#
+# usage : python3 benchmark/bench_main_loop.py [--requests 20] [--idle-seconds 10]
+#
+
+import argparse
+import queue
+import random
+import statistics
+import threading
+import time
+
+# the loop as it was, non blocking get, then sleep 1 second when the queue is empty
+def polling_loop(work_queue, stop, dispatched, counters) :
+    while not stop.is_set() :
+        counters["wakeups"] += 1
+        try :
+            queued_at = work_queue.get(block=False)
+            dispatched.append(time.monotonic() - queued_at)
+        except queue.Empty :
+            time.sleep(1)
+
+# the loop as it is now, block on the queue until there is work or a deadline is due
+# deadline_seconds stands in for the periodic update / day rollover deadline
+def event_loop(work_queue, stop, dispatched, counters, deadline_seconds=300) :
+    while not stop.is_set() :
+        counters["wakeups"] += 1
+        try :
+            queued_at = work_queue.get(timeout=deadline_seconds)
+            if queued_at is None :
+                continue
+            dispatched.append(time.monotonic() - queued_at)
+        except queue.Empty :
+            pass
+
+def run_loop(loop, requests, idle_seconds) :
+    work_queue = queue.SimpleQueue()
+    stop = threading.Event()
+    dispatched = []
+    counters = {"wakeups" : 0, "cpu" : 0.0}
+
+    def worker() :
+        start = time.thread_time()
+        loop(work_queue, stop, dispatched, counters)
+        counters["cpu"] = time.thread_time() - start
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+
+    # idle period, nothing is queued, don't count the first pass through the loop
+    time.sleep(0.1)
+    idle_start_wakeups = counters["wakeups"]
+    time.sleep(idle_seconds)
+    idle_wakeups = counters["wakeups"] - idle_start_wakeups
+
+    # control messages arriving at random times, like a user pressing buttons in home assistant
+    for i in range(requests) :
+        time.sleep(random.uniform(0.05, 0.5))
+        work_queue.put(time.monotonic())
+    while len(dispatched) < requests :
+        time.sleep(0.05)
+
+    stop.set()
+    # the event loop is blocked in get(), wake it so it sees the stop flag
+    work_queue.put(None)
+    thread.join()
+
+    return {
+        "idle_wakeups_per_minute" : idle_wakeups * 60.0 / idle_seconds,
+        "cpu_seconds" : counters["cpu"],
+        "latency_mean_ms" : statistics.mean(dispatched) * 1000.0,
+        "latency_p95_ms" : sorted(dispatched)[int(0.95 * (len(dispatched) - 1))] * 1000.0,
+        "latency_max_ms" : max(dispatched) * 1000.0,
+    }
+
+def main() :
+    parser = argparse.ArgumentParser(description="winix-02 main loop dispatch latency and idle cost")
+    parser.add_argument("--requests", type=int, default=20, help="number of queued update requests to time")
+    parser.add_argument("--idle-seconds", type=float, default=10.0, help="length of the idle period")
+    args = parser.parse_args()
+
+    print("{:<10} {:>14} {:>12} {:>12} {:>12} {:>12}".format("loop", "wakeups/min", "cpu s", "mean ms", "p95 ms", "max ms"))
+    for name, loop in (("polling", polling_loop), ("event", event_loop)) :
+        result = run_loop(loop, args.requests, args.idle_seconds)
+        print("{:<10} {:>14.1f} {:>12.4f} {:>12.2f} {:>12.2f} {:>12.2f}".format(name,
+            result["idle_wakeups_per_minute"], result["cpu_seconds"],
+            result["latency_mean_ms"], result["latency_p95_ms"], result["latency_max_ms"]))
+
+if __name__ == '__main__':
+    main()
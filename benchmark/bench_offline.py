@@ -0,0 +1,241 @@
+#! /usr/bin/env python3
+#
+# bench_offline.py
+# 202610182000
+#
+# end to end benchmark of winix-02 without purifiers, the winix cloud or an MQTT server
+#
+# starts the fake winix cloud (fake_cloud.py) with any number of synthetic units and the in-process MQTT broker
+# (fake_broker.py), writes a winix-02.yaml for them in a temporary working directory, and runs winix-02.py as a
+# subprocess against both. it measures :
+#   sweep       : time for the first round of polls to fetch every unit, and the fetches per second
+#                 poll_wheel_slots is 1 by default, so that round is a burst, not spread over check_interval
+#   commands    : time from a control message on winix/<mac>/control/fan_speed to winix-02 publishing a status
+#                 that shows the new fan speed, percentiles. with --optimistic-state that is the predicted status
+#   process     : cpu seconds and peak rss of winix-02
+#   latency     : status request latency percentiles as winix-02 saw them, from its last metrics, and with
+#                 --api-hedge how many requests were hedged
+#
+# --json appends the parameters and results as one line to a file, to track them over time
+#
+# usage : python3 benchmark/bench_offline.py [--units 1000] [--latency-ms 50] [--jitter-ms 20] [--error-rate 0.0]
+#                                            [--commands 50] [--json results.jsonl]
+#
+
+import argparse
+import json
+import os
+import random
+import resource
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import yaml
+
+from fake_broker import FakeBroker
+from fake_cloud import FakeCloud, unit_key, unit_mac
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+
+FAN_SPEEDS = ("25", "50", "75", "100")
+
+def percentile(values, percent) :
+    ordered = sorted(values)
+    return ordered[max(0, -(-percent * len(ordered) // 100) - 1)]
+
+def write_config(directory, args, cloud, broker) :
+    units = {}
+    for n in range(args.units) :
+        units["U{:06d}".format(n)] = {"home" : "Bench", "room" : "Room {:d}".format(n % 20), "key" : unit_key(n), "mac_address" : unit_mac(n)}
+    config = {
+        "debug_level" : args.debug_level,
+        "mqtt" : "127.0.0.1",
+        "mqtt_port" : broker.port,
+        "mqtt_topic" : "winix",
+        "rsyslog" : "",
+        "check_interval" : args.check_minutes,
+        "publish_heartbeat" : 0,
+        "publish_retain" : False,
+        "payload_profile" : args.payload_profile,
+        "poll_schedule" : args.poll_schedule,
+        "poll_wheel_slots" : args.poll_wheel_slots,
+        "optimistic_state" : args.optimistic_state,
+        "api_base_url" : cloud.base_url,
+        "api_requests_per_second" : args.api_requests_per_second,
+        "api_burst" : args.api_max_concurrency,
+        "api_max_concurrency" : args.api_max_concurrency,
+        "api_hedge" : args.api_hedge,
+        "metrics_interval" : 1,
+        "command_debounce" : args.command_debounce,
+        "history_file" : "winix-02-history.sqlite3" if args.history else "",
+        "units" : units,
+    }
+    (Path(directory) / "winix-02.yaml").write_text(yaml.safe_dump(config))
+
+# watches the status winix-02 publishes, and times commands from control message to a status showing the change
+class CommandTimer :
+
+    def __init__(self, broker, payload_profile) :
+        self._broker = broker
+        self._payload_profile = payload_profile
+        self._lock = threading.Lock()
+        # unit_mac -> (fan speed text expected, time the command was published)
+        self._waiting = {}
+        self.latencies = []
+        self.status_messages = 0
+        broker.subscribe("winix/#", self._on_message)
+
+    def _on_message(self, topic, payload) :
+        parts = topic.split("/")
+        if len(parts) < 2 or parts[1].startswith("$") or "control" in parts :
+            return
+        fan_speed = None
+        if self._payload_profile == "fields" :
+            if len(parts) == 4 and parts[3] == "unit_fan_speed_text" :
+                fan_speed = payload.decode()
+        elif len(parts) == 2 :
+            fan_speed = str(json.loads(payload).get("unit_fan_speed_text"))
+        now = time.perf_counter()
+        with self._lock :
+            self.status_messages += 1
+            waiting = self._waiting.get(parts[1])
+            if waiting is not None and fan_speed == waiting[0] :
+                del self._waiting[parts[1]]
+                self.latencies.append(now - waiting[1])
+
+    def send(self, mac, fan_speed) :
+        with self._lock :
+            self._waiting[mac] = (fan_speed, time.perf_counter())
+        self._broker.publish("winix/" + mac + "/control/fan_speed", fan_speed)
+
+    def waiting(self) :
+        with self._lock :
+            return len(self._waiting)
+
+def main() :
+    parser = argparse.ArgumentParser(description="winix-02 end to end against a fake winix cloud and MQTT broker")
+    parser.add_argument("--units", type=int, default=1000, help="number of synthetic units")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake cloud response latency")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="random jitter on the latency, plus or minus")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of cloud requests answered with a 500")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of cloud requests that are slow")
+    parser.add_argument("--tail-ms", type=float, default=1000, help="extra latency of a slow cloud request")
+    parser.add_argument("--api-hedge", action="store_true", help="api_hedge for winix-02, hedge slow status requests")
+    parser.add_argument("--upload-delay", type=float, default=0.0, help="seconds before a unit reports a command in its status")
+    parser.add_argument("--commands", type=int, default=50, help="fan speed commands to time after the first sweep")
+    parser.add_argument("--command-interval", type=float, default=0.2, help="seconds between commands")
+    parser.add_argument("--command-debounce", type=float, default=0.5, help="command_debounce for winix-02")
+    parser.add_argument("--check-minutes", type=float, default=5, help="check_interval for winix-02")
+    parser.add_argument("--api-requests-per-second", type=float, default=1000, help="api_requests_per_second for winix-02")
+    parser.add_argument("--api-max-concurrency", type=int, default=4, help="api_max_concurrency for winix-02")
+    parser.add_argument("--poll-schedule", default="sweep", choices=("adaptive", "sweep"), help="poll_schedule for winix-02")
+    parser.add_argument("--poll-wheel-slots", type=int, default=1, help="poll_wheel_slots for winix-02, 1 puts every unit in the first slot so the first round is a burst that measures throughput")
+    parser.add_argument("--optimistic-state", action="store_true", help="optimistic_state for winix-02, commands are timed to the predicted status")
+    parser.add_argument("--payload-profile", default="full", choices=("full", "compact", "fields"), help="payload_profile for winix-02")
+    parser.add_argument("--history", action="store_true", help="keep the local history database")
+    parser.add_argument("--debug-level", default="INFO", help="debug_level for winix-02")
+    parser.add_argument("--timeout", type=float, default=600, help="give up on a phase after this many seconds")
+    parser.add_argument("--json", help="append the results as a json line to this file")
+    args = parser.parse_args()
+
+    cloud = FakeCloud(args.units, args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, args.upload_delay,
+        tail_rate=args.tail_rate, tail_latency=args.tail_ms / 1000).start()
+    broker = FakeBroker().start()
+    timer = CommandTimer(broker, args.payload_profile)
+    # the last metrics winix-02 published
+    last_metrics = {}
+    broker.subscribe("winix/$SYS/METRICS", lambda topic, payload : last_metrics.update(json.loads(payload)["metrics"]))
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory :
+        write_config(directory, args, cloud, broker)
+        environment = dict(os.environ, WINIX_WORKING_DIRECTORY=directory)
+        stderr_file = open(Path(directory) / "stderr.txt", "w+")
+        started = time.time()
+        process = subprocess.Popen([sys.executable, str(REPO_DIRECTORY / "winix-02.py")], env=environment,
+            stdout=subprocess.DEVNULL, stderr=stderr_file)
+        try :
+            # first sweep, every unit fetched once
+            deadline = time.time() + args.timeout
+            while cloud.status_requests < args.units and time.time() < deadline and process.poll() is None :
+                time.sleep(0.05)
+            if cloud.status_requests < args.units :
+                raise RuntimeError("winix-02 did not finish the first sweep, {:d} of {:d} units fetched".format(cloud.status_requests, args.units))
+            times = cloud.status_times[:args.units]
+            results["startup_seconds"] = times[0] - started
+            results["sweep_seconds"] = times[-1] - times[0]
+            results["fetches_per_second"] = (args.units - 1) / results["sweep_seconds"] if results["sweep_seconds"] > 0 else 0.0
+
+            # let the publishes of the sweep drain before timing commands
+            time.sleep(1)
+
+            rng = random.Random(1)
+            fan_speeds = {}
+            for i in range(args.commands) :
+                n = rng.randrange(args.units)
+                mac = unit_mac(n)
+                fan_speed = rng.choice([speed for speed in FAN_SPEEDS if speed != fan_speeds.get(mac, "25")])
+                fan_speeds[mac] = fan_speed
+                timer.send(mac, fan_speed)
+                time.sleep(args.command_interval)
+            deadline = time.time() + min(args.timeout, 60)
+            while timer.waiting() and time.time() < deadline :
+                time.sleep(0.05)
+        finally :
+            if process.poll() is None :
+                process.send_signal(signal.SIGINT)
+                try :
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired :
+                    process.kill()
+                    process.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+            stderr_file.close()
+            cloud.stop()
+            broker.stop()
+            log_tail = ""
+            log_file = Path(directory) / "winix-02.log"
+            if log_file.exists() :
+                log_tail = "".join(log_file.read_text().splitlines(True)[-20:])
+
+        if "sweep_seconds" not in results :
+            print(stderr or log_tail)
+            sys.exit(1)
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    results["cpu_seconds"] = usage.ru_utime + usage.ru_stime
+    # ru_maxrss is in kilobytes on linux
+    results["max_rss_mb"] = usage.ru_maxrss / 1024
+    results["commands_confirmed"] = len(timer.latencies)
+    results["commands_lost"] = args.commands - len(timer.latencies)
+    if timer.latencies :
+        for percent in (50, 90, 99) :
+            results["command_p{:d}_ms".format(percent)] = percentile(timer.latencies, percent) * 1000
+        results["command_mean_ms"] = statistics.mean(timer.latencies) * 1000
+    results["cloud_status_requests"] = cloud.status_requests
+    results["cloud_command_requests"] = cloud.command_requests
+    results["cloud_errors"] = cloud.errors
+    results["mqtt_status_messages"] = timer.status_messages
+    for entry in last_metrics.get("winix_cloud_request_latency_quantile_seconds", {}).get("values", []) :
+        if entry["labels"]["kind"] == "status" :
+            results["status_p{:.0f}_ms".format(float(entry["labels"]["quantile"]) * 100)] = entry["value"] * 1000
+    for entry in last_metrics.get("winix_hedged_requests_total", {}).get("values", []) :
+        results["status_" + entry["labels"]["result"]] = entry["value"]
+
+    print("units {:d}, latency {:.0f} ms +/- {:.0f} ms, error rate {:.1%}".format(args.units, args.latency_ms, args.jitter_ms, args.error_rate))
+    for name, value in results.items() :
+        print("{:<24} {:>12.2f}".format(name, value) if isinstance(value, float) else "{:<24} {:>12d}".format(name, value))
+
+    if args.json :
+        with open(args.json, "a") as results_file :
+            results_file.write(json.dumps({"time" : int(time.time()), "parameters" : vars(args), "results" : results}) + "\n")
+
+if __name__ == '__main__':
+    main()
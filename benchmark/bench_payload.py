@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+#
+# bench_payload.py
+# 202610181900
+#
+# MQTT bytes published by winix-02 for each payload profile, full, compact and fields
+#
+# replays a day of fetches for a number of units. each unit uploads to the winix cloud every upload_minutes, the
+# air quality value drifts on most uploads, the band and fan speed change now and then, filter hours tick over
+# every hour. the status is built from sample-retrieve.json the way get_unit_update builds it, and goes through
+# the same change detection, so unchanged fetches publish nothing in any profile
+#
+# bytes are MQTT PUBLISH packet sizes at qos 0, fixed header, topic and payload, what the broker receives and
+# what a recorder subscribed to winix/# stores
+#
+# usage : python3 benchmark/bench_payload.py [--units 8] [--check-minutes 5] [--upload-minutes 5] [--heartbeat-minutes 60]
+#
+
+import argparse
+import copy
+import json
+import random
+import sys
+from pathlib import Path
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIRECTORY))
+
+from winix_decode import decode_status
+from winix_payload import PAYLOAD_PROFILES, PAYLOAD_COMPACT, PAYLOAD_FIELDS, FIELD_TOPIC, compact_message, FieldPublisher
+
+PUBLISH_VOLATILE_FIELDS = ("timestamp", "update_age_text", "unit_body_json")
+
+# size of an MQTT 3.1.1 PUBLISH packet at qos 0
+def publish_bytes(topic, payload) :
+    remaining = 2 + len(topic.encode("utf-8")) + len(payload.encode("utf-8"))
+    length_bytes = 1
+    while remaining >= 128 ** length_bytes :
+        length_bytes += 1
+    return 1 + length_bytes + remaining
+
+# the status message get_unit_update builds for one cloud response
+def status_message(body, unit_mac, retrieval_ts) :
+    data = body["data"][0]
+    message = {"timestamp" : "{:d}".format(retrieval_ts)}
+    message["unit_update_ts"] = str(data["utcTimestamp"])
+    message["update_age_text"] = str(retrieval_ts - data["utcTimestamp"])
+    message["unit_model"] = data["modelId"]
+    message["home"] = "My Home"
+    message["room"] = "Room " + unit_mac[-2:]
+    message.update(decode_status(data))
+    message["unit_body_json"] = body
+    return message
+
+# the cloud responses one unit uploads over a day
+def unit_uploads(sample_body, upload_seconds, rng) :
+    body = copy.deepcopy(sample_body)
+    attributes = body["data"][0]["attributes"]
+    aq_value = 120
+    uploads = []
+    for ts in range(1760000000, 1760000000 + 86400, upload_seconds) :
+        if rng.random() < 0.7 :
+            aq_value = max(0, aq_value + rng.randint(-6, 6))
+        attributes["S08"] = str(aq_value)
+        attributes["S07"] = "01" if aq_value < 150 else ("02" if aq_value < 200 else "03")
+        if rng.random() < 0.02 :
+            attributes["A04"] = rng.choice(["01", "02", "03", "05"])
+        attributes["A21"] = str(3824 + (ts - 1760000000) // 3600)
+        body["data"][0]["utcTimestamp"] = ts
+        body["data"][0]["creationTime"] = ts * 1000
+        body["data"][0]["rssi"] = str(-36 - rng.randint(0, 4))
+        uploads.append(copy.deepcopy(body))
+    return uploads
+
+def run(profile, units, check_seconds, upload_seconds, heartbeat_seconds, sample_body) :
+    field_publisher = FieldPublisher()
+    packets = 0
+    total = 0
+    for unit in range(units) :
+        rng = random.Random(unit)
+        unit_mac = "aa:bb:cc:dd:ee:{:02x}".format(unit)
+        uploads = unit_uploads(sample_body, upload_seconds, rng)
+        last = None
+        for fetch_ts in range(1760000000 + check_seconds, 1760000000 + 86400, check_seconds) :
+            # the newest upload the cloud has at fetch time
+            body = uploads[min(len(uploads) - 1, (fetch_ts - 1760000000) // upload_seconds)]
+            message = status_message(body, unit_mac, fetch_ts)
+            state = {field : value for field, value in message.items() if field not in PUBLISH_VOLATILE_FIELDS}
+            heartbeat = False
+            if last is not None and (last["ts"] == message["unit_update_ts"] or last["state"] == state) :
+                if heartbeat_seconds <= 0 or fetch_ts - last["published_at"] < heartbeat_seconds :
+                    last["ts"] = message["unit_update_ts"]
+                    continue
+                heartbeat = True
+            last = {"ts" : message["unit_update_ts"], "state" : state, "published_at" : fetch_ts}
+
+            if profile == PAYLOAD_FIELDS :
+                for field, payload in field_publisher.changes(unit_mac, compact_message(message), force=heartbeat) :
+                    packets += 1
+                    total += publish_bytes("winix/" + unit_mac + FIELD_TOPIC + field, payload)
+            else :
+                if profile == PAYLOAD_COMPACT :
+                    payload = json.dumps(compact_message(message), separators=(",", ":"))
+                else :
+                    payload = json.dumps(message)
+                packets += 1
+                total += publish_bytes("winix/" + unit_mac, payload)
+    return packets, total
+
+def main() :
+    parser = argparse.ArgumentParser(description="winix-02 MQTT bytes per payload profile")
+    parser.add_argument("--units", type=int, default=8, help="number of units")
+    parser.add_argument("--check-minutes", type=float, default=5, help="check_interval, minutes between fetches of a unit")
+    parser.add_argument("--upload-minutes", type=float, default=5, help="minutes between a unit's uploads to the winix cloud")
+    parser.add_argument("--heartbeat-minutes", type=float, default=60, help="publish_heartbeat, 0 for none")
+    args = parser.parse_args()
+
+    sample_body = json.loads((REPO_DIRECTORY / "sample-retrieve.json").read_text())["body"]
+
+    results = {}
+    for profile in PAYLOAD_PROFILES :
+        results[profile] = run(profile, args.units, int(args.check_minutes * 60), int(args.upload_minutes * 60),
+            int(args.heartbeat_minutes * 60), sample_body)
+
+    full_bytes = results[PAYLOAD_PROFILES[0]][1]
+    print("{} units, one day".format(args.units))
+    print("{:<10} {:>10} {:>12} {:>14} {:>10}".format("profile", "packets", "bytes", "bytes/packet", "of full"))
+    for profile, (packets, total) in results.items() :
+        print("{:<10} {:>10d} {:>12d} {:>14.1f} {:>9.1%}".format(profile, packets, total, total / packets if packets else 0, total / full_bytes))
+
+if __name__ == '__main__':
+    main()
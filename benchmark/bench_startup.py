@@ -0,0 +1,186 @@
+#! /usr/bin/env python3
+#
+# bench_startup.py
+# 202610190300
+#
+# how long winix-02 takes to import and to start, and that importing it has no side effects
+#
+# every import is timed in a fresh python process, so nothing is already in sys.modules, the median of --repeat runs :
+#   python       : the interpreter starting and doing nothing, the floor under everything else
+#   modules      : import of winix_daemon and of each winix_* module on its own, the decoder and the winix cloud
+#                  client should cost a few milliseconds, not the whole daemon
+#   side effects : after importing winix_daemon, with WINIX_WORKING_DIRECTORY set to an empty temporary directory,
+#                  the directory must still be empty, no log file, and only the main thread may be running
+#   start        : winix-02.py run against the fake winix cloud and MQTT broker, time to its START message on
+#                  winix/$SYS/STATUS and to its first status request
+#
+# --importtime lists the modules winix_daemon pulls in that take the longest to import, from python -X importtime
+# --budget-ms exits 1 when the median import of winix_daemon takes longer, to catch a slow import being added
+#
+# usage : python3 benchmark/bench_startup.py [--repeat 5] [--budget-ms 300] [--units 20] [--importtime]
+#                                            [--json results.jsonl]
+#
+
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from fake_broker import FakeBroker
+from fake_cloud import FakeCloud, unit_key, unit_mac
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+
+# run in a fresh process, prints the import time in seconds, the threads running and what is in the working directory
+IMPORT_SCRIPT = """
+import json, os, sys, threading, time
+started = time.perf_counter()
+if sys.argv[1] :
+    __import__(sys.argv[1])
+seconds = time.perf_counter() - started
+print(json.dumps({"seconds" : seconds, "threads" : threading.active_count(), "files" : sorted(os.listdir(os.environ["WINIX_WORKING_DIRECTORY"]))}))
+"""
+
+def import_once(module, directory) :
+    environment = dict(os.environ, WINIX_WORKING_DIRECTORY=directory)
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT, module], cwd=str(REPO_DIRECTORY), env=environment,
+        check=True, stdout=subprocess.PIPE).stdout
+    result = json.loads(output)
+    result["process_seconds"] = time.perf_counter() - started
+    return result
+
+def time_import(module, repeat) :
+    runs = []
+    for n in range(repeat) :
+        with tempfile.TemporaryDirectory() as directory :
+            runs.append(import_once(module, directory))
+    return runs
+
+# the modules imported by winix_daemon that take the longest, (cumulative seconds, module)
+def slowest_imports(count) :
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import winix_daemon"], cwd=str(REPO_DIRECTORY),
+        check=True, stderr=subprocess.PIPE).stderr.decode()
+    imports = []
+    for line in stderr.splitlines() :
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit() :
+            continue
+        name = parts[2].rstrip()
+        # only the imports made directly by winix_daemon, or the top of the tree, not what they import in turn
+        if len(name) - len(name.lstrip()) <= 3 :
+            imports.append((int(parts[1]) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def write_config(directory, args, cloud, broker) :
+    units = {}
+    for n in range(args.units) :
+        units["U{:06d}".format(n)] = {"home" : "Bench", "room" : "Room {:d}".format(n % 20), "key" : unit_key(n), "mac_address" : unit_mac(n)}
+    config = {
+        "debug_level" : "INFO",
+        "mqtt" : "127.0.0.1",
+        "mqtt_port" : broker.port,
+        "mqtt_topic" : "winix",
+        "rsyslog" : "",
+        "publish_retain" : False,
+        "api_base_url" : cloud.base_url,
+        "api_requests_per_second" : 1000,
+        "metrics_interval" : 60,
+        "history_file" : "",
+        "units" : units,
+    }
+    (Path(directory) / "winix-02.yaml").write_text(yaml.safe_dump(config))
+
+# seconds from starting winix-02.py to its START message, and to its first status request
+def time_start(args) :
+    cloud = FakeCloud(args.units).start()
+    broker = FakeBroker().start()
+    started_at = []
+    broker.subscribe("winix/$SYS/STATUS", lambda topic, payload : started_at.append(time.perf_counter()) if json.loads(payload).get("status") == "START" else None)
+    try :
+        with tempfile.TemporaryDirectory() as directory :
+            write_config(directory, args, cloud, broker)
+            environment = dict(os.environ, WINIX_WORKING_DIRECTORY=directory)
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, str(REPO_DIRECTORY / "winix-02.py")], env=environment,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try :
+                deadline = time.perf_counter() + args.timeout
+                while (not started_at or cloud.status_requests == 0) and time.perf_counter() < deadline and process.poll() is None :
+                    time.sleep(0.005)
+                first_fetch = time.perf_counter() if cloud.status_requests else None
+            finally :
+                if process.poll() is None :
+                    process.send_signal(signal.SIGINT)
+                    try :
+                        process.wait(timeout=30)
+                    except subprocess.TimeoutExpired :
+                        process.kill()
+                        process.wait()
+    finally :
+        cloud.stop()
+        broker.stop()
+    if not started_at or first_fetch is None :
+        raise RuntimeError("winix-02 did not start within {:.0f} seconds".format(args.timeout))
+    return started_at[0] - started, first_fetch - started
+
+def main() :
+    parser = argparse.ArgumentParser(description="winix-02 import and start time, and import side effects")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes per import measured, the median is reported")
+    parser.add_argument("--budget-ms", type=float, default=0, help="exit 1 if importing winix_daemon takes longer, 0 for no budget")
+    parser.add_argument("--units", type=int, default=20, help="synthetic units for the start measurement")
+    parser.add_argument("--no-start", action="store_true", help="only measure the imports, not a start against the fakes")
+    parser.add_argument("--importtime", action="store_true", help="list the slowest imports of winix_daemon")
+    parser.add_argument("--timeout", type=float, default=60, help="give up on the start after this many seconds")
+    parser.add_argument("--json", help="append the results as a json line to this file")
+    args = parser.parse_args()
+
+    modules = ["winix_daemon"] + sorted(path.stem for path in REPO_DIRECTORY.glob("winix_*.py") if path.stem != "winix_daemon")
+    results = {}
+    failures = []
+
+    results["python_ms"] = statistics.median(run["process_seconds"] for run in time_import("", args.repeat)) * 1000
+    for module in modules :
+        runs = time_import(module, args.repeat)
+        results[module + "_ms"] = statistics.median(run["seconds"] for run in runs) * 1000
+        for run in runs :
+            if run["files"] :
+                failures.append("importing " + module + " wrote " + ", ".join(run["files"]) + " to the working directory")
+            if run["threads"] != 1 :
+                failures.append("importing " + module + " left " + str(run["threads"] - 1) + " threads running")
+    failures = sorted(set(failures))
+
+    if not args.no_start :
+        results["start_to_status_ms"], results["start_to_first_fetch_ms"] = (seconds * 1000 for seconds in time_start(args))
+
+    print("python {:d}.{:d}, median of {:d} fresh processes".format(sys.version_info.major, sys.version_info.minor, args.repeat))
+    for name, value in results.items() :
+        print("{:<32} {:>10.1f}".format(name, value))
+
+    if args.importtime :
+        print()
+        print("slowest imports of winix_daemon, cumulative")
+        for seconds, name in slowest_imports(10) :
+            print("{:<32} {:>10.1f}".format(name, seconds * 1000))
+
+    if args.budget_ms and results["winix_daemon_ms"] > args.budget_ms :
+        failures.append("importing winix_daemon took {:.1f} ms, the budget is {:.1f} ms".format(results["winix_daemon_ms"], args.budget_ms))
+
+    if args.json :
+        with open(args.json, "a") as results_file :
+            results_file.write(json.dumps({"time" : int(time.time()), "parameters" : vars(args), "results" : results, "failures" : failures}) + "\n")
+
+    for failure in failures :
+        print("FAIL : " + failure)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+#! /usr/bin/env python3
+#
+# fake_broker.py
+# 202610182000
+#
+# a small in-process MQTT 3.1.1 broker, for benchmarks
+#
+# enough of MQTT for winix-02 and its subscribers : connect, subscribe with + and # wildcards, unsubscribe,
+# publish at qos 0 and 1 (everything is delivered at qos 0), retained messages, last will, ping and disconnect.
+# no authentication, no persistent sessions
+#
+# code in the same process subscribes and publishes directly, without a network client :
+#   broker.subscribe("winix/#", callback)    callback(topic, payload bytes) runs on the publisher's thread
+#   broker.publish("winix/<mac>/control/power", "ON")
+#
+
+import socket
+import struct
+import threading
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# does an MQTT topic filter match a topic
+def topic_matches(pattern, topic) :
+    pattern_levels = pattern.split("/")
+    topic_levels = topic.split("/")
+    # wildcards at the first level don't match $ topics
+    if topic.startswith("$") and pattern_levels[0] in ("+", "#") :
+        return False
+    for i, level in enumerate(pattern_levels) :
+        if level == "#" :
+            return True
+        if i >= len(topic_levels) :
+            return False
+        if level != "+" and level != topic_levels[i] :
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+def encode_length(length) :
+    encoded = bytearray()
+    while True :
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length :
+            return bytes(encoded)
+
+def encode_string(text) :
+    data = text.encode("utf-8") if isinstance(text, str) else text
+    return struct.pack("!H", len(data)) + data
+
+def packet(packet_type, flags, body) :
+    return bytes([(packet_type << 4) | flags]) + encode_length(len(body)) + body
+
+class _Client :
+
+    def __init__(self, broker, connection) :
+        self.broker = broker
+        self.connection = connection
+        self.client_id = None
+        self.subscriptions = set()
+        self.will = None
+        self._send_lock = threading.Lock()
+
+    def send(self, data) :
+        try :
+            with self._send_lock :
+                self.connection.sendall(data)
+        except OSError :
+            pass
+
+    def deliver(self, topic, payload, retain=False) :
+        self.send(packet(PUBLISH, 0x01 if retain else 0x00, encode_string(topic) + payload))
+
+    def _read(self, count) :
+        data = bytearray()
+        while len(data) < count :
+            chunk = self.connection.recv(count - len(data))
+            if not chunk :
+                raise ConnectionError("client closed connection")
+            data.extend(chunk)
+        return bytes(data)
+
+    def _read_packet(self) :
+        header = self._read(1)[0]
+        length = 0
+        multiplier = 1
+        while True :
+            byte = self._read(1)[0]
+            length += (byte & 0x7f) * multiplier
+            multiplier *= 128
+            if not byte & 0x80 :
+                break
+        return header >> 4, header & 0x0f, self._read(length)
+
+    def run(self) :
+        clean = False
+        try :
+            while True :
+                packet_type, flags, body = self._read_packet()
+                if packet_type == CONNECT :
+                    self._connect(body)
+                elif packet_type == PUBLISH :
+                    self._publish(flags, body)
+                elif packet_type == SUBSCRIBE :
+                    self._subscribe(body)
+                elif packet_type == UNSUBSCRIBE :
+                    self._unsubscribe(body)
+                elif packet_type == PINGREQ :
+                    self.send(packet(PINGRESP, 0, b""))
+                elif packet_type == DISCONNECT :
+                    clean = True
+                    break
+        except (OSError, ConnectionError, IndexError, struct.error) :
+            pass
+        finally :
+            self.broker._remove(self)
+            self.connection.close()
+            if not clean and self.will is not None :
+                self.broker.publish(*self.will)
+
+    def _connect(self, body) :
+        position = 2 + struct.unpack("!H", body[0:2])[0]
+        connect_flags = body[position + 1]
+        position += 4
+        length = struct.unpack("!H", body[position:position + 2])[0]
+        self.client_id = body[position + 2:position + 2 + length].decode("utf-8")
+        position += 2 + length
+        if connect_flags & 0x04 :
+            length = struct.unpack("!H", body[position:position + 2])[0]
+            will_topic = body[position + 2:position + 2 + length].decode("utf-8")
+            position += 2 + length
+            length = struct.unpack("!H", body[position:position + 2])[0]
+            will_payload = body[position + 2:position + 2 + length]
+            self.will = (will_topic, will_payload, bool(connect_flags & 0x20))
+        self.send(packet(CONNACK, 0, b"\x00\x00"))
+
+    def _publish(self, flags, body) :
+        qos = (flags >> 1) & 0x03
+        length = struct.unpack("!H", body[0:2])[0]
+        topic = body[2:2 + length].decode("utf-8")
+        position = 2 + length
+        if qos :
+            packet_id = body[position:position + 2]
+            position += 2
+            self.send(packet(PUBACK, 0, packet_id))
+        self.broker.publish(topic, body[position:], bool(flags & 0x01))
+
+    def _subscribe(self, body) :
+        packet_id = body[0:2]
+        position = 2
+        patterns = []
+        while position < len(body) :
+            length = struct.unpack("!H", body[position:position + 2])[0]
+            patterns.append(body[position + 2:position + 2 + length].decode("utf-8"))
+            position += 3 + length
+        self.subscriptions.update(patterns)
+        self.send(packet(SUBACK, 0, packet_id + b"\x00" * len(patterns)))
+        for pattern in patterns :
+            for topic, payload in self.broker.retained(pattern) :
+                self.deliver(topic, payload, retain=True)
+
+    def _unsubscribe(self, body) :
+        packet_id = body[0:2]
+        position = 2
+        while position < len(body) :
+            length = struct.unpack("!H", body[position:position + 2])[0]
+            self.subscriptions.discard(body[position + 2:position + 2 + length].decode("utf-8"))
+            position += 2 + length
+        self.send(packet(UNSUBACK, 0, packet_id))
+
+class FakeBroker :
+
+    def __init__(self, port=0) :
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", port))
+        self._socket.listen(64)
+        self.port = self._socket.getsockname()[1]
+        self._clients = []
+        self._local = []
+        self._retained = {}
+        self._lock = threading.Lock()
+        self._stopped = False
+        # counters
+        self.published = 0
+        self.published_bytes = 0
+
+    def start(self) :
+        threading.Thread(target=self._accept, name="fake-broker", daemon=True).start()
+        return self
+
+    def _accept(self) :
+        while not self._stopped :
+            try :
+                connection, address = self._socket.accept()
+            except OSError :
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _Client(self, connection)
+            with self._lock :
+                self._clients.append(client)
+            threading.Thread(target=client.run, name="fake-broker-client", daemon=True).start()
+
+    def _remove(self, client) :
+        with self._lock :
+            if client in self._clients :
+                self._clients.remove(client)
+
+    # retained messages matching a topic filter
+    def retained(self, pattern) :
+        with self._lock :
+            return [(topic, payload) for topic, payload in self._retained.items() if topic_matches(pattern, topic)]
+
+    # publish to every network client and local subscriber whose filter matches
+    def publish(self, topic, payload, retain=False) :
+        if isinstance(payload, str) :
+            payload = payload.encode("utf-8")
+        with self._lock :
+            self.published += 1
+            self.published_bytes += len(topic) + len(payload)
+            if retain :
+                if payload :
+                    self._retained[topic] = payload
+                else :
+                    self._retained.pop(topic, None)
+            clients = [client for client in self._clients if any(topic_matches(pattern, topic) for pattern in client.subscriptions)]
+            local = [callback for pattern, callback in self._local if topic_matches(pattern, topic)]
+        for client in clients :
+            client.deliver(topic, payload)
+        for callback in local :
+            callback(topic, payload)
+
+    # subscribe code in this process, callback(topic, payload)
+    def subscribe(self, pattern, callback) :
+        with self._lock :
+            self._local.append((pattern, callback))
+        for topic, payload in self.retained(pattern) :
+            callback(topic, payload)
+
+    # number of network clients connected
+    def clients(self) :
+        with self._lock :
+            return len(self._clients)
+
+    def stop(self) :
+        self._stopped = True
+        self._socket.close()
+        with self._lock :
+            clients = list(self._clients)
+        for client in clients :
+            try :
+                client.connection.shutdown(socket.SHUT_RDWR)
+            except OSError :
+                pass
@@ -0,0 +1,190 @@
+#! /usr/bin/env python3
+#
+# fake_cloud.py
+# 202610182000
+#
+# a local stand in for the winix cloud api, for benchmarks
+#
+# serves the two endpoints winix-02 uses, for any number of synthetic units :
+#   GET /common/event/sttus/devices/<key>                     status, a body like sample-retrieve.json
+#   GET /common/control/devices/<key>/A211/<attribute>:<value> command, the unit takes the new value
+#
+# a unit's key is unit_key(n), its mac address unit_mac(n). air quality drifts between uploads, and a unit uploads
+# again upload_delay seconds after a command, so the next status read shows the new value. every response waits
+# latency seconds plus or minus a random jitter, and a fraction error_rate of requests gets a 500. a fraction tail_rate
+# of requests waits tail_latency seconds more, the slow tail a real cloud has
+#
+# keep-alive HTTP/1.1 on a thread per connection, like the real api behind its load balancer
+#
+# run on its own : python3 benchmark/fake_cloud.py --units 1000 --port 8080
+#
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+
+STATUS_PATH = "/common/event/sttus/devices/"
+COMMAND_PATH = "/common/control/devices/"
+
+# command values that differ from the value the unit then reports in its status
+COMMAND_TO_STATUS = {
+    "A03" : {"03" : "02"},
+    "A07" : {"01" : "1", "02" : "0"},
+}
+
+def unit_key(n) :
+    return "unit{:06d}_key".format(n)
+
+def unit_mac(n) :
+    return "02:00:00:{:02x}:{:02x}:{:02x}".format((n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+
+class FakeCloud :
+
+    def __init__(self, units, latency=0.0, jitter=0.0, error_rate=0.0, upload_delay=0.0, port=0, seed=1, tail_rate=0.0, tail_latency=0.0) :
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.upload_delay = upload_delay
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        sample = json.loads((REPO_DIRECTORY / "sample-retrieve.json").read_text())
+        self._template = sample["body"]["data"][0]
+        now = int(time.time())
+        # key -> {"attributes", "utcTimestamp", "pending" : [(due, attribute, value)]}
+        self.units = {}
+        for n in range(units) :
+            attributes = dict(self._template["attributes"])
+            attributes["S08"] = str(self._random.randint(60, 220))
+            self.units[unit_key(n)] = {"attributes" : attributes, "utcTimestamp" : now - self._random.randint(0, 300), "pending" : []}
+
+        # counters, and the time every status request arrived, for the harness, errors included
+        self.status_requests = 0
+        self.command_requests = 0
+        self.errors = 0
+        self.status_times = []
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.base_url = "http://127.0.0.1:{:d}/".format(self.port)
+        self._thread = None
+
+    def _handler_class(self) :
+        cloud = self
+
+        class Handler(BaseHTTPRequestHandler) :
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) :
+                status, body = cloud.handle(self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args) :
+                pass
+
+        return Handler
+
+    # (http status, json body) for a request path
+    def handle(self, path) :
+        with self._lock :
+            if path.startswith(STATUS_PATH) :
+                self.status_requests += 1
+                self.status_times.append(time.time())
+            elif path.startswith(COMMAND_PATH) :
+                self.command_requests += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            if self._random.random() < self.tail_rate :
+                delay += self.tail_latency
+            fail = self._random.random() < self.error_rate
+        if delay :
+            time.sleep(delay)
+        if fail :
+            with self._lock :
+                self.errors += 1
+            return 500, {"statusCode" : 500, "headers" : {"resultCode" : "E500", "resultMessage" : "fake error"}}
+
+        if path.startswith(STATUS_PATH) :
+            return self.status(path[len(STATUS_PATH):])
+        if path.startswith(COMMAND_PATH) :
+            parts = path[len(COMMAND_PATH):].split("/")
+            if len(parts) == 3 and ":" in parts[2] :
+                attribute, value = parts[2].split(":", 1)
+                return self.command(parts[0], attribute, value)
+        return 404, {"statusCode" : 404}
+
+    def status(self, key) :
+        now = time.time()
+        with self._lock :
+            unit = self.units.get(key)
+            if unit is None :
+                return 404, {"statusCode" : 404}
+            # commands the unit has uploaded since
+            for due, attribute, value in list(unit["pending"]) :
+                if due <= now :
+                    unit["attributes"][attribute] = value
+                    unit["utcTimestamp"] = max(unit["utcTimestamp"] + 1, int(now))
+                    unit["pending"].remove((due, attribute, value))
+            # the unit uploads about once a minute, with a new air quality reading
+            if now - unit["utcTimestamp"] >= 60 :
+                unit["utcTimestamp"] = int(now)
+                unit["attributes"]["S08"] = str(max(0, int(unit["attributes"]["S08"]) + self._random.randint(-5, 5)))
+            data = dict(self._template)
+            data["attributes"] = dict(unit["attributes"])
+            data["utcTimestamp"] = unit["utcTimestamp"]
+            data["creationTime"] = unit["utcTimestamp"] * 1000
+        body = {"deviceId" : key, "totalCnt" : 1, "data" : [data]}
+        return 200, {"statusCode" : 200, "headers" : {"resultCode" : "S100", "resultMessage" : ""}, "body" : body}
+
+    def command(self, key, attribute, value) :
+        with self._lock :
+            unit = self.units.get(key)
+            if unit is None :
+                return 404, {"statusCode" : 404}
+            value = COMMAND_TO_STATUS.get(attribute, {}).get(value, value)
+            unit["pending"].append((time.time() + self.upload_delay, attribute, value))
+        return 200, {"statusCode" : 200, "headers" : {"resultCode" : "S100", "resultMessage" : ""}, "body" : {"deviceId" : key}}
+
+    def start(self) :
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-cloud", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) :
+        self.server.shutdown()
+        self.server.server_close()
+
+def main() :
+    parser = argparse.ArgumentParser(description="local stand in for the winix cloud api")
+    parser.add_argument("--units", type=int, default=100, help="number of synthetic units")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--latency-ms", type=float, default=50, help="response latency")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="random jitter added to the latency, plus or minus")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of requests that are slow")
+    parser.add_argument("--tail-ms", type=float, default=0.0, help="extra latency of a slow request")
+    args = parser.parse_args()
+
+    cloud = FakeCloud(args.units, args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, port=args.port,
+        tail_rate=args.tail_rate, tail_latency=args.tail_ms / 1000)
+    print("fake winix cloud on " + cloud.base_url + " with {:d} units, unit 0 key {} mac {}".format(args.units, unit_key(0), unit_mac(0)))
+    try :
+        cloud.server.serve_forever()
+    except KeyboardInterrupt :
+        cloud.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#
+# test_message_to_unit.py
+# 202610191000
+#
+# a control message with optimistic state is predicted before it is handed to the command dispatcher, so a command
+# sent, and expect()ed, by a worker before submit() returns is still tracked as sent and can be confirmed
+#
+# usage : python3 -m pytest tests, or python3 -m unittest discover tests
+#
+
+import sys
+import types
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import winix_daemon
+from winix_command import CommandDispatcher
+from winix_confirm import CommandTracker
+
+UNIT_MAC = "aa:bb:cc:dd:ee:ff"
+
+# a dispatcher that sends the command before submit() returns, what a worker can do with no debounce
+class SendingDispatcher :
+
+    def __init__(self, tracker) :
+        self._tracker = tracker
+
+    def submit(self, key, value) :
+        self._tracker.expect(key, winix_daemon.command_status_value(key[1], value))
+        return True
+
+class MessageToUnitTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.tracker = CommandTracker(lambda unit_mac : None, first_delay=60, timeout=60)
+        self.addCleanup(self.tracker.shutdown)
+        self.saved = (winix_daemon.settings, winix_daemon.services)
+        self.addCleanup(self.restore)
+        winix_daemon.settings = types.SimpleNamespace(MQTT_TOPIC_BASE="winix/", UNITS_BY_MAC={UNIT_MAC : "SB01"}, OPTIMISTIC_STATE=True)
+        winix_daemon.services = types.SimpleNamespace(owned_units={UNIT_MAC}, command_tracker=self.tracker)
+
+    def restore(self) :
+        winix_daemon.settings, winix_daemon.services = self.saved
+
+    def control(self, control, text) :
+        msg = types.SimpleNamespace(topic="winix/" + UNIT_MAC + "/control/" + control, payload=text.encode("utf-8"), qos=0)
+        winix_daemon.message_to_unit(None, None, msg)
+
+    def test_sent_before_submit_returns(self) :
+        winix_daemon.services.command_dispatcher = SendingDispatcher(self.tracker)
+        self.control("fan_speed", "75")
+        self.assertEqual(self.tracker.stats()["replaced"], 0)
+        self.assertEqual(self.tracker.observe(UNIT_MAC, {"A04" : "03"}), [(UNIT_MAC, "A04")])
+        self.assertEqual(self.tracker.stats()["pending"], 0)
+
+    def test_refused_submit_discards_prediction(self) :
+        dispatcher = CommandDispatcher(lambda key, value : None, debounce=0)
+        dispatcher.shutdown()
+        winix_daemon.services.command_dispatcher = dispatcher
+        self.control("fan_speed", "75")
+        self.assertEqual(self.tracker.expected(UNIT_MAC), {})
+
+if __name__ == "__main__" :
+    unittest.main()
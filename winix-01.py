@@ -36,6 +36,7 @@ import paho.mqtt.client as mqtt
 import time
 from datetime import datetime
 from dateutil import tz
+from winix_decode import get_decoder
 import logging
 import logging.handlers
 
@@ -113,17 +114,7 @@ def main():
     GET_STATUS_URL = "https://us.api.winix-iot.com/common/event/sttus/devices/"
     COMMAND_URL = "https://us.api.winix-iot.com/common/control/devices/"
 
-    # map of topics in the returned JSON
-
-    POWER = {"COMMAND" : "A02", "ON" : "1", "OFF" : "0"}
-    OPERATION_MODE = {"COMMAND" : "A03", "AUTO" : "01", "MANUAL" : "02"}
-    PLASMAWAVE = {"COMMAND" : "A07", "ON" : "1", "OFF" : "0"}
-    FAN_SPEED = {"COMMAND" : "A04", "100" : "05", "75" : "03", "50" : "02", "25" : "01", "SLEEP" : "06"}
-    SLEEP = {"COMMAND" : "A04", "SLEEP" : "06"}
-    AIR_QUALITY = {"COMMAND" : "S07", "GOOD" : "01", "FAIR" : "02", "POOR" : "03"}
-    FILTER_HOURS = {"COMMAND" : "A21"}
-    AMBIENT_LIGHT = {"COMMAND" : "S14"}
-    AIR_QUALITY_VALUE = {"COMMAND" : "S08"}
+    # the map of attributes in the returned JSON is in winix_decode.py, shared with winix-02.py
 
     # keep track of transition to new day at midnight local time
 
@@ -177,8 +168,11 @@ def main():
 
                 unit_rssi = unit_data_json[0].get("rssi")
 
+                # lookup tables for this model's attributes
+                decoder = get_decoder(unit_model)
+
                 unit_power_ordinal = unit_attributes_json.get("A02")
-                unit_power_text = list(POWER.keys())[list(POWER.values()).index(unit_power_ordinal)]
+                unit_power_text = decoder.text("power", unit_power_ordinal)
                 if unit_power_text == "OFF" :
                     unit_is_off = True
                 else :
@@ -211,8 +205,8 @@ def main():
 
                     # get attributes of current state in cloud for unit
                     air_quality_ordinal = unit_attributes_json.get("S07")
-                    # do a value loop to find they key
-                    air_quality_text = list(AIR_QUALITY.keys())[list(AIR_QUALITY.values()).index(air_quality_ordinal)]
+                    # look up the text for the code
+                    air_quality_text = decoder.text("air_quality", air_quality_ordinal)
 
                     air_quality_value = unit_attributes_json.get("S08")
 
@@ -223,13 +217,13 @@ def main():
                         unit_sleeping_text = "NO"
 
                     unit_plasmawave_ordinal = unit_attributes_json.get("A07")
-                    unit_plasmawave_text = list(PLASMAWAVE.keys())[list(PLASMAWAVE.values()).index(unit_plasmawave_ordinal)]
+                    unit_plasmawave_text = decoder.text("plasmawave", unit_plasmawave_ordinal)
 
                     unit_mode_ordinal = unit_attributes_json.get("A03")
-                    unit_mode_text = list(OPERATION_MODE.keys())[list(OPERATION_MODE.values()).index(unit_mode_ordinal)]
+                    unit_mode_text = decoder.text("mode", unit_mode_ordinal)
 
                     unit_fan_speed_ordinal = unit_attributes_json.get("A04")
-                    unit_fan_speed_text = list(FAN_SPEED.keys())[list(FAN_SPEED.values()).index(unit_fan_speed_ordinal)]
+                    unit_fan_speed_text = decoder.text("fan_speed", unit_fan_speed_ordinal)
 
                     unit_filter_hours = unit_attributes_json.get("A21")
 
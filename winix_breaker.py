@@ -0,0 +1,124 @@
+#
+# winix_breaker.py
+# 202610190000
+#
+# circuit breakers, so a unit or a winix cloud that keeps failing is left alone for a while instead of being asked again
+# on every poll
+#
+# a breaker is closed while requests succeed. failures consecutive failures open it, and while it is open allow()
+# refuses every request. after reset seconds it is half open, and allow() lets exactly one request through as a probe,
+# success closes the breaker, failure opens it again for twice as long as before, up to max_reset. every open time is
+# jittered by plus or minus jitter, so breakers that opened together, in an outage, don't all probe at the same moment
+#
+# winix-02 keeps one breaker per unit, for a unit with a bad key or that the cloud has lost, and one for the winix
+# cloud as a whole, for an outage, which only counts the errors that say the cloud itself is in trouble
+#
+
+import random
+import threading
+import time
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+# a request not made because a breaker is open
+class CircuitOpenError(Exception) :
+
+    def __init__(self, name, retry_in) :
+        super().__init__("circuit breaker open : " + name + " , next try in " + "{:.0f}".format(retry_in) + " seconds")
+        self.name = name
+        self.retry_in = retry_in
+
+class CircuitBreaker :
+
+    # on_change(breaker, old state, new state) is called when the breaker opens or closes, without the lock held
+    def __init__(self, name, failures=3, reset=60.0, max_reset=1800.0, jitter=0.2, on_change=None) :
+        self.name = name
+        self.failures = max(1, int(failures))
+        self.reset = float(reset)
+        self.max_reset = max(float(max_reset), self.reset)
+        self.jitter = float(jitter)
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._state = BREAKER_CLOSED
+        self._consecutive = 0
+        # times opened in a row without closing, doubles the open time
+        self._opens = 0
+        self._open_until = 0.0
+        self._probing = False
+        # counters
+        self.trips = 0
+        self.rejected = 0
+
+    # the state, an open breaker whose time is up is half open
+    def state(self, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            return self._current(now)
+
+    # caller holds the lock
+    def _current(self, now) :
+        if self._state == BREAKER_OPEN and now >= self._open_until :
+            self._state = BREAKER_HALF_OPEN
+            self._probing = False
+        return self._state
+
+    # may a request go ahead, a half open breaker lets one probe through until its outcome is recorded
+    def allow(self, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            state = self._current(now)
+            if state == BREAKER_CLOSED :
+                return True
+            if state == BREAKER_HALF_OPEN and not self._probing :
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    # seconds until an open breaker lets a probe through, 0 when it would now
+    def retry_in(self, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            if self._current(now) != BREAKER_OPEN :
+                return 0.0
+            return self._open_until - now
+
+    # a request allow() let through was not made after all, another breaker refused it, or its answer was not used
+    def cancel(self) :
+        with self._lock :
+            self._probing = False
+
+    def record_success(self) :
+        with self._lock :
+            old = self._state
+            self._state = BREAKER_CLOSED
+            self._consecutive = 0
+            self._opens = 0
+            self._probing = False
+        if old != BREAKER_CLOSED and self._on_change is not None :
+            self._on_change(self, old, BREAKER_CLOSED)
+
+    def record_failure(self, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            old = self._current(now)
+            self._consecutive += 1
+            if old == BREAKER_OPEN or (old == BREAKER_CLOSED and self._consecutive < self.failures) :
+                return
+            # a failed probe, or one failure too many, opens the breaker
+            self._opens += 1
+            self.trips += 1
+            open_seconds = min(self.max_reset, self.reset * 2 ** min(self._opens - 1, 16))
+            self._open_until = now + open_seconds * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+            self._state = BREAKER_OPEN
+            self._probing = False
+        if self._on_change is not None :
+            self._on_change(self, old, BREAKER_OPEN)
+
+    # snapshot of the counters
+    def stats(self) :
+        with self._lock :
+            return {"state" : self._current(time.monotonic()), "consecutive_failures" : self._consecutive,
+                "trips" : self.trips, "rejected" : self.rejected}
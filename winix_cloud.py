@@ -0,0 +1,337 @@
+#
+# winix_cloud.py
+# 202610180900
+#
+# helpers for talking to the winix cloud api from winix-02.py
+# a token bucket to keep us inside the api request quota, a small fetch engine that keeps
+# several unit requests in flight at once instead of one blocking request followed by a fixed sleep,
+# and a keep-alive connection pool shared by the status and command requests
+#
+# every request has a deadline, connect_timeout for the connection and tls handshake and timeout for each read of the
+# answer, so one connection the cloud never answers on can't hold up a worker, and through it the units behind it.
+# the latency tracker keeps recent request times for tail latency stats, and the hedger uses them to send a second
+# copy of a request that is taking longer than most do, the first answer is used
+#
+
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+# error returned by the winix cloud, an http status of 400 or above
+class CloudError(Exception) :
+
+    def __init__(self, status, reason, url) :
+        super().__init__("HTTP " + str(status) + " " + str(reason) + " : " + url)
+        self.status = status
+        self.reason = reason
+        self.url = url
+
+# token bucket rate limiter
+# rate is the number of requests per second we allow on average, burst is how many requests can go
+# out back to back after an idle period. acquire() blocks the calling thread until a token is available
+
+class TokenBucket :
+
+    def __init__(self, rate, burst=1) :
+        if rate <= 0 :
+            raise ValueError("token bucket rate must be greater than zero : " + str(rate))
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    # add the tokens earned since the last refill, capped at the burst size, caller holds the lock
+    def _refill(self, now) :
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    # take a token without waiting, returns False if the bucket is empty
+    def try_acquire(self) :
+        with self._lock :
+            self._refill(time.monotonic())
+            if self._tokens >= 1.0 :
+                self._tokens -= 1.0
+                return True
+            return False
+
+    # take a token, sleeping until one is available, returns the number of seconds spent waiting
+    def acquire(self) :
+        waited = 0.0
+        while True :
+            with self._lock :
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1.0 :
+                    self._tokens -= 1.0
+                    return waited
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+# fetch engine
+# a thread pool with a hard cap on the number of requests in flight. submit() blocks the caller once
+# max_concurrency jobs are running, so the update queue is drained only as fast as the api lets us,
+# and work that is still queued can be coalesced or reprioritised rather than piling up in the pool
+
+class FetchEngine :
+
+    def __init__(self, max_concurrency, name="winix-fetch") :
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+
+    # wait for a free slot then run fn(*args) on a worker thread
+    # exceptions raised by fn are left on the returned future, the worker thread keeps running
+    def submit(self, fn, *args) :
+        self._slots.acquire()
+        with self._lock :
+            self.in_flight += 1
+            self.submitted += 1
+        try :
+            future = self._executor.submit(fn, *args)
+        except Exception :
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future) :
+        with self._lock :
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    # stop accepting work, optionally waiting for requests already in flight
+    def shutdown(self, wait=True) :
+        self._executor.shutdown(wait=wait)
+
+# keep-alive connection pool
+# every request to the winix cloud used to open a new connection, paying dns, tcp and tls handshakes each time.
+# the pool keeps idle connections to the api host open and hands them out again, at most max_connections
+# are open at once, callers wait for one to come free. the tls context is built once and shared
+# http.client and ssl are imported by the first pool made, they take longer to import than the rest of the module, and
+# the token bucket, fetch engine and latency tracker don't need them
+
+class ConnectionPool :
+
+    # timeout is the read timeout in seconds, connect_timeout the connect and handshake timeout, which defaults to it
+    def __init__(self, base_url, max_connections, timeout=None, connect_timeout=None) :
+        global http, ssl
+        import http.client
+        import ssl
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https") :
+            raise ValueError("unsupported url scheme for connection pool : " + base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.netloc = parts.netloc
+        self.max_connections = max(1, int(max_connections))
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout if connect_timeout is not None else timeout
+        self._ssl_context = ssl.create_default_context() if self.scheme == "https" else None
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._idle = []
+        self._lock = threading.Lock()
+        # counters
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.connections_dropped = 0
+
+    def _new_connection(self) :
+        with self._lock :
+            self.connections_opened += 1
+        if self.scheme == "https" :
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+
+    def _close(self, connection) :
+        with self._lock :
+            self.connections_dropped += 1
+        connection.close()
+
+    # send one GET on a connection and read the whole body, so the connection can be used again
+    # a new connection is opened within the connect timeout, then every read waits at most timeout seconds
+    def _send(self, connection, path, timeout) :
+        if connection.sock is None :
+            connection.connect()
+        connection.sock.settimeout(timeout)
+        connection.request("GET", path, headers={"Connection" : "keep-alive", "Accept" : "application/json"})
+        response = connection.getresponse()
+        body = response.read()
+        return response, body
+
+    # GET a url on the pooled host and decode the json body, timeout overrides the pool's read timeout
+    def get_json(self, url, timeout=None) :
+        parts = urlsplit(url)
+        if parts.netloc != self.netloc :
+            raise ValueError("url is not on pooled host " + self.netloc + " : " + url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        timeout = timeout if timeout is not None else self.timeout
+
+        self._slots.acquire()
+        try :
+            with self._lock :
+                self.requests += 1
+                connection = self._idle.pop() if self._idle else None
+                if connection is not None :
+                    self.connections_reused += 1
+            if connection is None :
+                connection = self._new_connection()
+                reused = False
+            else :
+                reused = True
+
+            try :
+                response, body = self._send(connection, path, timeout)
+            except (http.client.HTTPException, ConnectionError) :
+                self._close(connection)
+                # the server may have closed an idle keep-alive connection, retry once on a fresh one
+                if not reused :
+                    raise
+                connection = self._new_connection()
+                try :
+                    response, body = self._send(connection, path, timeout)
+                except Exception :
+                    self._close(connection)
+                    raise
+            except Exception :
+                self._close(connection)
+                raise
+
+            if response.will_close :
+                self._close(connection)
+            else :
+                with self._lock :
+                    self._idle.append(connection)
+
+            if response.status >= 400 :
+                raise CloudError(response.status, response.reason, url)
+
+            return json.loads(body.decode())
+        finally :
+            self._slots.release()
+
+    # snapshot of the counters, reuse rate is the fraction of requests that did not need a new connection
+    def stats(self) :
+        with self._lock :
+            return {
+                "requests" : self.requests,
+                "connections_opened" : self.connections_opened,
+                "connections_reused" : self.connections_reused,
+                "connections_dropped" : self.connections_dropped,
+                "connections_idle" : len(self._idle),
+                "reuse_rate" : (self.connections_reused / self.requests) if self.requests else 0.0,
+            }
+
+    # close all idle connections
+    def close(self) :
+        with self._lock :
+            idle, self._idle = self._idle, []
+        for connection in idle :
+            connection.close()
+
+# recent request latencies, for percentiles
+# keeps the last window latencies, a percentile is None until there are min_samples of them
+
+class LatencyTracker :
+
+    def __init__(self, window=256, min_samples=20) :
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._sorted = None
+
+    def observe(self, seconds) :
+        with self._lock :
+            self._latencies.append(seconds)
+            self._sorted = None
+
+    # the latency percent of the recent requests took no longer than
+    def percentile(self, percent) :
+        with self._lock :
+            if len(self._latencies) < self.min_samples :
+                return None
+            if self._sorted is None :
+                self._sorted = sorted(self._latencies)
+            ordered = self._sorted
+        return ordered[min(len(ordered) - 1, max(0, -(-percent * len(ordered) // 100) - 1))]
+
+    def count(self) :
+        with self._lock :
+            return len(self._latencies)
+
+# hedged requests
+# call(fn) runs fn on one of the hedger's threads and waits for it. if it has not returned within the percent
+# percentile of the latencies of earlier calls, and may_hedge() agrees, a second copy of fn is started and the
+# first of the two to return is used, the other is left to finish on its own. only for requests that are safe
+# to make twice, a status read, not a command. a call that fails is not counted in the latencies, so a burst of
+# timeouts doesn't teach it to wait longer before hedging
+
+class Hedger :
+
+    def __init__(self, max_workers, percent=95, min_delay=0.05, window=256, min_samples=20, name="winix-hedge") :
+        self.percent = percent
+        self.min_delay = min_delay
+        self.latencies = LatencyTracker(window, min_samples)
+        self._executor = ThreadPoolExecutor(max_workers=max(2, int(max_workers)), thread_name_prefix=name)
+        self._lock = threading.Lock()
+        # counters
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_won = 0
+
+    # seconds a call waits before it is hedged, None while there are too few latencies to tell
+    def delay(self) :
+        percentile = self.latencies.percentile(self.percent)
+        return None if percentile is None else max(self.min_delay, percentile)
+
+    def _timed(self, fn) :
+        start = time.monotonic()
+        result = fn()
+        self.latencies.observe(time.monotonic() - start)
+        return result
+
+    def call(self, fn, may_hedge=None) :
+        with self._lock :
+            self.calls += 1
+        delay = self.delay()
+        first = self._executor.submit(self._timed, fn)
+        if delay is None :
+            return first.result()
+        done, not_done = wait([first], timeout=delay)
+        if done or (may_hedge is not None and not may_hedge()) :
+            return first.result()
+
+        with self._lock :
+            self.hedged += 1
+        second = self._executor.submit(self._timed, fn)
+        futures = [first, second]
+        while futures :
+            done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done :
+                if future.exception() is None :
+                    if future is second :
+                        with self._lock :
+                            self.hedge_won += 1
+                    return future.result()
+            futures = list(not_done)
+        # both failed, the first one's error is the one that counts
+        return first.result()
+
+    # snapshot of the counters
+    def stats(self) :
+        with self._lock :
+            return {"calls" : self.calls, "hedged" : self.hedged, "hedge_won" : self.hedge_won, "delay" : self.delay()}
+
+    def shutdown(self, wait=True) :
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,125 @@
+#
+# winix_command.py
+# 202610181500
+#
+# send control commands to the winix cloud off the MQTT network thread
+#
+# a command is keyed by unit and attribute, (mac, "A04") for example. it waits debounce seconds before it is sent,
+# and a newer value for the same key replaces the waiting one and restarts the wait, so a slider in home assistant
+# that fires fan_speed 25, 50, 75, 100 within a second sends only 100. a value is never held back longer than
+# max_delay seconds from the first one, however fast new values arrive
+#
+# commands are sent by a small pool of worker threads, never by the thread that submitted them. only one command
+# per key is in flight at a time, so an older value can't overtake a newer one on another worker
+#
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class CommandDispatcher :
+
+    # send(key, value) is called on a worker thread, exceptions it raises are passed to on_error(key, value, exception)
+    def __init__(self, send, max_workers=2, debounce=0.5, max_delay=None, on_error=None, name="winix-command") :
+        self._send = send
+        self._on_error = on_error
+        self.debounce = max(0.0, float(debounce))
+        self.max_delay = float(max_delay) if max_delay is not None else self.debounce * 4
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix=name)
+        # key -> [value, due time, time first value arrived]
+        self._pending = {}
+        self._in_flight = set()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition(threading.Lock())
+        self._stopped = False
+        # counters
+        self.submitted = 0
+        self.debounced = 0
+        self.sent = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name=name + "-dispatch", daemon=True)
+        self._thread.start()
+
+    # queue a command, returns False if it replaced a value that was still waiting for the same key
+    # raises RuntimeError once the dispatcher has been shut down, like the worker pool
+    def submit(self, key, value) :
+        now = time.monotonic()
+        with self._condition :
+            if self._stopped :
+                raise RuntimeError("command dispatcher has been shut down")
+            self.submitted += 1
+            pending = self._pending.get(key)
+            if pending is not None :
+                self.debounced += 1
+                pending[0] = value
+                pending[1] = min(now + self.debounce, pending[2] + self.max_delay)
+                replaced = True
+            else :
+                pending = [value, now + self.debounce, now]
+                self._pending[key] = pending
+                replaced = False
+            heapq.heappush(self._heap, (pending[1], next(self._sequence), key))
+            self._condition.notify()
+        return not replaced
+
+    # dispatcher thread, hands commands whose wait is over to the worker pool
+    def _run(self) :
+        with self._condition :
+            while not self._stopped :
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now :
+                    due, sequence, key = heapq.heappop(self._heap)
+                    pending = self._pending.get(key)
+                    # stale heap entry, the value was replaced and rescheduled, or already sent
+                    if pending is None or pending[1] != due :
+                        continue
+                    # a command for this key is still being sent, it is rescheduled when that one finishes
+                    if key in self._in_flight :
+                        continue
+                    del self._pending[key]
+                    self._in_flight.add(key)
+                    self._executor.submit(self._deliver, key, pending[0])
+                timeout = (self._heap[0][0] - now) if self._heap else None
+                self._condition.wait(timeout)
+
+    # worker thread
+    def _deliver(self, key, value) :
+        try :
+            self._send(key, value)
+            with self._condition :
+                self.sent += 1
+        except Exception as e :
+            with self._condition :
+                self.failed += 1
+            if self._on_error is not None :
+                self._on_error(key, value, e)
+        finally :
+            with self._condition :
+                self._in_flight.discard(key)
+                pending = self._pending.get(key)
+                if pending is not None :
+                    heapq.heappush(self._heap, (pending[1], next(self._sequence), key))
+                    self._condition.notify()
+
+    # snapshot of the counters
+    def stats(self) :
+        with self._condition :
+            return {
+                "submitted" : self.submitted,
+                "debounced" : self.debounced,
+                "sent" : self.sent,
+                "failed" : self.failed,
+                "waiting" : len(self._pending),
+                "in_flight" : len(self._in_flight),
+            }
+
+    # stop dispatching, commands still waiting are dropped
+    def shutdown(self, wait=True) :
+        with self._condition :
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,177 @@
+#
+# winix_confirm.py
+# 202610182300
+#
+# wait for the winix cloud to show that a control command took effect
+#
+# the cloud takes a command straight away, but the unit has to act on it and upload its new status before a status
+# read shows the change, a few seconds and sometimes much longer. a single refresh right after the command mostly
+# reads the old status, and home assistant then shows the old state until the next scheduled poll
+#
+# the tracker remembers the status value each command should lead to, keyed by unit and attribute like the command
+# dispatcher, (mac, "A04") for example, and asks for the unit to be polled again first_delay seconds after the command,
+# then twice as long after that each time, up to max_interval, until a status shows the value or timeout seconds
+# have passed. a newer command for the same unit and attribute replaces the one being waited on
+#
+# the re-polls are asked for by calling repoll(unit_mac), and are made on the tracker's own thread, like the
+# command dispatcher's. on_confirmed(key, value, seconds) and on_timeout(key, value, seconds) are called with what
+# happened to each command, seconds is from the command being sent
+#
+# with optimistic state, a command is predicted before it is sent, while it waits out the debounce. the predicted
+# value is held as pending, so expected() includes it, but it can't be confirmed or re-polled for until expect() is
+# called when the command is sent, or it is dropped by discard() if the command could not be sent
+#
+
+import heapq
+import itertools
+import threading
+import time
+
+class _Pending :
+
+    __slots__ = ("value", "sent", "since", "deadline", "due", "delay")
+
+    # since is when the command was sent, or predicted if it has not been sent yet
+    def __init__(self, value, sent, since, deadline, due, delay) :
+        self.value = value
+        self.sent = sent
+        self.since = since
+        self.deadline = deadline
+        self.due = due
+        self.delay = delay
+
+class CommandTracker :
+
+    def __init__(self, repoll, first_delay=1.0, max_interval=15.0, timeout=60.0, on_confirmed=None, on_timeout=None, name="winix-confirm") :
+        self._repoll = repoll
+        self._on_confirmed = on_confirmed
+        self._on_timeout = on_timeout
+        self.first_delay = max(0.0, float(first_delay))
+        self.max_interval = max(float(max_interval), self.first_delay)
+        self.timeout = float(timeout)
+        # (unit_mac, attribute) -> _Pending
+        self._pending = {}
+        # (due, sequence, key), entries whose due no longer matches the pending command are skipped
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition(threading.Lock())
+        self._stopped = False
+        # counters
+        self.tracked = 0
+        self.replaced = 0
+        self.confirmed = 0
+        self.timed_out = 0
+        self.repolls = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # a command has been sent, value is the raw status value the unit reports once it has taken it
+    def expect(self, key, value) :
+        now = time.monotonic()
+        with self._condition :
+            self.tracked += 1
+            previous = self._pending.get(key)
+            if previous is not None and previous.sent :
+                self.replaced += 1
+            pending = _Pending(value, True, now, now + self.timeout, now + self.first_delay, self.first_delay)
+            self._pending[key] = pending
+            heapq.heappush(self._heap, (pending.due, next(self._sequence), key))
+            self._condition.notify()
+
+    # a command is waiting to be sent, hold its value as pending until expect() or discard() is called for it
+    # it is given up on after timeout seconds if neither is
+    def predict(self, key, value) :
+        now = time.monotonic()
+        with self._condition :
+            # a sent command still waiting to show is replaced by this one, as in expect()
+            previous = self._pending.get(key)
+            if previous is not None and previous.sent :
+                self.replaced += 1
+            pending = _Pending(value, False, now, now + self.timeout, now + self.timeout, self.first_delay)
+            self._pending[key] = pending
+            heapq.heappush(self._heap, (pending.due, next(self._sequence), key))
+            self._condition.notify()
+
+    # a command could not be sent, stop waiting for it, unless a newer value has been predicted or sent since
+    def discard(self, key, value) :
+        with self._condition :
+            pending = self._pending.get(key)
+            if pending is not None and pending.value == value :
+                del self._pending[key]
+
+    # a status has been read for a unit, attributes is the raw attributes from the cloud
+    # returns the keys of the commands it confirmed
+    def observe(self, unit_mac, attributes) :
+        now = time.monotonic()
+        confirmed = []
+        with self._condition :
+            for key, pending in list(self._pending.items()) :
+                if key[0] == unit_mac and pending.sent and attributes.get(key[1]) == pending.value :
+                    del self._pending[key]
+                    self.confirmed += 1
+                    confirmed.append((key, pending.value, now - pending.since))
+        if self._on_confirmed is not None :
+            for key, value, seconds in confirmed :
+                self._on_confirmed(key, value, seconds)
+        return [key for key, value, seconds in confirmed]
+
+    # {attribute : value} of the commands for a unit still waiting to show in its status, predicted or sent
+    def expected(self, unit_mac) :
+        with self._condition :
+            return {key[1] : pending.value for key, pending in self._pending.items() if key[0] == unit_mac}
+
+    # tracker thread, asks for the re-polls that are due and gives up on the commands past their deadline
+    def _run(self) :
+        while True :
+            repolls = []
+            timeouts = []
+            with self._condition :
+                if self._stopped :
+                    return
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now :
+                    due, sequence, key = heapq.heappop(self._heap)
+                    pending = self._pending.get(key)
+                    # stale heap entry, the command was confirmed, replaced or already rescheduled
+                    if pending is None or pending.due != due :
+                        continue
+                    if now >= pending.deadline :
+                        del self._pending[key]
+                        self.timed_out += 1
+                        timeouts.append((key, pending.value, now - pending.since))
+                        continue
+                    self.repolls += 1
+                    if key[0] not in repolls :
+                        repolls.append(key[0])
+                    # never wait past the deadline, the command is given up on then
+                    pending.due = min(now + pending.delay, pending.deadline)
+                    pending.delay = min(pending.delay * 2, self.max_interval)
+                    heapq.heappush(self._heap, (pending.due, next(self._sequence), key))
+                if not repolls and not timeouts :
+                    self._condition.wait((self._heap[0][0] - now) if self._heap else None)
+                    continue
+            # callbacks are made without the lock, they queue polls and publish
+            for unit_mac in repolls :
+                self._repoll(unit_mac)
+            if self._on_timeout is not None :
+                for key, value, seconds in timeouts :
+                    self._on_timeout(key, value, seconds)
+
+    # snapshot of the counters
+    def stats(self) :
+        with self._condition :
+            return {
+                "tracked" : self.tracked,
+                "replaced" : self.replaced,
+                "confirmed" : self.confirmed,
+                "timed_out" : self.timed_out,
+                "repolls" : self.repolls,
+                "pending" : len(self._pending),
+            }
+
+    # stop the tracker thread, commands still waiting are dropped
+    def shutdown(self) :
+        with self._condition :
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
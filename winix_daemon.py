@@ -0,0 +1,1899 @@
+#
+# winix_daemon.py
+# 202610190300
+#
+# the winix-02 daemon, winix-02.py only checks the version of python and calls main() here
+#
+# importing this module does nothing but define things : no log file is opened or rolled over, no config read, no
+# thread started and no connection made, so the daemon's functions can be imported and tried out on their own, and
+# a start that fails does so in main(), with a message, not halfway through an import. main() sets up, in order
+#   setup_logging()     : the log file, returns logs
+#   load_config()       : reads winix-02.yaml, exits if it can't be read
+#   configure()         : the settings from the config, returns settings
+#   configure_logging() : the log level, rotation and rsyslog from the settings, and the log thread
+#   start_services()    : the MQTT connection and every part of the daemon with a thread or a connection, and the metrics,
+#                         returns services
+# then subscribes and runs the main loop. the rest of the module reads logs, settings and services, which main() sets
+# once, a config reload changes the settings and services in place
+#
+# the decoding of a status and the winix cloud client don't need any of it, they are winix_decode and winix_cloud
+#
+
+PROGRAM_NAME = "winix-02"
+VERSION_MAJOR = "1"
+VERSION_MINOR = "13"
+WORKING_DIRECTORY = "/home/user/winix/"
+# winix URL's, status and command requests share a pool of keep-alive connections to the api host
+WINIX_API_URL = "https://us.api.winix-iot.com/"
+GET_STATUS_URL = "https://us.api.winix-iot.com/common/event/sttus/devices/"
+COMMAND_URL = "https://us.api.winix-iot.com/common/control/devices/"
+
+import sys
+import atexit
+import json
+import os
+import traceback
+from pathlib import Path
+import yaml
+import queue
+import threading
+import types
+import paho.mqtt.client as mqtt
+import time
+from datetime import datetime
+from datetime import timedelta
+from winix_cloud import TokenBucket, FetchEngine, ConnectionPool, CloudError, LatencyTracker, Hedger
+from winix_queue import UnitUpdateQueue, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from winix_decode import decode_status, is_known_model, DEFAULT_MODEL
+from winix_command import CommandDispatcher
+from winix_confirm import CommandTracker
+from winix_breaker import CircuitBreaker, CircuitOpenError, BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN
+from winix_history import HistoryStore, reading_from_status, COLUMNS
+from winix_payload import PAYLOAD_PROFILES, PAYLOAD_FULL, PAYLOAD_COMPACT, PAYLOAD_FIELDS, FIELD_TOPIC, compact_message, FieldPublisher
+from winix_schedule import AdaptiveScheduler, TimeWheel
+from winix_metrics import MetricsRegistry, MetricsServer, LATENCY_BUCKETS, SWEEP_BUCKETS, CONFIRM_BUCKETS
+from winix_rollup import RollupEngine, MemoryRollupStore, GRANULARITIES, SCOPE_UNIT, SCOPE_ROOM
+from winix_shard import ShardMembership
+from winix_snapshot import write_snapshot, read_snapshot
+import logging
+import logging.handlers
+
+# the working directory can be given in the environment, to run another copy of winix-02 with its own config and log
+WORKING_DIRECTORY = os.path.join(os.environ.get("WINIX_WORKING_DIRECTORY", WORKING_DIRECTORY), "")
+
+# Logging setup
+
+# select logging level
+logging_level_file = logging.getLevelName('DEBUG')
+#level_file = logging.getLevelName('DEBUG')
+logging_level_rsyslog = logging.getLevelName('INFO')
+
+# set local logging
+LOG_FILENAME = PROGRAM_NAME + '.log'
+
+root_logger = logging.getLogger()
+
+#set loggers
+
+log_formatter = logging.Formatter(fmt='%(asctime)s %(levelname)-8s ' + PROGRAM_NAME + ' ' + '%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+# configure highest level combo logger, this is what we log to and it automagically goes to the log receivers that we have configured
+my_logger = logging.getLogger(PROGRAM_NAME)
+
+# the config file is read again when it changes, and the units, check_interval, debug_level and rsyslog applied
+# without a restart, see reload_config
+CONFIG_FILE = WORKING_DIRECTORY + PROGRAM_NAME + ".yaml"
+
+# (modification time, size) of the config file, None if it can't be read
+def config_file_signature() :
+    try :
+        stat = os.stat(CONFIG_FILE)
+    except OSError :
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+MQTT_CONTROL_TOPIC = "/control/"
+MQTT_STATUS_TOPIC = ""
+
+# global dictionary to keep track of current state of each unit
+UNITS_BY_MAC_STATE = {}
+
+# global dictionary of the last status published for each unit, used to skip publishing unchanged status
+# written from the fetch engine worker threads, so guarded by a lock
+UNITS_LAST_PUBLISHED = {}
+units_last_published_lock = threading.Lock()
+
+# fields of the status message that change on every fetch even when the unit has not, left out of the comparison
+PUBLISH_VOLATILE_FIELDS = ("timestamp", "update_age_text", "unit_body_json")
+
+# global dictionary of the last status read for each unit, (cloud response body, unit data), what optimistic state
+# predicts from, written from the fetch engine worker threads, a whole entry is replaced at once
+UNITS_LAST_STATUS = {}
+
+# publish counters, logged at the day rollover
+PUBLISH_COUNTS = {"published" : 0, "heartbeat" : 0, "unchanged" : 0}
+
+# with payload_profile "fields", the value last published on each field topic
+field_publisher = FieldPublisher()
+
+# what main() sets up, each one returned by the function that sets it up, None until then
+#   logs     : the log handlers, and the thread that writes to them, from setup_logging()
+#   settings : the settings read from the config file, from configure()
+#   services : the MQTT connection, and every part of the daemon with a thread or a connection, from start_services()
+logs = None
+settings = None
+services = None
+
+# log to a file in the working directory, rolled over at every start
+def setup_logging() :
+
+    logs = types.SimpleNamespace(level_file=logging_level_file, queue=None, listener=None)
+
+    # file logger
+    logs.handler_file = logging.handlers.RotatingFileHandler(WORKING_DIRECTORY + LOG_FILENAME, backupCount=5)
+    logs.handler_file.setFormatter(log_formatter)
+    logs.handler_file.setLevel(logs.level_file)
+    logs.handlers = [logs.handler_file]
+
+    root_logger.addHandler(logs.handler_file)
+
+    # Roll over on application start
+    logs.handler_file.doRollover()
+
+    return logs
+
+# read the yaml config file which lists the air purifier units, exits if it can't be read
+# returns the config, and the signature of the file it was read from
+def load_config() :
+
+    # read yaml config file which lists the air purifer units
+    try :
+        raw_yaml = Path(WORKING_DIRECTORY + PROGRAM_NAME + ".yaml").read_text()
+    except Exception as e:
+        my_logger.error("Error : configuration file : " + WORKING_DIRECTORY + PROGRAM_NAME + ".yaml" + " not found.")
+        sys.exit(1)
+
+    signature = config_file_signature()
+    try : 
+        program_config = yaml.load(raw_yaml, Loader=yaml.FullLoader)
+    except Exception as e :
+        my_logger.error("Error : YAML syntax problem in configuration file : " + WORKING_DIRECTORY + PROGRAM_NAME + ".yaml" + " .")
+        sys.exit(1)
+
+    return program_config, signature
+
+# the settings from the config file
+def configure(program_config, signature) :
+
+    settings = types.SimpleNamespace()
+
+    # the config the program started with, what a change that waits for a restart is against
+    settings.PROGRAM_CONFIG = program_config
+    # the config as last read, and the signature of the file it was read from
+    settings.LOADED_CONFIG = [program_config, signature]
+
+    # seconds between checks of the config file for a change, 0 to never read it again
+    settings.CONFIG_WATCH_SECONDS = settings.PROGRAM_CONFIG.get("config_watch", 5)
+
+    # read debug from YAML config file
+    # simple key value pair in YAML file : debug_level: "level" and set debug level
+    settings.DEBUG_LEVEL = settings.PROGRAM_CONFIG.get("debug_level", "")
+    if ( settings.DEBUG_LEVEL == "" ) :
+        settings.DEBUG_LEVEL = "INFO"
+
+    # log file rotation, read from YAML config file
+    # log_rotate_when : "" rotates when the file reaches log_max_bytes, or a TimedRotatingFileHandler interval like "midnight"
+    settings.LOG_MAX_BYTES = settings.PROGRAM_CONFIG.get("log_max_bytes", 10 * 1024 * 1024)
+    settings.LOG_BACKUP_COUNT = settings.PROGRAM_CONFIG.get("log_backup_count", 5)
+    settings.LOG_ROTATE_WHEN = settings.PROGRAM_CONFIG.get("log_rotate_when", "")
+
+    # read MQTT server info from YAML config file
+    # simple key value pair in YAML file : mqtt: "<mqtt server info>"
+    settings.MQTT_SERVER = settings.PROGRAM_CONFIG.get("mqtt", "")
+    if ( settings.MQTT_SERVER == "" ) :
+        settings.MQTT_SERVER = "192.168.2.242"
+    settings.MQTT_PORT = settings.PROGRAM_CONFIG.get("mqtt_port", 1883)
+
+    # read MQTT server info from YAML config file
+    # simple key value pair in YAML file : mqtt: "<mqtt server info>"
+    settings.MQTT_TOPIC_BASE = settings.PROGRAM_CONFIG.get("mqtt_topic", "")
+    if ( settings.MQTT_TOPIC_BASE == "" ) :
+        settings.MQTT_TOPIC_BASE = "winix"
+
+    # remove any forward slashes in value received from config file and just make it simple name with one following forward slash
+    settings.MQTT_TOPIC_BASE = settings.MQTT_TOPIC_BASE.strip( "/" ) + "/"
+
+    # read rsyslog info from YAML config file
+    # simple key value pair in YAML file : rsyslog: "<rsyslog server info>"
+    # simple string
+    settings.RSYSLOG_SERVER = settings.PROGRAM_CONFIG.get("rsyslog", "")
+    settings.LOG_RSYSLOG = (settings.RSYSLOG_SERVER, 514)
+
+    # how often to check the winix cloud for updated from each unit, be careful to not be to quick at updates
+    # this is in minutes
+    settings.CHECK_PERIOD_MINUTES = settings.PROGRAM_CONFIG.get("check_interval", 5)
+    settings.CHECK_PERIOD_SECONDS = settings.CHECK_PERIOD_MINUTES * 60
+
+    # with sweep polling, seconds after a unit's slot in the check interval comes round by which it should have been fetched,
+    # its status request is given no longer than what is left, and a unit not fetched by then is counted as missed
+    # the default is by the time its slot comes round again
+    settings.SWEEP_DEADLINE_SECONDS = settings.PROGRAM_CONFIG.get("sweep_deadline", settings.CHECK_PERIOD_SECONDS)
+
+    # refreshes asked for over MQTT go ahead of the periodic update, but a periodic update request that has
+    # waited this many seconds is served next anyway, so the periodic update still finishes within its interval
+    settings.SWEEP_MAX_WAIT_SECONDS = settings.PROGRAM_CONFIG.get("sweep_max_wait", settings.CHECK_PERIOD_SECONDS / 2)
+
+    # a unit's status is only published when it has changed since the last publish
+    # heartbeat in minutes, republish an unchanged status this often anyway, 0 to never republish
+    settings.PUBLISH_HEARTBEAT_MINUTES = settings.PROGRAM_CONFIG.get("publish_heartbeat", 0)
+    settings.PUBLISH_HEARTBEAT_SECONDS = settings.PUBLISH_HEARTBEAT_MINUTES * 60
+    # publish unit status as retained messages, so a new subscriber gets the latest state straight away
+    settings.PUBLISH_RETAIN = bool(settings.PROGRAM_CONFIG.get("publish_retain", False))
+    # shape of the published status, "full" is every value a string plus the raw cloud response, "compact" is the decoded
+    # fields with numbers as numbers, "fields" publishes each field on its own topic winix/<mac>/state/<field> when it changes
+    settings.PAYLOAD_PROFILE = settings.PROGRAM_CONFIG.get("payload_profile", PAYLOAD_FULL)
+    if ( settings.PAYLOAD_PROFILE not in PAYLOAD_PROFILES ) :
+        my_logger.error("Error : payload_profile must be one of " + ", ".join(PAYLOAD_PROFILES) + ", not : " + str(settings.PAYLOAD_PROFILE) + " , using " + PAYLOAD_FULL)
+        settings.PAYLOAD_PROFILE = PAYLOAD_FULL
+
+    # local history of unit readings, a SQLite database in the working directory, put empty string for no history
+    settings.HISTORY_FILE = settings.PROGRAM_CONFIG.get("history_file", PROGRAM_NAME + "-history.sqlite3")
+    # days of readings to keep, older readings are deleted, 0 to keep everything
+    settings.HISTORY_RETENTION_DAYS = settings.PROGRAM_CONFIG.get("history_retention_days", 30)
+    # rollups of the readings per unit and room, 5 minute, hourly and daily, queried over MQTT on $SYS/ROLLUP/REQUEST
+    # seconds between two readings of a unit that still count as one continuous period, also how long a rollup stays open
+    settings.ROLLUP_MAX_GAP_SECONDS = settings.PROGRAM_CONFIG.get("rollup_max_gap", 3600)
+    # snapshot of what is known about each unit, in the working directory, written every snapshot_interval seconds and
+    # when the program stops, and read at start so a restart carries on where the last run left off, put empty string for none
+    settings.SNAPSHOT_FILE = settings.PROGRAM_CONFIG.get("snapshot_file", PROGRAM_NAME + "-state.json")
+    settings.SNAPSHOT_INTERVAL_SECONDS = settings.PROGRAM_CONFIG.get("snapshot_interval", 60)
+
+    # base URL of the winix cloud api, only changed to point winix-02 at a stand in for the cloud when testing
+    settings.WINIX_API_URL = settings.PROGRAM_CONFIG.get("api_base_url", WINIX_API_URL).rstrip("/") + "/"
+    settings.GET_STATUS_URL = settings.WINIX_API_URL + "common/event/sttus/devices/"
+    settings.COMMAND_URL = settings.WINIX_API_URL + "common/control/devices/"
+
+    # winix cloud api quota, so as to not flood the cloud server
+    # average requests per second across all units, status reads and commands share the same budget
+    settings.API_REQUESTS_PER_SECOND = settings.PROGRAM_CONFIG.get("api_requests_per_second", 1.0)
+    # number of requests allowed to go out back to back after an idle period
+    settings.API_BURST = settings.PROGRAM_CONFIG.get("api_burst", 2)
+    # maximum number of unit requests in flight at the same time
+    settings.API_MAX_CONCURRENCY = settings.PROGRAM_CONFIG.get("api_max_concurrency", 4)
+    # hedged status requests, a status read taking longer than api_hedge_percentile of recent ones is sent again and the
+    # first answer is used, the second request takes a token from the api quota like any other, or is not sent
+    settings.API_HEDGE = bool(settings.PROGRAM_CONFIG.get("api_hedge", False))
+    settings.API_HEDGE_PERCENTILE = settings.PROGRAM_CONFIG.get("api_hedge_percentile", 95)
+    # maximum number of keep-alive connections held open to the winix cloud, enough for the status requests, their hedges
+    # and commands
+    settings.API_MAX_CONNECTIONS = settings.PROGRAM_CONFIG.get("api_max_connections", settings.API_MAX_CONCURRENCY * (2 if settings.API_HEDGE else 1) + 2)
+    # seconds to connect to the winix cloud, and to wait for each read of an answer, before a request is given up
+    settings.API_CONNECT_TIMEOUT_SECONDS = settings.PROGRAM_CONFIG.get("api_connect_timeout", 5)
+    settings.API_READ_TIMEOUT_SECONDS = settings.PROGRAM_CONFIG.get("api_read_timeout", 15)
+
+    # control commands are sent by worker threads, not the MQTT thread
+    # seconds a command waits before it is sent, a newer value for the same unit and control replaces it
+    settings.COMMAND_DEBOUNCE_SECONDS = settings.PROGRAM_CONFIG.get("command_debounce", 0.5)
+    # number of worker threads sending commands to the winix cloud
+    settings.COMMAND_WORKERS = settings.PROGRAM_CONFIG.get("command_workers", 2)
+    # after a command the unit is polled again until its status shows the change, command_confirm_delay seconds after
+    # the command, then twice as long each time up to command_confirm_max_interval, for command_confirm_timeout seconds
+    settings.COMMAND_CONFIRM_DELAY_SECONDS = settings.PROGRAM_CONFIG.get("command_confirm_delay", 1.0)
+    settings.COMMAND_CONFIRM_MAX_INTERVAL_SECONDS = settings.PROGRAM_CONFIG.get("command_confirm_max_interval", 15)
+    settings.COMMAND_CONFIRM_TIMEOUT_SECONDS = settings.PROGRAM_CONFIG.get("command_confirm_timeout", 60)
+    # optimistic state, publish the status a command will lead to as soon as the command arrives, with command_pending "YES",
+    # then the status read from the cloud once it shows the command, or the old status if it never does
+    settings.OPTIMISTIC_STATE = bool(settings.PROGRAM_CONFIG.get("optimistic_state", False))
+
+    # circuit breakers, a unit whose requests fail unit_breaker_failures times in a row is not asked again for
+    # unit_breaker_reset seconds, then one request tries it, and if that fails too it waits twice as long, up to
+    # breaker_max_reset. the winix cloud as a whole gets the same after cloud_breaker_failures connection errors,
+    # timeouts or server errors in a row. while a breaker is open the unit's last good status is published flagged stale
+    settings.UNIT_BREAKER_FAILURES = settings.PROGRAM_CONFIG.get("unit_breaker_failures", 3)
+    settings.UNIT_BREAKER_RESET_SECONDS = settings.PROGRAM_CONFIG.get("unit_breaker_reset", settings.CHECK_PERIOD_SECONDS)
+    settings.CLOUD_BREAKER_FAILURES = settings.PROGRAM_CONFIG.get("cloud_breaker_failures", 5)
+    settings.CLOUD_BREAKER_RESET_SECONDS = settings.PROGRAM_CONFIG.get("cloud_breaker_reset", 30)
+    settings.BREAKER_MAX_RESET_SECONDS = settings.PROGRAM_CONFIG.get("breaker_max_reset", 3600)
+
+    # metrics, published as JSON on winix/$SYS/METRICS every metrics_interval seconds, 0 to not publish them
+    settings.METRICS_INTERVAL_SECONDS = settings.PROGRAM_CONFIG.get("metrics_interval", 60)
+    # prometheus endpoint http://<metrics_address>:<metrics_port>/metrics, port 0 for no endpoint
+    settings.METRICS_PORT = settings.PROGRAM_CONFIG.get("metrics_port", 0)
+    settings.METRICS_ADDRESS = settings.PROGRAM_CONFIG.get("metrics_address", "127.0.0.1")
+
+    # winix units info from YAML config file
+    # dictionary of dictionaries
+    # units:
+    # example line : "SB01" : {"home" : "South Beach", "room" : "Living Room",   "key" : "zzzzzzzzzzzzzzzzzzzzzzzzzzzzzz", , "mac_address" : "xx:xx:xx:xx:xx:xx"}
+    settings.UNITS = settings.PROGRAM_CONFIG.get("units", {})
+
+    # build another dictionary, so that we can lookup the unit's key by it's mac address
+    settings.UNITS_BY_MAC = {}
+    for unit in settings.UNITS :
+        settings.UNITS_BY_MAC[settings.UNITS[unit]['mac_address']] = settings.UNITS[unit]
+
+    # how the units are polled, "sweep" polls every unit every check_interval, each unit at its own fixed offset into the
+    # interval, "adaptive" learns when each unit uploads to the winix cloud and polls it just after
+    settings.POLL_SCHEDULE = settings.PROGRAM_CONFIG.get("poll_schedule", "sweep")
+    if ( settings.POLL_SCHEDULE not in ("adaptive", "sweep") ) :
+        my_logger.error("Error : poll_schedule must be adaptive or sweep, not : " + str(settings.POLL_SCHEDULE) + " , using sweep")
+        settings.POLL_SCHEDULE = "sweep"
+    # adaptive polling, a unit is polled at most every poll_min_interval seconds and at least every poll_max_interval seconds
+    settings.POLL_MIN_INTERVAL_SECONDS = settings.PROGRAM_CONFIG.get("poll_min_interval", 60)
+    settings.POLL_MAX_INTERVAL_SECONDS = settings.PROGRAM_CONFIG.get("poll_max_interval", settings.CHECK_PERIOD_SECONDS * 6)
+    # seconds after a unit's expected upload that it is polled, time for the winix cloud to have it
+    settings.POLL_LAG_SECONDS = settings.PROGRAM_CONFIG.get("poll_lag", 20)
+    # most scheduled polls per hour for all units together, 0 for no limit
+    # the default is what polling every unit every check_interval costs, so adaptive polling never costs more
+    settings.POLL_BUDGET_PER_HOUR = settings.PROGRAM_CONFIG.get("poll_budget_per_hour", len(settings.UNITS) * 3600 / settings.CHECK_PERIOD_SECONDS)
+    # the check interval is cut into this many slots, each unit is polled in its own slot so the polls are spread out
+    settings.POLL_WHEEL_SLOTS = settings.PROGRAM_CONFIG.get("poll_wheel_slots", 60)
+
+    # sharding, several instances with the same units and each its own shard_id split the units between them, an
+    # instance only polls and takes commands for the units it owns. empty for a single instance that owns every unit
+    settings.SHARD_ID = str(settings.PROGRAM_CONFIG.get("shard_id", "")).strip()
+    if ( any(character in settings.SHARD_ID for character in "/+#") ) :
+        my_logger.error("Error : shard_id can't contain / + or # : " + settings.SHARD_ID + " , not sharding")
+        settings.SHARD_ID = ""
+    # seconds a shard's lease lasts, it is renewed every third of that, a shard that stops renewing is dropped after it
+    settings.SHARD_LEASE_SECONDS = settings.PROGRAM_CONFIG.get("shard_lease", 60)
+    # seconds a shard waits at start for the leases of the other shards, before it works out which units it owns
+    settings.SHARD_SETTLE_SECONDS = settings.PROGRAM_CONFIG.get("shard_settle", 2)
+    # the $SYS topics each shard publishes its own of, winix/$SYS/STATUS/<shard_id> for example
+    settings.SHARD_TOPIC_SUFFIX = "/" + settings.SHARD_ID if settings.SHARD_ID else ""
+
+    # the retained shard leases, one topic per shard
+    settings.MQTT_SHARD_TOPIC = settings.MQTT_TOPIC_BASE + "$SYS/SHARDS/"
+
+    # we only subscribe to control topics, status messages we publish ourselves never come back to us
+    settings.MQTT_CONTROL_SUBSCRIPTION = settings.MQTT_TOPIC_BASE + "+" + MQTT_CONTROL_TOPIC + "+"
+    settings.MQTT_ROLLUP_REQUEST_TOPIC = settings.MQTT_TOPIC_BASE + "$SYS/ROLLUP/REQUEST"
+    settings.MQTT_ROLLUP_RESPONSE_TOPIC = settings.MQTT_TOPIC_BASE + "$SYS/ROLLUP/RESPONSE"
+
+    return settings
+
+# the log level, rotation and rsyslog from the settings, and the thread that writes the log
+def configure_logging() :
+
+    logs.level_file = logging.getLevelName(settings.DEBUG_LEVEL)
+    logs.handler_file.setLevel(logs.level_file)
+
+    if ( settings.LOG_ROTATE_WHEN != "" ) :
+        root_logger.removeHandler(logs.handler_file)
+        logs.handler_file.close()
+        logs.handler_file = logging.handlers.TimedRotatingFileHandler(WORKING_DIRECTORY + LOG_FILENAME, when=settings.LOG_ROTATE_WHEN, backupCount=settings.LOG_BACKUP_COUNT)
+        logs.handler_file.setFormatter(log_formatter)
+        logs.handler_file.setLevel(logs.level_file)
+        root_logger.addHandler(logs.handler_file)
+    else :
+        logs.handler_file.maxBytes = settings.LOG_MAX_BYTES
+        logs.handler_file.backupCount = settings.LOG_BACKUP_COUNT
+
+    logs.handlers = [logs.handler_file]
+
+    # rsyslog handler, if an IP address was specified in the YAML config file that configure to log to a RSYSLOG server
+    if (settings.RSYSLOG_SERVER != "") :
+        handler_rsyslog = logging.handlers.SysLogHandler(address = settings.LOG_RSYSLOG)
+        handler_rsyslog.setFormatter(log_formatter)
+        handler_rsyslog.setLevel(logging_level_rsyslog)
+        logs.handlers.append(handler_rsyslog)
+
+    # from here on the file and rsyslog writes are done by a background thread, the fetch and MQTT threads only
+    # put the log record on a queue. the listener is stopped at exit, which writes out anything still queued
+    logs.queue = queue.SimpleQueue()
+    root_logger.removeHandler(logs.handler_file)
+    root_logger.addHandler(logging.handlers.QueueHandler(logs.queue))
+    logs.listener = logging.handlers.QueueListener(logs.queue, *logs.handlers, respect_handler_level=True)
+    logs.listener.start()
+    atexit.register(logs.listener.stop)
+
+    # the root logger drops a record before it is formatted if no handler would write it,
+    # so debug messages cost next to nothing unless debug_level asks for them
+    root_logger.setLevel(min(handler.level for handler in logs.handlers))
+
+    return
+
+# debug, check that the YAML reads and massaging are correct
+def log_settings() :
+
+    my_logger.debug("MQTT_SERVER          :" + str(settings.MQTT_SERVER))
+    my_logger.debug("MQTT_PORT            :" + str(settings.MQTT_PORT))
+    my_logger.debug("MQTT_TOPIC_BASE      :" + str(settings.MQTT_TOPIC_BASE))
+    my_logger.debug("LOG_RSYSLOG          :" + str(settings.LOG_RSYSLOG))
+    my_logger.debug("CHECK_PERIOD_MINUTES :" + str(settings.CHECK_PERIOD_MINUTES))
+    my_logger.debug("SWEEP_MAX_WAIT_SECS  :" + str(settings.SWEEP_MAX_WAIT_SECONDS))
+    my_logger.debug("SWEEP_DEADLINE       :" + str(settings.SWEEP_DEADLINE_SECONDS))
+    my_logger.debug("PUBLISH_HEARTBEAT    :" + str(settings.PUBLISH_HEARTBEAT_MINUTES))
+    my_logger.debug("PUBLISH_RETAIN       :" + str(settings.PUBLISH_RETAIN))
+    my_logger.debug("PAYLOAD_PROFILE      :" + str(settings.PAYLOAD_PROFILE))
+    my_logger.debug("HISTORY_FILE         :" + str(settings.HISTORY_FILE))
+    my_logger.debug("HISTORY_RETENTION    :" + str(settings.HISTORY_RETENTION_DAYS))
+    my_logger.debug("ROLLUP_MAX_GAP       :" + str(settings.ROLLUP_MAX_GAP_SECONDS))
+    my_logger.debug("SNAPSHOT_FILE        :" + str(settings.SNAPSHOT_FILE))
+    my_logger.debug("SNAPSHOT_INTERVAL    :" + str(settings.SNAPSHOT_INTERVAL_SECONDS))
+    my_logger.debug("WINIX_API_URL        :" + str(settings.WINIX_API_URL))
+    my_logger.debug("API_REQUESTS_PER_SEC :" + str(settings.API_REQUESTS_PER_SECOND))
+    my_logger.debug("API_BURST            :" + str(settings.API_BURST))
+    my_logger.debug("API_MAX_CONCURRENCY  :" + str(settings.API_MAX_CONCURRENCY))
+    my_logger.debug("API_MAX_CONNECTIONS  :" + str(settings.API_MAX_CONNECTIONS))
+    my_logger.debug("API_CONNECT_TIMEOUT  :" + str(settings.API_CONNECT_TIMEOUT_SECONDS))
+    my_logger.debug("API_READ_TIMEOUT     :" + str(settings.API_READ_TIMEOUT_SECONDS))
+    my_logger.debug("API_HEDGE            :" + str(settings.API_HEDGE))
+    my_logger.debug("API_HEDGE_PERCENTILE :" + str(settings.API_HEDGE_PERCENTILE))
+    my_logger.debug("COMMAND_DEBOUNCE     :" + str(settings.COMMAND_DEBOUNCE_SECONDS))
+    my_logger.debug("COMMAND_WORKERS      :" + str(settings.COMMAND_WORKERS))
+    my_logger.debug("COMMAND_CONFIRM_DLY  :" + str(settings.COMMAND_CONFIRM_DELAY_SECONDS))
+    my_logger.debug("COMMAND_CONFIRM_MAX  :" + str(settings.COMMAND_CONFIRM_MAX_INTERVAL_SECONDS))
+    my_logger.debug("COMMAND_CONFIRM_TMO  :" + str(settings.COMMAND_CONFIRM_TIMEOUT_SECONDS))
+    my_logger.debug("OPTIMISTIC_STATE     :" + str(settings.OPTIMISTIC_STATE))
+    my_logger.debug("UNIT_BREAKER_FAILS   :" + str(settings.UNIT_BREAKER_FAILURES))
+    my_logger.debug("UNIT_BREAKER_RESET   :" + str(settings.UNIT_BREAKER_RESET_SECONDS))
+    my_logger.debug("CLOUD_BREAKER_FAILS  :" + str(settings.CLOUD_BREAKER_FAILURES))
+    my_logger.debug("CLOUD_BREAKER_RESET  :" + str(settings.CLOUD_BREAKER_RESET_SECONDS))
+    my_logger.debug("BREAKER_MAX_RESET    :" + str(settings.BREAKER_MAX_RESET_SECONDS))
+    my_logger.debug("METRICS_INTERVAL     :" + str(settings.METRICS_INTERVAL_SECONDS))
+    my_logger.debug("METRICS_PORT         :" + str(settings.METRICS_PORT))
+    my_logger.debug("METRICS_ADDRESS      :" + str(settings.METRICS_ADDRESS))
+    my_logger.debug("LOG_MAX_BYTES        :" + str(settings.LOG_MAX_BYTES))
+    my_logger.debug("LOG_BACKUP_COUNT     :" + str(settings.LOG_BACKUP_COUNT))
+    my_logger.debug("LOG_ROTATE_WHEN      :" + str(settings.LOG_ROTATE_WHEN))
+    my_logger.debug("POLL_SCHEDULE        :" + str(settings.POLL_SCHEDULE))
+    my_logger.debug("POLL_MIN_INTERVAL    :" + str(settings.POLL_MIN_INTERVAL_SECONDS))
+    my_logger.debug("POLL_MAX_INTERVAL    :" + str(settings.POLL_MAX_INTERVAL_SECONDS))
+    my_logger.debug("POLL_LAG             :" + str(settings.POLL_LAG_SECONDS))
+    my_logger.debug("POLL_BUDGET_PER_HOUR :" + str(settings.POLL_BUDGET_PER_HOUR))
+    my_logger.debug("POLL_WHEEL_SLOTS     :" + str(settings.POLL_WHEEL_SLOTS))
+    my_logger.debug("SHARD_ID             :" + str(settings.SHARD_ID))
+    my_logger.debug("SHARD_LEASE          :" + str(settings.SHARD_LEASE_SECONDS))
+    my_logger.debug("SHARD_SETTLE         :" + str(settings.SHARD_SETTLE_SECONDS))
+    my_logger.debug("CONFIG_WATCH         :" + str(settings.CONFIG_WATCH_SECONDS))
+    my_logger.debug("UNITS                :" + str(settings.UNITS))
+
+    return
+
+# the MQTT connection, and every part of the daemon with a thread or a connection
+def start_services() :
+
+    services = types.SimpleNamespace()
+
+    # create MQTT client
+    # connect to MQTT server
+    # each shard has its own client ID, the broker drops the older of two clients with the same ID
+    # if a shard's connection drops without it clearing its lease, the broker clears the lease with the last will
+    services.mqttc = mqtt.Client(PROGRAM_NAME + settings.SHARD_TOPIC_SUFFIX.replace("/", "-"))  # Create instance of client with client ID 
+    if ( settings.SHARD_ID ) :
+        services.mqttc.will_set(settings.MQTT_SHARD_TOPIC + settings.SHARD_ID, "", retain=True)
+    services.mqttc.connect(settings.MQTT_SERVER, settings.MQTT_PORT)  # Connect to (broker, port, keepalive-time)
+
+    # setup a queue where we can put a request for an update to a winix unit from the winix cloud
+    # a unit that is already waiting in the queue is not queued a second time
+    # requests from MQTT control messages are interactive and go ahead of the background periodic update
+    services.queue_unit_request_update = UnitUpdateQueue(max_wait=settings.SWEEP_MAX_WAIT_SECONDS)
+
+    # every request to the winix cloud takes a token from this bucket first
+    services.api_token_bucket = TokenBucket(settings.API_REQUESTS_PER_SECOND, settings.API_BURST)
+
+    # keep-alive connections to the winix cloud, used by both the status and command requests
+    services.api_pool = ConnectionPool(settings.WINIX_API_URL, settings.API_MAX_CONNECTIONS, timeout=settings.API_READ_TIMEOUT_SECONDS, connect_timeout=settings.API_CONNECT_TIMEOUT_SECONDS)
+
+    # latency of the recent requests to the winix cloud as the callers saw them, hedging included, for the tail latency stats
+    services.cloud_latencies = {"status" : LatencyTracker(), "command" : LatencyTracker()}
+
+    # hedged status requests, each status request in flight can have its hedge in flight too, None when not hedging
+    services.status_hedger = None
+    if ( settings.API_HEDGE ) :
+        services.status_hedger = Hedger(settings.API_MAX_CONCURRENCY * 2, percent=settings.API_HEDGE_PERCENTILE)
+
+    # local history of every reading, None if not configured
+    services.history_store = None
+    if ( settings.HISTORY_FILE != "" ) :
+        try :
+            services.history_store = HistoryStore(WORKING_DIRECTORY + settings.HISTORY_FILE, settings.HISTORY_RETENTION_DAYS)
+        except Exception as e :
+            my_logger.error("Error : Unable to open history file : " + WORKING_DIRECTORY + settings.HISTORY_FILE + " : " + traceback.format_exc())
+
+    # rollups of the readings, kept up to date as readings arrive, closed rollups are saved with the history
+    # or kept in memory when there is no history file
+    services.rollup_store = services.history_store if services.history_store is not None else MemoryRollupStore()
+    services.rollup_engine = RollupEngine(save=services.rollup_store.save_rollup, max_gap=settings.ROLLUP_MAX_GAP_SECONDS)
+
+    # one circuit breaker for the winix cloud and one for each unit
+    services.cloud_breaker = CircuitBreaker("winix cloud", failures=settings.CLOUD_BREAKER_FAILURES, reset=settings.CLOUD_BREAKER_RESET_SECONDS,
+        max_reset=settings.BREAKER_MAX_RESET_SECONDS, on_change=circuit_breaker_changed)
+    services.unit_breakers = {}
+    for unit in settings.UNITS :
+        services.unit_breakers[settings.UNITS[unit]['mac_address']] = CircuitBreaker(settings.UNITS[unit]['mac_address'], failures=settings.UNIT_BREAKER_FAILURES,
+            reset=settings.UNIT_BREAKER_RESET_SECONDS, max_reset=settings.BREAKER_MAX_RESET_SECONDS, on_change=circuit_breaker_changed)
+
+    # worker threads that fetch unit status from the winix cloud, several units can be in flight at once
+    services.fetch_engine = FetchEngine(settings.API_MAX_CONCURRENCY)
+
+    # the units this instance polls and takes commands for, every unit unless sharded
+    # a shard owns none until it has waited for the other shards' leases, then shard_rebalance gives it its units
+    services.owned_units = set() if settings.SHARD_ID else set(settings.UNITS_BY_MAC)
+    services.shard_settled = not settings.SHARD_ID
+
+    # every unit has a fixed offset into the check interval, from a hash of its mac address, so the polls of all the
+    # units are spread evenly over the interval instead of going out together. with "sweep" the wheel queues the units
+    services.poll_wheel = TimeWheel(settings.CHECK_PERIOD_SECONDS, settings.POLL_WHEEL_SLOTS, sorted(services.owned_units))
+
+    # adaptive polling, every unit is polled once in the first interval, at its offset, to learn when it uploads
+    # the budget holds enough for that first round whatever the offsets, None when polling by sweep
+    services.unit_scheduler = None
+    if ( settings.POLL_SCHEDULE == "adaptive" ) :
+        services.unit_scheduler = AdaptiveScheduler(default_interval=settings.CHECK_PERIOD_SECONDS, min_interval=settings.POLL_MIN_INTERVAL_SECONDS,
+            max_interval=settings.POLL_MAX_INTERVAL_SECONDS, lag=settings.POLL_LAG_SECONDS, budget_per_hour=settings.POLL_BUDGET_PER_HOUR,
+            burst=max(len(settings.UNITS), settings.POLL_BUDGET_PER_HOUR / 60))
+        for unit_mac in services.owned_units :
+            services.unit_scheduler.add(unit_mac, due=time.time() + services.poll_wheel.phase(unit_mac))
+
+    # where the main loop gets the units due a poll from
+    services.unit_poller = services.unit_scheduler if services.unit_scheduler is not None else services.poll_wheel
+
+    # the shards, from their leases, None when not sharded
+    services.shard_membership = None
+    if ( settings.SHARD_ID ) :
+        services.shard_membership = ShardMembership(settings.SHARD_ID, on_change=lambda members : shard_rebalance())
+
+    # metrics
+    # the counters the queue, pool, dispatcher and publish already keep are read from them when the metrics are read
+    services.metrics = MetricsRegistry()
+    services.metric_cloud_request_seconds = services.metrics.histogram("cloud_request_seconds", "winix cloud request latency, by kind status or command", LATENCY_BUCKETS)
+    services.metric_api_token_wait_seconds = services.metrics.histogram("api_token_wait_seconds", "time waiting on the api rate limit before a request, by kind", LATENCY_BUCKETS)
+    services.metric_cloud_errors = services.metrics.counter("cloud_errors_total", "failed winix cloud requests, by kind and error")
+    services.metric_sweep_seconds = services.metrics.histogram("sweep_seconds", "time from a unit's slot in the check interval to its fetch, with sweep polling", SWEEP_BUCKETS)
+    services.metric_sweep_last_seconds = services.metrics.gauge("sweep_last_seconds", "slowest unit of the last turn of the poll wheel, seconds from its slot to its fetch")
+    services.metric_sweep_overruns = services.metrics.counter("sweep_overruns_total", "units whose slot came round again before their last poll was fetched or missed its deadline")
+    services.metric_sweep_deadline_missed = services.metrics.counter("sweep_deadline_missed_total", "units not fetched by sweep_deadline seconds after their slot")
+    services.metrics.gauge("cloud_request_latency_quantile_seconds", "recent winix cloud request latency percentiles as callers saw them, by kind and quantile",
+        lambda : [({"kind" : kind, "quantile" : quantile}, round(value, 4)) for kind, quantile, value in cloud_latency_quantiles()])
+    if ( services.status_hedger is not None ) :
+        services.metrics.counter("hedged_requests_total", "status requests sent a second time, and the ones the second answered first",
+            lambda : [({"result" : "hedged"}, services.status_hedger.hedged), ({"result" : "hedge_won"}, services.status_hedger.hedge_won)])
+        services.metrics.gauge("hedge_delay_seconds", "how long a status request waits before it is hedged",
+            lambda : [({}, round(services.status_hedger.delay(), 4))] if services.status_hedger.delay() is not None else [])
+    services.metrics.gauge("check_interval_seconds", "configured time between periodic updates", lambda : [({}, settings.CHECK_PERIOD_SECONDS)])
+    services.metric_published = services.metrics.counter("mqtt_published_total", "messages published, by kind status, field or sys")
+    services.metric_published_bytes = services.metrics.counter("mqtt_published_bytes_total", "topic and payload bytes published, by kind")
+    services.metric_unit_update_age = services.metrics.gauge("unit_update_age_seconds", "age of the newest data the winix cloud had for a unit when fetched")
+    services.metrics.counter("status_publish_total", "unit status publish decisions, by result",
+        lambda : [({"result" : result}, count) for result, count in PUBLISH_COUNTS.items()])
+    services.metrics.gauge("update_queue_depth", "unit update requests waiting, by lane",
+        lambda : [({"lane" : lane}, services.queue_unit_request_update.stats()["depth_" + lane]) for lane in ("interactive", "background")])
+    services.metrics.counter("update_queue_total", "unit update queue events",
+        lambda : [({"event" : event}, services.queue_unit_request_update.stats()[event]) for event in ("queued", "coalesced", "promoted", "dispatched", "starvation_guarded")])
+    services.metrics.gauge("fetches_in_flight", "unit status requests in flight", lambda : [({}, services.fetch_engine.in_flight)])
+    services.metrics.counter("api_connections_total", "winix cloud connections, by event",
+        lambda : [({"event" : event}, services.api_pool.stats()["connections_" + event]) for event in ("opened", "reused", "dropped")])
+    if ( services.unit_scheduler is not None ) :
+        services.metrics.gauge("unit_upload_period_seconds", "learned time between a unit's uploads to the winix cloud",
+            lambda : [({"unit" : unit_mac}, period) for unit_mac, period in services.unit_scheduler.periods().items() if period is not None])
+        services.metrics.counter("polls_total", "scheduled and requested unit polls, by what they found, new, stale, off or failed",
+            lambda : [({"result" : result}, count) for result, count in services.unit_scheduler.polls.items()])
+        services.metrics.counter("poll_budget_deferred_total", "times a due poll waited for the poll budget",
+            lambda : [({}, services.unit_scheduler.deferred)])
+    services.metrics.gauge("poll_wheel_slot_units", "units polled in each slot of the check interval",
+        lambda : [({"slot" : slot}, units) for slot, units in enumerate(services.poll_wheel.occupancy())])
+    services.metrics.gauge("poll_wheel_late_seconds", "how late the last slot of the check interval was served, with sweep polling",
+        lambda : [({}, round(services.poll_wheel.late, 3))])
+    services.metrics.counter("poll_wheel_skipped_total", "slots skipped because the main loop fell a whole interval behind",
+        lambda : [({}, services.poll_wheel.skipped)])
+    services.metrics.gauge("circuit_breaker_state", "circuit breakers that are not closed, 1 half open, 2 open, the winix cloud's always",
+        lambda : breaker_state_values())
+    services.metrics.counter("circuit_breaker_trips_total", "times circuit breakers opened, by scope cloud or unit",
+        lambda : [({"scope" : "cloud"}, services.cloud_breaker.trips), ({"scope" : "unit"}, sum(breaker.trips for breaker in services.unit_breakers.values()))])
+    services.metrics.counter("circuit_breaker_rejected_total", "requests not made because a circuit breaker was open, by scope cloud or unit",
+        lambda : [({"scope" : "cloud"}, services.cloud_breaker.rejected), ({"scope" : "unit"}, sum(breaker.rejected for breaker in services.unit_breakers.values()))])
+    services.metric_stale_status = services.metrics.counter("stale_status_total", "times a unit's last good status was published again flagged stale")
+    services.metrics.counter("commands_total", "control commands, by result",
+        lambda : [({"result" : result}, services.command_dispatcher.stats()[result]) for result in ("submitted", "debounced", "sent", "failed")])
+    services.metric_command_confirm_seconds = services.metrics.histogram("command_confirm_seconds", "time from a command being sent to a status showing it, by attribute", CONFIRM_BUCKETS)
+    services.metrics.counter("command_confirm_total", "sent commands, by whether a status showed them, confirmed, timed_out or replaced by a newer command",
+        lambda : [({"result" : result}, services.command_tracker.stats()[result]) for result in ("confirmed", "timed_out", "replaced")])
+    services.metrics.counter("command_repolls_total", "unit polls asked for while waiting on a command", lambda : [({}, services.command_tracker.stats()["repolls"])])
+    services.metrics.gauge("commands_unconfirmed", "sent commands still waiting for a status showing them", lambda : [({}, services.command_tracker.stats()["pending"])])
+    services.metric_snapshot_writes = services.metrics.counter("snapshot_writes_total", "state snapshots written, by result ok or failed")
+    services.metric_snapshot_write_seconds = services.metrics.gauge("snapshot_write_seconds", "time the last state snapshot took to write")
+    services.metric_snapshot_bytes = services.metrics.gauge("snapshot_bytes", "size of the last state snapshot written")
+    services.metrics.gauge("shard_units_owned", "units this instance polls and takes commands for", lambda : [({}, len(services.owned_units))])
+    if ( services.shard_membership is not None ) :
+        services.metrics.gauge("shard_members", "shards this shard knows of from their leases, itself included", lambda : [({}, len(services.shard_membership.members()))])
+        services.metrics.counter("shard_rebalances_total", "times the shards changed and this shard worked out its units again", lambda : [({}, SHARD_COUNTS["rebalances"])])
+        services.metrics.counter("shard_units_moved_total", "units this shard was given or gave up in rebalances, by direction gained or lost",
+            lambda : [({"direction" : direction}, SHARD_COUNTS[direction]) for direction in ("gained", "lost")])
+
+    # prometheus endpoint
+    services.metrics_server = None
+    if ( settings.METRICS_PORT ) :
+        try :
+            services.metrics_server = MetricsServer(services.metrics, settings.METRICS_PORT, settings.METRICS_ADDRESS)
+        except Exception as e :
+            my_logger.error("Error : Unable to start metrics endpoint on port : " + str(settings.METRICS_PORT) + " : " + traceback.format_exc())
+
+    # re-polls the units until the status shows the commands sent to them, the polls are interactive, like an MQTT update
+    services.command_tracker = CommandTracker(queue_unit_update_after_command, first_delay=settings.COMMAND_CONFIRM_DELAY_SECONDS,
+        max_interval=settings.COMMAND_CONFIRM_MAX_INTERVAL_SECONDS, timeout=settings.COMMAND_CONFIRM_TIMEOUT_SECONDS,
+        on_confirmed=command_confirmed, on_timeout=command_timed_out)
+
+    # worker threads that send the control commands, with last write wins debouncing per unit and control
+    services.command_dispatcher = CommandDispatcher(send_unit_command, max_workers=settings.COMMAND_WORKERS, debounce=settings.COMMAND_DEBOUNCE_SECONDS,
+        on_error=send_unit_command_failed)
+
+    return services
+
+# a breaker opening or closing is logged
+def circuit_breaker_changed(breaker, old_state, new_state) :
+
+    if ( new_state == BREAKER_OPEN ) :
+        my_logger.warning("circuit breaker open : " + breaker.name + " , next try in " + "{:.0f}".format(breaker.retry_in()) + " seconds")
+    else :
+        my_logger.info("circuit breaker closed : " + breaker.name)
+
+    return
+
+# guards which units this instance owns, and the shard counters
+shard_lock = threading.Lock()
+SHARD_COUNTS = {"rebalances" : 0, "gained" : 0, "lost" : 0}
+
+# does this instance poll and take commands for a unit
+def owns_unit(unit_mac) :
+    with shard_lock :
+        return unit_mac in services.owned_units
+
+# start polling a unit this shard has just been given, its first poll is at its offset into the next interval
+def start_polling_unit(unit_mac) :
+    services.poll_wheel.add(unit_mac)
+    if ( services.unit_scheduler is not None ) :
+        services.unit_scheduler.add(unit_mac, due=time.time() + services.poll_wheel.phase(unit_mac))
+
+# stop polling a unit another shard now owns, a poll already queued or in flight for it still goes ahead
+def stop_polling_unit(unit_mac) :
+    services.poll_wheel.remove(unit_mac)
+    if ( services.unit_scheduler is not None ) :
+        services.unit_scheduler.remove(unit_mac)
+    with sweep_lock :
+        SWEEP_PENDING.pop(unit_mac, None)
+    # the shard that owns it now publishes its status, if it comes back here it is published again straight away
+    with units_last_published_lock :
+        UNITS_LAST_PUBLISHED.pop(unit_mac, None)
+    # and exports its metrics, the per unit series of a unit that left are not exported for ever
+    services.metric_unit_update_age.remove(unit=unit_mac)
+
+# work out which of the configured units this instance owns, every one unless sharded, and start or stop polling
+# the ones that moved, returns (gained, lost), None while a shard is still waiting for the leases at start
+def update_owned_units() :
+
+    with shard_lock :
+        if not services.shard_settled :
+            return None
+        if ( services.shard_membership is None ) :
+            owned = set(settings.UNITS_BY_MAC)
+        else :
+            owned = {unit_mac for unit_mac in settings.UNITS_BY_MAC if services.shard_membership.owns(unit_mac)}
+        gained = owned - services.owned_units
+        lost = services.owned_units - owned
+        services.owned_units.clear()
+        services.owned_units.update(owned)
+        for unit_mac in lost :
+            stop_polling_unit(unit_mac)
+        for unit_mac in gained :
+            start_polling_unit(unit_mac)
+
+    return gained, lost
+
+# a shard joined or left, work out this shard's units again
+def shard_rebalance() :
+
+    moved = update_owned_units()
+    if ( moved is None ) :
+        return
+    gained, lost = moved
+    with shard_lock :
+        SHARD_COUNTS["rebalances"] += 1
+        SHARD_COUNTS["gained"] += len(gained)
+        SHARD_COUNTS["lost"] += len(lost)
+    my_logger.info("shards : " + " ".join(services.shard_membership.members()) + " , this shard owns " + str(len(services.owned_units)) +
+        " units, gained " + str(len(gained)) + ", lost " + str(len(lost)))
+
+    return
+
+# circuit breaker states as metric values
+BREAKER_STATE_VALUES = {BREAKER_CLOSED : 0, BREAKER_HALF_OPEN : 1, BREAKER_OPEN : 2}
+
+# the winix cloud's breaker, and the unit breakers that are not closed, a fleet of closed breakers is not worth a series each
+# only the units this instance owns, a unit removed or moved to another shard keeps its breaker but not its series
+def breaker_state_values() :
+    values = [({"breaker" : services.cloud_breaker.name}, BREAKER_STATE_VALUES[services.cloud_breaker.state()])]
+    for unit_mac, breaker in services.unit_breakers.items() :
+        if not owns_unit(unit_mac) :
+            continue
+        state = breaker.state()
+        if ( state != BREAKER_CLOSED ) :
+            values.append(({"breaker" : breaker.name}, BREAKER_STATE_VALUES[state]))
+    return values
+
+# with sweep polling, the units whose slot has come round and that have not been fetched yet, unit_mac -> the monotonic
+# time its slot came round, in that order as the slots come round in order, so the first is the next to miss its deadline
+# and the slowest unit of the current turn of the wheel, seconds from its slot to its fetch
+SWEEP_PENDING = {}
+SWEEP_SLOWEST = [0.0]
+sweep_lock = threading.Lock()
+
+# one request to the winix cloud, taking a token from the rate limit first, timed and counted for the metrics
+# kind is "status" or "command", timeout overrides api_read_timeout
+# raises CircuitOpenError without a request, or a token, while the winix cloud's circuit breaker is open
+# a status request is hedged when api_hedge is set, the hedge only goes if there is a token for it straight away
+def cloud_request(kind, url, timeout=None) :
+
+    if not services.cloud_breaker.allow() :
+        raise CircuitOpenError(services.cloud_breaker.name, services.cloud_breaker.retry_in())
+    services.metric_api_token_wait_seconds.observe(services.api_token_bucket.acquire(), kind=kind)
+    start = time.monotonic()
+    try :
+        if ( kind == "status" and services.status_hedger is not None ) :
+            unit_raw_json = services.status_hedger.call(lambda : services.api_pool.get_json(url, timeout), services.api_token_bucket.try_acquire)
+        else :
+            unit_raw_json = services.api_pool.get_json(url, timeout)
+    except Exception as e :
+        services.metric_cloud_errors.inc(kind=kind, error=("http_" + str(e.status)) if isinstance(e, CloudError) else type(e).__name__)
+        # a client error is about the request, the cloud itself answered
+        if ( isinstance(e, CloudError) and e.status < 500 ) :
+            services.cloud_breaker.record_success()
+        else :
+            services.cloud_breaker.record_failure()
+        raise
+    finally :
+        services.metric_cloud_request_seconds.observe(time.monotonic() - start, kind=kind)
+        services.cloud_latencies[kind].observe(time.monotonic() - start)
+    services.cloud_breaker.record_success()
+
+    return unit_raw_json
+
+# publish to MQTT, counted for the metrics by kind
+def publish_message(topic, payload, kind, retain=False) :
+
+    services.metric_published.inc(kind=kind)
+    services.metric_published_bytes.inc(len(topic.encode("utf-8")) + len(payload.encode("utf-8")), kind=kind)
+    services.mqttc.publish(topic, payload, retain=retain)
+
+# functions to handle the command messages from MQTT sources
+
+# control sub topics that send a command to a unit, winix/<mac>/control/<control>
+# each maps to the attribute to set, the command value for each message text, and the value sent for any other text
+# these are the values the winix cloud accepts in a command URL, some differ from the values it reports in status
+# 'update' sends no command, it only asks for a status update from the winix cloud
+CONTROL_COMMANDS = {
+    "power" : ("A02", {"ON" : "1"}, "0"),
+    "mode" : ("A03", {"AUTO" : "01"}, "03"),
+    "plasmawave" : ("A07", {"ON" : "01"}, "02"),
+    "fan_speed" : ("A04", {"100" : "05", "75" : "03", "50" : "02", "25" : "01"}, "01"),
+    "sleep" : ("A04", {"ON" : "06"}, "01"),
+    "update" : None,
+}
+
+# command values the unit reports differently in its status once it has taken the command, by attribute
+# any other command value is reported as it was sent
+COMMAND_STATUS_VALUES = {
+    "A03" : {"03" : "02"},
+    "A07" : {"01" : "1", "02" : "0"},
+}
+
+# the value a unit reports in its status for an attribute once it has taken a command
+def command_status_value(attribute, msg_command) :
+    return COMMAND_STATUS_VALUES.get(attribute, {}).get(msg_command, msg_command)
+
+def message_to_unit(mosq, obj, msg) :
+
+    msg_text = msg.payload.decode("utf-8")
+
+    my_logger.debug("in message_to_unit, message topic, qos, text: %s %s %s", msg.topic, msg.qos, msg_text)
+
+    # topic is winix/<mac>/control/<control>, split off the base topic, not strip(), which removes characters not a prefix
+    topic_parts = msg.topic[len(settings.MQTT_TOPIC_BASE):].split("/")
+    if ( len(topic_parts) != 3 or topic_parts[1] != MQTT_CONTROL_TOPIC.strip("/") ) :
+        my_logger.warning("Ignoring control message on unexpected topic : " + msg.topic)
+        return
+
+    unit_mac = topic_parts[0]
+    control = topic_parts[2]
+
+    if ( unit_mac not in settings.UNITS_BY_MAC ) :
+        my_logger.warning("Ignoring control message for unknown unit : " + msg.topic)
+        return
+
+    # every shard sees every control message, only the one that owns the unit acts on it
+    if not owns_unit(unit_mac) :
+        my_logger.debug("Ignoring control message for a unit another shard owns : %s", msg.topic)
+        return
+
+    if ( control not in CONTROL_COMMANDS ) :
+        my_logger.warning("Ignoring unknown control command : " + msg.topic)
+        return
+
+    command = CONTROL_COMMANDS[control]
+
+    # the 'update' topic does not request any change, so for that MQTT topic we just queue a status update
+    if ( command is None ) :
+        my_logger.debug("Update from cloud requested for unit : %s", unit_mac)
+        queue_unit_update_after_command(unit_mac)
+        return
+
+    # if we received a valid MQTT command to send to winix cloud, hand it to the command workers
+    # this thread is the MQTT network thread, it must never wait on the winix cloud
+    attribute, command_values, command_default = command
+    msg_command = command_values.get(msg_text, command_default)
+    command_key = (unit_mac, attribute)
+
+    # show the new state straight away, flagged as pending until the winix cloud confirms it
+    # predicted before it is submitted, with no debounce a worker can send it, and expect() it, before submit() returns
+    if ( settings.OPTIMISTIC_STATE ) :
+        services.command_tracker.predict(command_key, command_status_value(attribute, msg_command))
+        publish_predicted_status(unit_mac)
+
+    try :
+        if not services.command_dispatcher.submit(command_key, msg_command) :
+            my_logger.debug("command replaces one still waiting to be sent : %s %s:%s", unit_mac, attribute, msg_command)
+    except RuntimeError as e :
+        # the dispatcher is shutting down, the command will never be sent, so roll the prediction back
+        my_logger.warning("Winix command " + attribute + ":" + msg_command + " not sent for unit : " + unit_mac + " : " + str(e))
+        if ( settings.OPTIMISTIC_STATE ) :
+            services.command_tracker.discard(command_key, command_status_value(attribute, msg_command))
+            publish_predicted_status(unit_mac)
+
+    return
+
+# rollup queries, request on winix/$SYS/ROLLUP/REQUEST with a JSON message like
+# {"scope" : "room", "key" : "Living Room", "granularity" : "hour", "start" : 1760000000, "end" : 1760086400}
+# the answer goes to winix/$SYS/ROLLUP/RESPONSE, or to "response_topic" if the request has one, with "request_id" copied back
+# start and end are unix seconds, end defaults to now and start to one day before end
+# closed rollups come from the store, the ones still open are computed on the spot
+# when sharded, a unit's rollups come from the shard that owns it, and every shard answers for a room with the
+# rollup of its own units in the room and "shard_id", the caller adds them up
+
+def message_to_rollup(mosq, obj, msg) :
+
+    response = {}
+    response_topic = settings.MQTT_ROLLUP_RESPONSE_TOPIC
+    try :
+        request = json.loads(msg.payload.decode("utf-8"))
+        response_topic = request.get("response_topic", settings.MQTT_ROLLUP_RESPONSE_TOPIC)
+        if "request_id" in request :
+            response["request_id"] = request["request_id"]
+        scope = request.get("scope", SCOPE_UNIT)
+        key = request["key"]
+        granularity = request.get("granularity", "hour")
+        if ( scope not in (SCOPE_UNIT, SCOPE_ROOM) or granularity not in GRANULARITIES ) :
+            raise ValueError("unknown scope or granularity : " + str(scope) + " " + str(granularity))
+        if ( services.shard_membership is not None ) :
+            if ( scope == SCOPE_UNIT and not services.shard_membership.owns(key) ) :
+                return
+            response["shard_id"] = settings.SHARD_ID
+        end = int(request.get("end", time.time()))
+        start = int(request.get("start", end - 86400))
+        response.update({"scope" : scope, "key" : key, "granularity" : granularity, "start" : start, "end" : end})
+        response["rollups"] = rollup_query(scope, key, granularity, start, end)
+    except Exception as e :
+        my_logger.warning("Ignoring rollup request : " + msg.topic + " : " + str(e))
+        response["error"] = str(e)
+
+    publish_message(response_topic, json.dumps(response), "sys")
+
+    return
+
+# closed and open rollups for one unit or room, in time order
+def rollup_query(scope, key, granularity, start, end) :
+    rollups = {summary["start"] : summary for summary in services.rollup_store.rollups(scope, key, granularity, start, end)}
+    for summary in services.rollup_engine.open_summaries(scope, key, granularity, start, end) :
+        rollups[summary["start"]] = summary
+    return [rollups[bucket_start] for bucket_start in sorted(rollups)]
+
+# request the main loop do an update of the current status of this unit from winix cloud
+# rather than waiting for next periodic update
+def queue_unit_update_after_command(unit_mac) :
+    my_logger.debug("command completed, queuing an update request for unit : %s", unit_mac)
+    if not services.queue_unit_request_update.put(unit_mac, PRIORITY_INTERACTIVE) :
+        my_logger.debug("update request for unit already queued : %s", unit_mac)
+
+# send a command to winix cloud for the unit, runs on a command dispatcher worker thread
+def send_unit_command(command_key, msg_command) :
+
+    unit_mac, attribute = command_key
+
+    # key the unit key based on MAC address of unit, and create control URL
+    unit_key = settings.UNITS_BY_MAC[unit_mac].get('key', '')
+    unit_url = settings.COMMAND_URL + unit_key + "/A211/" + attribute + ":" + msg_command
+
+    unit_breaker = services.unit_breakers[unit_mac]
+    if not unit_breaker.allow() :
+        raise CircuitOpenError(unit_breaker.name, unit_breaker.retry_in())
+    my_logger.debug("Requested URL : %s", unit_url)
+    try :
+        unit_raw_json = cloud_request("command", unit_url)
+    except CircuitOpenError :
+        unit_breaker.cancel()
+        raise
+    except Exception :
+        unit_breaker.record_failure()
+        raise
+    unit_breaker.record_success()
+    my_logger.debug("Returned data : %s", unit_raw_json)
+
+    # poll the unit until its status shows the command, rather than once straight away, which mostly reads the old status
+    services.command_tracker.expect(command_key, command_status_value(attribute, msg_command))
+
+    return
+
+# a command could not be sent, log it and carry on with the other units
+# still ask for a status update, so what we publish matches what the unit is actually doing
+def send_unit_command_failed(command_key, msg_command, e) :
+
+    unit_mac, attribute = command_key
+    if ( isinstance(e, CircuitOpenError) ) :
+        my_logger.warning("Winix command " + attribute + ":" + msg_command + " not sent for unit : " + unit_mac + " : " + str(e))
+    else :
+        my_logger.error("Error : Unable to send Winix command " + attribute + ":" + msg_command + " for unit : " + unit_mac + " : " +
+            "".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+    # with optimistic state, the status update rolls back the state predicted for the command
+    services.command_tracker.discard(command_key, command_status_value(attribute, msg_command))
+    queue_unit_update_after_command(unit_mac)
+
+    return
+
+# outcome of each command sent, published on winix/$SYS/COMMAND
+# result is "confirmed" when a status showed the command, or "timeout" when none did within command_confirm_timeout
+def publish_command_result(command_key, status_value, result, seconds) :
+
+    unit_mac, attribute = command_key
+    message = {"timestamp": "{:d}".format(int(time.time()))}
+    message["unit"] = unit_mac
+    message["attribute"] = attribute
+    message["value"] = status_value
+    message["result"] = result
+    message["seconds"] = round(seconds, 3)
+    publish_message(settings.MQTT_TOPIC_BASE + "$SYS/COMMAND", json.dumps(message), "sys")
+
+    return
+
+# a status read on a fetch worker thread shows a command took effect
+def command_confirmed(command_key, status_value, seconds) :
+
+    unit_mac, attribute = command_key
+    services.metric_command_confirm_seconds.observe(seconds, attribute=attribute)
+    my_logger.debug("command %s:%s confirmed in %.1f seconds for unit : %s", attribute, status_value, seconds, unit_mac)
+    publish_command_result(command_key, status_value, "confirmed", seconds)
+
+    return
+
+# no status showed a command in time, the unit may be offline or someone changed it again from the unit or the app
+def command_timed_out(command_key, status_value, seconds) :
+
+    unit_mac, attribute = command_key
+    my_logger.warning("command " + attribute + ":" + status_value + " not confirmed after " + "{:.0f}".format(seconds) + " seconds for unit : " + unit_mac)
+    publish_command_result(command_key, status_value, "timeout", seconds)
+
+    # with optimistic state, a fresh status rolls back the state predicted for the command
+    if ( settings.OPTIMISTIC_STATE ) :
+        queue_unit_update_after_command(unit_mac)
+
+    return
+
+# keep track of the current state of the controls of a unit, from the status we just decoded
+# a control state may have been changed by someone pressing buttons on the front of the unit, or by a command
+# from the winix mobile app, rather than by us
+
+UNIT_STATE_FIELDS = ("power_text", "unit_mode_text", "unit_plasmawave_text", "unit_sleeping_text", "unit_fan_speed_text")
+
+def update_unit_state(unit_mac, message) :
+
+    unit_state = UNITS_BY_MAC_STATE.get(unit_mac)
+    if ( unit_state is None ) :
+        unit_state = {field : "UNKNOWN" for field in UNIT_STATE_FIELDS}
+        UNITS_BY_MAC_STATE[unit_mac] = unit_state
+
+    for field in UNIT_STATE_FIELDS :
+        value = message.get(field, "UNKNOWN")
+        if ( unit_state[field] != value ) :
+            my_logger.debug("%s changed : %s", field, unit_mac)
+            unit_state[field] = value
+
+    return
+
+# function to request a status update for unit from winix cloud
+
+def get_unit_update(unit_mac) :
+
+    # while the unit's circuit breaker is open it is not asked, its last good status is published flagged stale
+    unit_breaker = services.unit_breakers[unit_mac]
+    if not unit_breaker.allow() :
+        my_logger.debug("circuit breaker open, not polling unit : %s", unit_mac)
+        publish_stale_status(unit_mac)
+        return
+
+    try:
+        unit_key = settings.UNITS_BY_MAC[unit_mac].get('key', '')
+        unit_url = settings.GET_STATUS_URL + unit_key
+        my_logger.debug("Requested URL : %s", unit_url)
+        unit_raw_json = cloud_request("status", unit_url, status_request_timeout(unit_mac))
+        my_logger.debug("Returned data : %s", unit_raw_json)
+    except CircuitOpenError as e :
+        # the winix cloud's breaker is open, the unit was not asked so its own breaker learns nothing
+        unit_breaker.cancel()
+        my_logger.debug("not polling unit : %s : %s", unit_mac, str(e))
+        publish_stale_status(unit_mac)
+        return
+    except Exception as e:
+        my_logger.error("Error : Unable to retrieve Winix status URL : " + traceback.format_exc())
+        unit_breaker.record_failure()
+        if ( unit_breaker.state() != BREAKER_CLOSED or services.cloud_breaker.state() != BREAKER_CLOSED ) :
+            publish_stale_status(unit_mac)
+        return
+        # sys.exit(1)
+
+    # the unit was taken out of the config while its status was on the way
+    # the answer is not looked at, but if this poll was the breaker's probe it must be let go, the breaker is kept if
+    # the unit is added back and would otherwise never allow another poll
+    if ( unit_mac not in settings.UNITS_BY_MAC ) :
+        my_logger.debug("unit removed from the config, status not published : %s", unit_mac)
+        unit_breaker.cancel()
+        return
+
+    # time of getting the status of unit from web api, not that this is the retrieval time of data from the web server
+    # the unit may not have updated the web server for a while
+    unit_status_retrieval_ts = int(time.time())
+
+    unit_body_json = unit_raw_json.get("body")
+    unit_data_json = unit_body_json.get("data")
+
+    unit_mac_address = unit_mac
+
+    unit_model = unit_data_json[0].get("modelId")
+    if not is_known_model(unit_model) :
+        my_logger.debug("unit model %s not known, decoding as %s : %s", unit_model, DEFAULT_MODEL, unit_mac)
+
+    # this is the time the unit last sent its status up to the web server
+    unit_update_time_gmt_ts = int(unit_data_json[0].get("utcTimestamp"))
+    # not for a unit that moved to another shard while its status was on the way, its series has been removed
+    if owns_unit(unit_mac) :
+        services.metric_unit_update_age.set(unit_status_retrieval_ts - unit_update_time_gmt_ts, unit=unit_mac)
+
+    message = unit_status_message(unit_mac_address, unit_body_json, unit_data_json[0], unit_status_retrieval_ts)
+
+    # the unit answered with a status we could decode
+    unit_breaker.record_success()
+
+    # the newest status read for the unit, what optimistic state predicts from
+    UNITS_LAST_STATUS[unit_mac_address] = (unit_body_json, unit_data_json[0])
+
+    # commands sent to the unit that this status shows it has taken
+    services.command_tracker.observe(unit_mac_address, unit_data_json[0].get("attributes") or {})
+
+    # the adaptive scheduler learns the unit's upload period from the cloud timestamps
+    if ( services.unit_scheduler is not None ) :
+        services.unit_scheduler.observe(unit_mac_address, unit_update_time_gmt_ts, powered=(message["power_text"] != "OFF"))
+
+    # track the control states of the unit in process, rather than reading back the status we publish
+    update_unit_state(unit_mac_address, message)
+
+    # every reading goes into the local history and the rollups, whether or not it is published
+    reading = reading_from_status(unit_mac_address, message)
+    if ( services.history_store is not None ) :
+        try :
+            services.history_store.append(reading)
+        except Exception as e :
+            my_logger.error("Error : Unable to write history for unit : " + unit_mac_address + " : " + traceback.format_exc())
+    try :
+        services.rollup_engine.add(unit_mac_address, message["room"], dict(zip(COLUMNS, reading)))
+    except Exception as e :
+        my_logger.error("Error : Unable to update rollups for unit : " + unit_mac_address + " : " + traceback.format_exc())
+
+    # with optimistic state, commands that the status doesn't show yet are published as if it did, until they are
+    # confirmed or time out, so home assistant doesn't flip back to the old state while the unit catches up
+    if ( settings.OPTIMISTIC_STATE ) :
+        expected = services.command_tracker.expected(unit_mac_address)
+        if expected :
+            message = predicted_status_message(unit_mac_address, unit_body_json, unit_data_json[0], unit_status_retrieval_ts, expected)
+
+    publish_unit_status(unit_mac_address, unit_update_time_gmt_ts, message)
+
+    return
+
+# the status message for a unit, from one entry of the "data" list in the cloud response and the time it was read
+def unit_status_message(unit_mac, unit_body_json, unit_data, unit_status_retrieval_ts) :
+
+    unit_update_time_gmt_ts = int(unit_data.get("utcTimestamp"))
+
+    update_age_timedelta = datetime.fromtimestamp(unit_status_retrieval_ts) - datetime.fromtimestamp(unit_update_time_gmt_ts)
+    update_age_text = str(update_age_timedelta)
+
+    # create dictionary to be converted to JSON string
+    message = {"timestamp": "{:d}".format(unit_status_retrieval_ts)}
+
+    message["unit_update_ts"] = str(unit_update_time_gmt_ts)
+    message["update_age_text"] = update_age_text
+    message["unit_model"] = unit_data.get("modelId")
+    message["home"] = settings.UNITS_BY_MAC[unit_mac]["home"]
+    message["room"] = settings.UNITS_BY_MAC[unit_mac]["room"]
+    # decoded attributes, power, sleeping, air quality, plasmawave, mode, fan speed, filter hours, ambient light and rssi
+    message.update(decode_status(unit_data))
+    # "YES" when the status could not be read from the winix cloud, and this is the last one that could
+    message["stale"] = "NO"
+    # with optimistic state, "YES" when the message shows commands the winix cloud has not confirmed yet
+    if ( settings.OPTIMISTIC_STATE ) :
+        message["command_pending"] = "NO"
+    message["unit_body_json"] = unit_body_json
+
+    return message
+
+# the status message a unit will have once it has taken the commands still pending for it
+# expected is {attribute : status value}, decoded by the same tables as a status read from the cloud
+# unit_body_json is left as the cloud sent it
+def predicted_status_message(unit_mac, unit_body_json, unit_data, unit_status_retrieval_ts, expected) :
+
+    unit_data = dict(unit_data)
+    unit_data["attributes"] = dict(unit_data.get("attributes") or {}, **expected)
+    message = unit_status_message(unit_mac, unit_body_json, unit_data, unit_status_retrieval_ts)
+    message["command_pending"] = "YES"
+
+    return message
+
+# with optimistic state, publish what a unit's status will be once a command just received over MQTT has been taken
+# runs on the MQTT thread, from the last status read for the unit, nothing is published before the first one
+def publish_predicted_status(unit_mac) :
+
+    last_status = UNITS_LAST_STATUS.get(unit_mac)
+    if ( last_status is None ) :
+        return
+
+    unit_body_json, unit_data = last_status
+    message = predicted_status_message(unit_mac, unit_body_json, unit_data, int(time.time()), services.command_tracker.expected(unit_mac))
+    publish_unit_status(unit_mac, None, message)
+
+    return
+
+# while a unit or the winix cloud can't be asked, publish the unit's last good status again, flagged stale
+# nothing is published before the unit's first good status
+def publish_stale_status(unit_mac) :
+
+    last_status = UNITS_LAST_STATUS.get(unit_mac)
+    if ( last_status is None ) :
+        return
+
+    unit_body_json, unit_data = last_status
+    message = unit_status_message(unit_mac, unit_body_json, unit_data, int(time.time()))
+    message["stale"] = "YES"
+    services.metric_stale_status.inc()
+    publish_unit_status(unit_mac, None, message)
+
+    return
+
+# publish a unit's status message in the configured payload profile, if it has changed since the last publish
+# a stale message or one with a command pending doesn't match its cloud timestamp, so it is recorded without one
+def publish_unit_status(unit_mac_address, unit_update_ts, message) :
+
+    if ( message.get("command_pending") == "YES" or message.get("stale") == "YES" ) :
+        unit_update_ts = None
+
+    # skip the publish if nothing has changed since the last one we sent for this unit
+    publish_reason = unit_status_changed(unit_mac_address, unit_update_ts, message)
+    if not publish_reason :
+        my_logger.debug("unit status unchanged, not publishing : %s", unit_mac_address)
+        return
+
+    # each field on its own topic, only the fields that changed, all of them on a heartbeat
+    if ( settings.PAYLOAD_PROFILE == PAYLOAD_FIELDS ) :
+        for field, payload in field_publisher.changes(unit_mac_address, compact_message(message), force=(publish_reason == "heartbeat")) :
+            publish_message(settings.MQTT_TOPIC_BASE + unit_mac_address + FIELD_TOPIC + field, payload, "field", retain=settings.PUBLISH_RETAIN)
+            my_logger.debug("publishing field : |%s%s%s%s| |%s|", settings.MQTT_TOPIC_BASE, unit_mac_address, FIELD_TOPIC, field, payload)
+        return
+
+    # Publish message to topic
+    # create JSON string
+    # doing the json.dumps forces single quotes to double quotes, which json likes better
+    if ( settings.PAYLOAD_PROFILE == PAYLOAD_COMPACT ) :
+        message_to_publish = json.dumps(compact_message(message), separators=(",", ":"))
+    else :
+        message_to_publish = json.dumps(message)
+    publish_message(settings.MQTT_TOPIC_BASE + unit_mac_address + MQTT_STATUS_TOPIC, message_to_publish, "status", retain=settings.PUBLISH_RETAIN)
+    my_logger.debug("publishing on topic : |%s%s%s|", settings.MQTT_TOPIC_BASE, unit_mac_address, MQTT_STATUS_TOPIC)
+    my_logger.debug("publishing message : |%s|", message_to_publish)
+
+    return
+
+# decide whether a freshly fetched status for a unit needs publishing, and if so record it as the last published
+# the status has changed if any of the published fields differ, whether or not the unit uploaded to the cloud since
+# the last fetch, a config reload or a prediction rolled back changes them without a new upload. an unchanged status
+# is still published once the heartbeat interval has passed
+# returns "changed" or "heartbeat" when the status is to be published, None when it is not
+
+def unit_status_changed(unit_mac, unit_update_ts, message) :
+
+    now = time.monotonic()
+    state = {field : value for field, value in message.items() if field not in PUBLISH_VOLATILE_FIELDS}
+
+    with units_last_published_lock :
+        last = UNITS_LAST_PUBLISHED.get(unit_mac)
+
+        if last is not None :
+            # the cloud timestamp is only an extra check, a new upload is a change even if the fields compare equal
+            unchanged = last["state"] == state and (unit_update_ts is None or last["unit_update_ts"] in (None, unit_update_ts))
+            heartbeat_due = settings.PUBLISH_HEARTBEAT_SECONDS > 0 and now - last["published_at"] >= settings.PUBLISH_HEARTBEAT_SECONDS
+            if unchanged and not heartbeat_due :
+                # remember the cloud timestamp, so the next fetch compares against the newest upload
+                last["unit_update_ts"] = unit_update_ts
+                PUBLISH_COUNTS["unchanged"] += 1
+                return None
+            if unchanged :
+                PUBLISH_COUNTS["heartbeat"] += 1
+
+        UNITS_LAST_PUBLISHED[unit_mac] = {"unit_update_ts" : unit_update_ts, "state" : state, "published_at" : now}
+        PUBLISH_COUNTS["published"] += 1
+
+    return "heartbeat" if last is not None and unchanged else "changed"
+
+# runs on a fetch engine worker thread, an unexpected error decoding one unit must not kill the worker
+# the api rate is enforced by the token bucket inside get_unit_update, so there is no sleep here
+
+def fetch_unit_update(unit_mac) :
+
+    try :
+        get_unit_update(unit_mac)
+    except Exception as e :
+        # a status that can't be decoded counts against the unit, a bad key gets an answer with no data in it
+        services.unit_breakers[unit_mac].record_failure()
+        my_logger.error("Error : Unable to process Winix status for unit : " + unit_mac + " : " + traceback.format_exc())
+        if ( services.unit_breakers[unit_mac].state() != BREAKER_CLOSED ) :
+            publish_stale_status(unit_mac)
+    finally :
+        sweep_unit_done(unit_mac)
+        # schedule the unit's next poll from what this one found, if it was a scheduled poll
+        if ( services.unit_scheduler is not None ) :
+            services.unit_scheduler.complete(unit_mac)
+
+    return
+
+# a unit has been fetched, or tried, time it from its slot if the sweep was waiting for it
+def sweep_unit_done(unit_mac) :
+
+    with sweep_lock :
+        slot_due = SWEEP_PENDING.pop(unit_mac, None)
+        if slot_due is None :
+            return
+        sweep_seconds = time.monotonic() - slot_due
+        SWEEP_SLOWEST[0] = max(SWEEP_SLOWEST[0], sweep_seconds)
+
+    services.metric_sweep_seconds.observe(sweep_seconds)
+
+# the wheel handed out units whose slot came round, the sweep waits for each of them until its deadline
+# a unit whose slot comes round again before it was fetched, or missed its deadline, is an overrun
+def sweep_units_due(due) :
+
+    overruns = 0
+    with sweep_lock :
+        for unit_mac, slot_due in due :
+            if SWEEP_PENDING.pop(unit_mac, None) is not None :
+                overruns += 1
+            SWEEP_PENDING[unit_mac] = slot_due
+
+    if overruns :
+        services.metric_sweep_overruns.inc(overruns)
+
+    return
+
+# read timeout for a unit's status request, no longer than what is left until the unit's sweep deadline if the sweep
+# is still waiting for it
+def status_request_timeout(unit_mac) :
+
+    with sweep_lock :
+        slot_due = SWEEP_PENDING.get(unit_mac)
+        if slot_due is None :
+            return settings.API_READ_TIMEOUT_SECONDS
+        remaining = slot_due + settings.SWEEP_DEADLINE_SECONDS - time.monotonic()
+
+    return max(1.0, min(settings.API_READ_TIMEOUT_SECONDS, remaining))
+
+# seconds until the next sweep deadline, None if the sweep is not waiting on any unit
+def sweep_deadline_seconds() :
+
+    with sweep_lock :
+        if not SWEEP_PENDING :
+            return None
+        return next(iter(SWEEP_PENDING.values())) + settings.SWEEP_DEADLINE_SECONDS - time.monotonic()
+
+# the units whose sweep deadline has passed are counted as missed, and fetched as usual later
+def check_sweep_deadline() :
+
+    now = time.monotonic()
+    missed = 0
+    with sweep_lock :
+        while SWEEP_PENDING :
+            unit_mac, slot_due = next(iter(SWEEP_PENDING.items()))
+            if ( now < slot_due + settings.SWEEP_DEADLINE_SECONDS ) :
+                break
+            del SWEEP_PENDING[unit_mac]
+            SWEEP_SLOWEST[0] = max(SWEEP_SLOWEST[0], now - slot_due)
+            missed += 1
+
+    if missed :
+        services.metric_sweep_deadline_missed.inc(missed)
+        my_logger.warning("sweep deadline passed, units not fetched : " + str(missed))
+
+    return
+
+# housekeeping on a regular basis, called from the main loop every CHECK_PERIOD_MINUTES
+# the units themselves are queued by poll_due_units, each in its slot of the interval
+def periodic_update_units():
+
+    if ( settings.POLL_SCHEDULE == "sweep" ) :
+        # a turn of the poll wheel starts, record how long the slowest unit of the turn just ended took to be fetched
+        with sweep_lock :
+            sweep_seconds = SWEEP_SLOWEST[0]
+            SWEEP_SLOWEST[0] = 0.0
+        services.metric_sweep_last_seconds.set(round(sweep_seconds, 3))
+        my_logger.debug("sweep, slowest unit fetched %.1f seconds after its slot", sweep_seconds)
+
+    # close the rollups no reading can add to any more, they are saved to the rollup store
+    try :
+        services.rollup_engine.flush()
+    except Exception as e :
+        my_logger.error("Error : Unable to save rollups : " + traceback.format_exc())
+
+    if my_logger.isEnabledFor(logging.DEBUG) :
+        my_logger.debug("api connection pool : %s", api_pool_stats_text())
+        my_logger.debug("update queue : %s", update_queue_stats_text())
+
+    return
+
+# queue the units whose poll is due, from the poll wheel or the adaptive scheduler, called from the main loop
+def poll_due_units() :
+
+    if ( settings.POLL_SCHEDULE == "sweep" ) :
+        due = services.poll_wheel.pop_due(with_due=True)
+        sweep_units_due(due)
+        due_units = [unit_mac for unit_mac, slot_due in due]
+    else :
+        due_units = services.unit_scheduler.pop_due()
+
+    for unit_mac in due_units :
+        my_logger.debug("scheduled poll, queueing status update request for : %s", unit_mac)
+        if not services.queue_unit_request_update.put(unit_mac, PRIORITY_BACKGROUND) :
+            my_logger.debug("scheduled poll, unit still waiting from previous update : %s", unit_mac)
+
+    return
+
+# one line summary of how the units are spread over the check interval, for the log
+def poll_wheel_stats_text() :
+    stats = services.poll_wheel.stats()
+    return "{:d} units in {:d} slots of {:.1f} seconds, per slot min {:d}, max {:d}, mean {:.2f}, stdev {:.2f}".format(
+        stats["units"], stats["slots"], stats["slot_seconds"], stats["slot_min"], stats["slot_max"], stats["slot_mean"], stats["slot_stdev"])
+
+# one line summary of the adaptive polling counters for the log
+def poll_stats_text() :
+    stats = services.unit_scheduler.stats()
+    return "new {:d}, stale {:d}, off {:d}, failed {:d}, deferred by budget {:d}".format(
+        stats["polls_new"], stats["polls_stale"], stats["polls_off"], stats["polls_failed"], stats["deferred"])
+
+# one line summary of the update queue counters for the log
+def update_queue_stats_text() :
+    stats = services.queue_unit_request_update.stats()
+    return "depth {:d} (interactive {:d}, background {:d}), queued {:d}, coalesced {:d}, promoted {:d}, dispatched {:d}, starvation guarded {:d}".format(
+        stats["depth"], stats["depth_interactive"], stats["depth_background"], stats["queued"], stats["coalesced"],
+        stats["promoted"], stats["dispatched"], stats["starvation_guarded"])
+
+# one line summary of the command dispatcher counters for the log
+def command_stats_text() :
+    stats = services.command_dispatcher.stats()
+    return "submitted {:d}, debounced {:d}, sent {:d}, failed {:d}, waiting {:d}, in flight {:d}".format(
+        stats["submitted"], stats["debounced"], stats["sent"], stats["failed"], stats["waiting"], stats["in_flight"])
+
+# one line summary of the command confirmation counters for the log
+def command_confirm_stats_text() :
+    stats = services.command_tracker.stats()
+    return "tracked {:d}, confirmed {:d}, timed out {:d}, replaced {:d}, re-polls {:d}, waiting {:d}".format(
+        stats["tracked"], stats["confirmed"], stats["timed_out"], stats["replaced"], stats["repolls"], stats["pending"])
+
+# one line summary of the circuit breakers for the log
+def breaker_stats_text() :
+    stats = services.cloud_breaker.stats()
+    units_open = [breaker.name for breaker in services.unit_breakers.values() if breaker.state() != BREAKER_CLOSED]
+    return "winix cloud {}, trips {:d}, rejected {:d}, unit trips {:d}, rejected {:d}, units not closed {:d} {}".format(
+        stats["state"], stats["trips"], stats["rejected"], sum(breaker.trips for breaker in services.unit_breakers.values()),
+        sum(breaker.rejected for breaker in services.unit_breakers.values()), len(units_open), " ".join(units_open))
+
+# (kind, quantile, seconds) of the recent winix cloud request latencies, the tail latency stats
+def cloud_latency_quantiles() :
+    quantiles = []
+    for kind, latencies in services.cloud_latencies.items() :
+        for quantile, percent in (("0.5", 50), ("0.95", 95), ("0.99", 99)) :
+            value = latencies.percentile(percent)
+            if ( value is not None ) :
+                quantiles.append((kind, quantile, value))
+    return quantiles
+
+# one line summary of the recent winix cloud request latencies, and hedging, for the log
+def cloud_latency_stats_text() :
+    text = " ".join("{} p{:.0f} {:.0f} ms".format(kind, float(quantile) * 100, value * 1000) for kind, quantile, value in cloud_latency_quantiles())
+    if ( services.status_hedger is not None ) :
+        stats = services.status_hedger.stats()
+        text += ", hedged {:d} of {:d}, hedge answered first {:d}".format(stats["hedged"], stats["calls"], stats["hedge_won"])
+    return text
+
+# one line summary of the shards for the log
+def shard_stats_text() :
+    return "shard {}, members {}, units owned {:d}, rebalances {:d}, units gained {:d}, lost {:d}, members expired {:d}".format(
+        settings.SHARD_ID, " ".join(services.shard_membership.members()), len(services.owned_units), SHARD_COUNTS["rebalances"], SHARD_COUNTS["gained"],
+        SHARD_COUNTS["lost"], services.shard_membership.expired)
+
+# one line summary of the api connection pool counters for the log
+def api_pool_stats_text() :
+    stats = services.api_pool.stats()
+    return "requests {:d}, connections opened {:d}, reused {:d}, dropped {:d}, idle {:d}, reuse rate {:.1%}".format(
+        stats["requests"], stats["connections_opened"], stats["connections_reused"],
+        stats["connections_dropped"], stats["connections_idle"], stats["reuse_rate"])
+
+# at the day rollover, publish the rollup of the day just ended for each room on winix/$SYS/ROLLUP/DAY
+# when sharded each shard publishes the rollups of its own units on winix/$SYS/ROLLUP/DAY/<shard_id>
+# the day is still open, readings for it can arrive for another rollup_max_gap seconds, so this is the rollup as it
+# stands at midnight, the final one is saved when it closes and can be asked for on $SYS/ROLLUP/REQUEST
+def publish_prior_day_rollups() :
+
+    yesterday = datetime.combine(datetime.now().date() - timedelta(days=1), datetime.min.time()).timestamp()
+    message = {"timestamp": "{:d}".format(int(time.time())), "granularity" : "day", "start" : int(yesterday), "rooms" : {}}
+    for room in sorted({settings.UNITS[unit]["room"] for unit in settings.UNITS}) :
+        rollups = rollup_query(SCOPE_ROOM, room, "day", int(yesterday), int(yesterday) + 1)
+        if rollups :
+            message["rooms"][room] = rollups[0]
+    publish_message(settings.MQTT_TOPIC_BASE + "$SYS/ROLLUP/DAY" + settings.SHARD_TOPIC_SUFFIX, json.dumps(message), "sys", retain=settings.PUBLISH_RETAIN)
+    my_logger.info("rollups : open {open:d}, closed {closed:d}, units {units:d}".format(**services.rollup_engine.stats()))
+
+    return
+
+# publish the metrics on winix/$SYS/METRICS, winix/$SYS/METRICS/<shard_id> when sharded
+def publish_metrics() :
+
+    message = {"timestamp": "{:d}".format(int(time.time())), "metrics" : services.metrics.snapshot()}
+    publish_message(settings.MQTT_TOPIC_BASE + "$SYS/METRICS" + settings.SHARD_TOPIC_SUFFIX, json.dumps(message, separators=(",", ":")), "sys")
+
+    return
+
+# what is known about each unit, for the snapshot, unit_mac -> {published, status, state, fields, schedule}
+# and where the poll wheel is in its turn. times are wall clock, the monotonic clock starts again with the next run
+def snapshot_state() :
+
+    now = time.monotonic()
+    wall_now = time.time()
+    units = {}
+    with units_last_published_lock :
+        for unit_mac, last in UNITS_LAST_PUBLISHED.items() :
+            units.setdefault(unit_mac, {})["published"] = {"unit_update_ts" : last["unit_update_ts"], "state" : last["state"],
+                "published_at" : wall_now - (now - last["published_at"])}
+    # the other dictionaries have whole entries replaced by the fetch threads, a copy of the items is consistent enough
+    for unit_mac, status in list(UNITS_LAST_STATUS.items()) :
+        units.setdefault(unit_mac, {})["status"] = list(status)
+    for unit_mac, unit_state in list(UNITS_BY_MAC_STATE.items()) :
+        units.setdefault(unit_mac, {})["state"] = dict(unit_state)
+    for unit_mac, fields in field_publisher.export_state().items() :
+        units.setdefault(unit_mac, {})["fields"] = fields
+    if ( services.unit_scheduler is not None ) :
+        for unit_mac, schedule in services.unit_scheduler.export_state().items() :
+            units.setdefault(unit_mac, {})["schedule"] = schedule
+    tick, elapsed = services.poll_wheel.position(now)
+
+    return {"units" : units, "poll_wheel" : {"slots" : services.poll_wheel.slots, "interval" : services.poll_wheel.interval, "tick" : tick, "elapsed" : elapsed}}
+
+# write the snapshot, called from the main loop and when the program stops
+def save_snapshot() :
+
+    start = time.monotonic()
+    try :
+        size = write_snapshot(WORKING_DIRECTORY + settings.SNAPSHOT_FILE, snapshot_state())
+    except Exception as e :
+        services.metric_snapshot_writes.inc(result="failed")
+        my_logger.error("Error : Unable to write snapshot : " + WORKING_DIRECTORY + settings.SNAPSHOT_FILE + " : " + traceback.format_exc())
+        return
+    services.metric_snapshot_writes.inc(result="ok")
+    services.metric_snapshot_write_seconds.set(round(time.monotonic() - start, 4))
+    services.metric_snapshot_bytes.set(size)
+
+    return
+
+# carry on from the snapshot of the last run, for the units in the config that this instance owns
+# the last published status of each unit is restored, so a status that has not changed since is not published again,
+# the adaptive scheduler gets its due times and learned upload periods back, and the poll wheel carries on from where
+# it was, so only the units whose poll came due while the program was down are polled straight away
+# returns the seconds until the poll wheel starts its next turn, None without a snapshot it could use
+def restore_snapshot() :
+
+    if ( settings.SNAPSHOT_FILE == "" ) :
+        return None
+    try :
+        snapshot = read_snapshot(WORKING_DIRECTORY + settings.SNAPSHOT_FILE)
+        if ( snapshot is None ) :
+            my_logger.info("no snapshot, polling every unit : " + WORKING_DIRECTORY + settings.SNAPSHOT_FILE)
+            return None
+        state, written = snapshot
+        # not the units another shard owns now, their last published status would hold back the first publish if they
+        # are handed to this shard later, and the other shard may have published newer since
+        units = {unit_mac : unit for unit_mac, unit in state["units"].items() if owns_unit(unit_mac)}
+    except Exception as e :
+        my_logger.error("Error : Unable to read snapshot, polling every unit : " + WORKING_DIRECTORY + settings.SNAPSHOT_FILE + " : " + str(e))
+        return None
+
+    now = time.monotonic()
+    age = max(0.0, time.time() - written)
+    with units_last_published_lock :
+        for unit_mac, unit in units.items() :
+            if "published" in unit :
+                published = unit["published"]
+                UNITS_LAST_PUBLISHED[unit_mac] = {"unit_update_ts" : published["unit_update_ts"], "state" : published["state"],
+                    "published_at" : now - (time.time() - published["published_at"])}
+    for unit_mac, unit in units.items() :
+        if "status" in unit :
+            UNITS_LAST_STATUS[unit_mac] = tuple(unit["status"])
+        if "state" in unit :
+            UNITS_BY_MAC_STATE[unit_mac] = unit["state"]
+    field_publisher.restore_state({unit_mac : unit["fields"] for unit_mac, unit in units.items() if "fields" in unit})
+    scheduled = 0
+    if ( services.unit_scheduler is not None ) :
+        scheduled = services.unit_scheduler.restore_state({unit_mac : unit["schedule"] for unit_mac, unit in units.items() if "schedule" in unit})
+
+    # the wheel only carries on if it is cut the same way, otherwise the units are in other slots
+    next_turn_seconds = None
+    wheel = state.get("poll_wheel")
+    if ( wheel is not None and wheel["slots"] == services.poll_wheel.slots and wheel["interval"] == services.poll_wheel.interval ) :
+        elapsed = wheel["elapsed"] + age
+        services.poll_wheel.resume(wheel["tick"], elapsed)
+        next_turn_seconds = settings.CHECK_PERIOD_SECONDS - elapsed % settings.CHECK_PERIOD_SECONDS
+
+    my_logger.info("snapshot restored, {:.0f} seconds old, units {:d}, scheduled {:d}, poll wheel {}".format(
+        age, len(units), scheduled, "resumed" if next_turn_seconds is not None else "restarted"))
+
+    return next_turn_seconds
+
+# a shard's lease on winix/$SYS/SHARDS/<shard_id> arrived, or was cleared with an empty message
+def message_to_shard(mosq, obj, msg) :
+
+    member = msg.topic[len(settings.MQTT_SHARD_TOPIC):]
+    try :
+        if not msg.payload :
+            services.shard_membership.remove(member)
+            return
+        lease = json.loads(msg.payload.decode("utf-8"))
+        services.shard_membership.update(member, float(lease["lease"]))
+    except Exception as e :
+        my_logger.warning("Ignoring shard lease : " + msg.topic + " : " + str(e))
+
+    return
+
+# publish this shard's lease, retained so a shard that starts later sees it straight away
+def publish_shard_lease() :
+
+    message = {"timestamp": "{:d}".format(int(time.time())), "shard_id" : settings.SHARD_ID, "lease" : settings.SHARD_LEASE_SECONDS}
+    message["units"] = len(services.owned_units)
+    publish_message(settings.MQTT_SHARD_TOPIC + settings.SHARD_ID, json.dumps(message), "sys", retain=True)
+
+    return
+
+# drop the shards whose lease ran out, they hang without their connection dropping, so their last will didn't clear
+# their lease. it is cleared here, so shards that start later don't wait for it to run out too
+def expire_shard_leases() :
+
+    for member in services.shard_membership.expire() :
+        my_logger.warning("shard lease ran out : " + member)
+        publish_message(settings.MQTT_SHARD_TOPIC + member, "", "sys", retain=True)
+
+    return
+
+# config keys reload_config applies, a change to any other key is logged as waiting for a restart
+# the defaults worked out from check_interval at start, like poll_max_interval, keep their start values, except for
+# sweep_deadline and poll_budget_per_hour
+RELOAD_CONFIG_KEYS = ("units", "check_interval", "debug_level", "rsyslog", "config_watch")
+
+# read the config file again if it changed since it was last read, called from the main loop
+# a file that can't be read or parsed is logged, and the running config kept
+def check_config_file() :
+
+    signature = config_file_signature()
+    if ( signature is None or signature == settings.LOADED_CONFIG[1] ) :
+        return
+    settings.LOADED_CONFIG[1] = signature
+    try :
+        config = yaml.load(Path(CONFIG_FILE).read_text(), Loader=yaml.FullLoader)
+        units = config.get("units", {})
+        units_by_mac = {units[unit]['mac_address'] : units[unit] for unit in units}
+    except Exception as e :
+        my_logger.error("Error : configuration file not reloaded, keeping the running config : " + CONFIG_FILE + " : " + str(e))
+        return
+
+    reload_config(config, units, units_by_mac)
+
+    return
+
+# apply a changed config to the running program
+# only the units added, removed or moved between shards are touched, the others keep their place in the poll wheel,
+# their learned upload period, their circuit breaker and their last published status. a new unit is polled at its
+# offset into the check interval, like the units at start, so a reload makes no extra winix cloud requests
+def reload_config(config, units, units_by_mac) :
+
+    settings.LOADED_CONFIG[0] = config
+
+    # the threads that read the unit dictionaries get either the old or the new one, they are replaced, never changed
+    # a removed unit keeps its circuit breaker, a fetch still in flight for it records its result there
+    added = set(units_by_mac) - set(settings.UNITS_BY_MAC)
+    removed = set(settings.UNITS_BY_MAC) - set(units_by_mac)
+    changed = [unit_mac for unit_mac in units_by_mac if unit_mac in settings.UNITS_BY_MAC and units_by_mac[unit_mac] != settings.UNITS_BY_MAC[unit_mac]]
+    if ( added or removed or changed ) :
+        breakers = dict(services.unit_breakers)
+        for unit_mac in added :
+            if ( unit_mac not in breakers ) :
+                breakers[unit_mac] = CircuitBreaker(unit_mac, failures=settings.UNIT_BREAKER_FAILURES, reset=settings.UNIT_BREAKER_RESET_SECONDS,
+                    max_reset=settings.BREAKER_MAX_RESET_SECONDS, on_change=circuit_breaker_changed)
+        services.unit_breakers = breakers
+        with shard_lock :
+            settings.UNITS = units
+            settings.UNITS_BY_MAC = units_by_mac
+        update_owned_units()
+        my_logger.info("config reloaded, units added {:d}, removed {:d}, changed {:d}, owned {:d}".format(
+            len(added), len(removed), len(changed), len(services.owned_units)))
+
+    check_minutes = config.get("check_interval", 5)
+    if ( check_minutes != settings.CHECK_PERIOD_MINUTES ) :
+        settings.CHECK_PERIOD_MINUTES = check_minutes
+        settings.CHECK_PERIOD_SECONDS = settings.CHECK_PERIOD_MINUTES * 60
+        services.poll_wheel.set_interval(settings.CHECK_PERIOD_SECONDS)
+        if ( services.unit_scheduler is not None ) :
+            services.unit_scheduler.default_interval = float(settings.CHECK_PERIOD_SECONDS)
+        if ( "sweep_deadline" not in config ) :
+            settings.SWEEP_DEADLINE_SECONDS = settings.CHECK_PERIOD_SECONDS
+        my_logger.info("config reloaded, check interval : " + str(settings.CHECK_PERIOD_MINUTES) + " minutes")
+
+    # the default poll budget is what polling every unit every check_interval costs
+    if ( services.unit_scheduler is not None and "poll_budget_per_hour" not in config ) :
+        budget = len(settings.UNITS) * 3600 / settings.CHECK_PERIOD_SECONDS
+        if ( budget != settings.POLL_BUDGET_PER_HOUR ) :
+            settings.POLL_BUDGET_PER_HOUR = budget
+            services.unit_scheduler.set_budget(settings.POLL_BUDGET_PER_HOUR, burst=max(len(settings.UNITS), settings.POLL_BUDGET_PER_HOUR / 60))
+
+    debug_level = config.get("debug_level", "") or "INFO"
+    if ( debug_level != settings.DEBUG_LEVEL ) :
+        try :
+            logs.handler_file.setLevel(logging.getLevelName(debug_level))
+            settings.DEBUG_LEVEL = debug_level
+            my_logger.info("config reloaded, debug level : " + settings.DEBUG_LEVEL)
+        except ValueError as e :
+            my_logger.error("Error : unknown debug_level : " + str(debug_level) + " , keeping : " + settings.DEBUG_LEVEL)
+
+    # the log listener writes to the handlers it is given, swap in the new rsyslog handler and close the old one
+    # the listener is stopped for the swap, so its thread is not still writing to the old handler when it is closed,
+    # records logged meanwhile wait on the queue and are written when it starts again
+    rsyslog_server = config.get("rsyslog", "")
+    if ( rsyslog_server != settings.RSYSLOG_SERVER ) :
+        settings.RSYSLOG_SERVER = rsyslog_server
+        settings.LOG_RSYSLOG = (settings.RSYSLOG_SERVER, 514)
+        old_handlers = logs.handlers[1:]
+        del logs.handlers[1:]
+        if ( settings.RSYSLOG_SERVER != "" ) :
+            handler_rsyslog = logging.handlers.SysLogHandler(address = settings.LOG_RSYSLOG)
+            handler_rsyslog.setFormatter(log_formatter)
+            handler_rsyslog.setLevel(logging_level_rsyslog)
+            logs.handlers.append(handler_rsyslog)
+        logs.listener.stop()
+        logs.listener.handlers = tuple(logs.handlers)
+        logs.listener.start()
+        for handler in old_handlers :
+            handler.close()
+        my_logger.info("config reloaded, rsyslog : " + str(settings.LOG_RSYSLOG))
+    root_logger.setLevel(min(handler.level for handler in logs.handlers))
+
+    settings.CONFIG_WATCH_SECONDS = config.get("config_watch", 5)
+
+    # against the config the program started with, so a change is reported at every reload until the restart
+    restart_keys = sorted(key for key in set(config) | set(settings.PROGRAM_CONFIG) if key not in RELOAD_CONFIG_KEYS and config.get(key) != settings.PROGRAM_CONFIG.get(key))
+    if ( restart_keys ) :
+        my_logger.warning("config reloaded, changes that wait for a restart : " + " ".join(restart_keys))
+
+    return
+
+# number of seconds from now until local midnight, when the main loop has to wake up for the day rollover
+def seconds_until_midnight() :
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds()
+
+def main():
+
+    global logs, settings, services
+
+    logs = setup_logging()
+    settings = configure(*load_config())
+    configure_logging()
+    log_settings()
+    services = start_services()
+
+    # keep track of transition to new day at midnight local time
+    # at rollover, reset the tracking of duplicate incident id
+    current_day = datetime.now().timetuple().tm_yday
+
+    try :
+        # Add message callbacks that will only trigger on a specific subscription match.
+        services.mqttc.message_callback_add(settings.MQTT_CONTROL_SUBSCRIPTION, message_to_unit)
+        services.mqttc.subscribe(settings.MQTT_CONTROL_SUBSCRIPTION, 0)
+        services.mqttc.message_callback_add(settings.MQTT_ROLLUP_REQUEST_TOPIC, message_to_rollup)
+        services.mqttc.subscribe(settings.MQTT_ROLLUP_REQUEST_TOPIC, 0)
+        if ( services.shard_membership is not None ) :
+            services.mqttc.message_callback_add(settings.MQTT_SHARD_TOPIC + "+", message_to_shard)
+            services.mqttc.subscribe(settings.MQTT_SHARD_TOPIC + "+", 0)
+
+        message = {"timestamp": "{:d}".format(int(datetime.now().timestamp()))}
+        message["program_version"] = PROGRAM_NAME + " Version : " + VERSION_MAJOR + "." + VERSION_MINOR
+        message["status"] = "START"
+        message["unit_check_interval"] = settings.CHECK_PERIOD_MINUTES
+        if ( settings.SHARD_ID ) :
+            message["shard_id"] = settings.SHARD_ID
+        publish_message(settings.MQTT_TOPIC_BASE + "$SYS/STATUS" + settings.SHARD_TOPIC_SUFFIX, json.dumps(message), "sys")
+        my_logger.info("Program start : " + PROGRAM_NAME + " Version : " + VERSION_MAJOR + "." + VERSION_MINOR)
+
+        # Start mqtt
+        services.mqttc.loop_start()
+
+        # a shard takes its lease, waits for the other shards' retained leases to arrive, then takes its units
+        # deadline of the next lease renewal, never if not sharded
+        next_shard_renew = float("inf")
+        if ( services.shard_membership is not None ) :
+            publish_shard_lease()
+            time.sleep(settings.SHARD_SETTLE_SECONDS)
+            with shard_lock :
+                services.shard_settled = True
+            shard_rebalance()
+            next_shard_renew = time.monotonic() + settings.SHARD_LEASE_SECONDS / 3
+
+        # get the initial state of all the winix units from winix cloud, spread over the first interval
+        # or carry on from the snapshot of the last run, the first periodic update is then at the next turn of the wheel
+        my_logger.info("poll wheel : " + poll_wheel_stats_text())
+        services.poll_wheel.start()
+        next_turn_seconds = restore_snapshot()
+        if ( next_turn_seconds is None ) :
+            periodic_update_units()
+            next_turn_seconds = settings.CHECK_PERIOD_SECONDS
+        poll_due_units()
+
+        # deadline of the next periodic update of all units, on the monotonic clock so wall clock changes don't matter
+        next_periodic_update = time.monotonic() + next_turn_seconds
+        # deadline of the next metrics publish, never if metrics are not published
+        next_metrics_publish = time.monotonic() + settings.METRICS_INTERVAL_SECONDS if settings.METRICS_INTERVAL_SECONDS > 0 else float("inf")
+        # deadline of the next snapshot, never if there is no snapshot
+        next_snapshot = time.monotonic() + settings.SNAPSHOT_INTERVAL_SECONDS if settings.SNAPSHOT_FILE != "" and settings.SNAPSHOT_INTERVAL_SECONDS > 0 else float("inf")
+        # deadline of the next check of the config file for changes, never if it is not watched
+        next_config_check = time.monotonic() + settings.CONFIG_WATCH_SECONDS if settings.CONFIG_WATCH_SECONDS > 0 else float("inf")
+
+        # loop forever waiting for keyboard interrupt
+        # the loop blocks on the update queue, so a queued request is dispatched the moment it arrives, and
+        # otherwise the process sleeps until the next deadline, either the periodic update or the day rollover
+        while True :
+
+            # units past their sweep deadline are counted first, before their slot coming round again counts as an overrun
+            check_sweep_deadline()
+
+            # periodic update of all units is due, if we fell more than a whole period behind don't try to catch up
+            now = time.monotonic()
+            if now >= next_periodic_update :
+                periodic_update_units()
+                next_periodic_update += settings.CHECK_PERIOD_SECONDS
+                if next_periodic_update <= now :
+                    next_periodic_update = now + settings.CHECK_PERIOD_SECONDS
+
+            if now >= next_snapshot :
+                save_snapshot()
+                next_snapshot = max(next_snapshot + settings.SNAPSHOT_INTERVAL_SECONDS, now + 1)
+
+            # apply the config file if it changed, a new check interval starts from now
+            if now >= next_config_check :
+                check_period_seconds = settings.CHECK_PERIOD_SECONDS
+                try :
+                    check_config_file()
+                except Exception as e :
+                    my_logger.error("Error : Unable to reload configuration : " + traceback.format_exc())
+                if ( settings.CHECK_PERIOD_SECONDS != check_period_seconds ) :
+                    next_periodic_update = now + settings.CHECK_PERIOD_SECONDS
+                next_config_check = now + settings.CONFIG_WATCH_SECONDS if settings.CONFIG_WATCH_SECONDS > 0 else float("inf")
+
+            # renew this shard's lease, and drop the shards whose lease ran out
+            if now >= next_shard_renew :
+                publish_shard_lease()
+                next_shard_renew = max(next_shard_renew + settings.SHARD_LEASE_SECONDS / 3, now + 1)
+            if ( services.shard_membership is not None ) :
+                expire_shard_leases()
+
+            # units whose poll is due
+            poll_due_units()
+
+            if now >= next_metrics_publish :
+                try :
+                    publish_metrics()
+                except Exception as e :
+                    my_logger.error("Error : Unable to publish metrics : " + traceback.format_exc())
+                next_metrics_publish = max(next_metrics_publish + settings.METRICS_INTERVAL_SECONDS, now + 1)
+
+            # check if it is a new day, if so log the counters and publish the prior day's rollup for each room
+            if current_day != datetime.now().timetuple().tm_yday :
+                my_logger.info("24 hour rollover")
+                try :
+                    publish_prior_day_rollups()
+                except Exception as e :
+                    my_logger.error("Error : Unable to publish prior day rollups : " + traceback.format_exc())
+                my_logger.info("api connection pool : " + api_pool_stats_text())
+                my_logger.info("cloud latency : " + cloud_latency_stats_text())
+                my_logger.info("update queue : " + update_queue_stats_text())
+                if ( services.unit_scheduler is not None ) :
+                    my_logger.info("polls : " + poll_stats_text())
+                my_logger.info("commands : " + command_stats_text())
+                my_logger.info("command confirmation : " + command_confirm_stats_text())
+                my_logger.info("circuit breakers : " + breaker_stats_text())
+                if ( services.shard_membership is not None ) :
+                    my_logger.info("shards : " + shard_stats_text())
+                if ( services.history_store is not None ) :
+                    my_logger.info("history : written {written:d}, duplicates {duplicates:d}, pruned {pruned:d}".format(**services.history_store.stats()))
+                my_logger.info("unit status : published {:d} (heartbeat {:d}), unchanged not published {:d}".format(
+                    PUBLISH_COUNTS["published"], PUBLISH_COUNTS["heartbeat"], PUBLISH_COUNTS["unchanged"]))
+                if ( settings.PAYLOAD_PROFILE == PAYLOAD_FIELDS ) :
+                    my_logger.info("field topics : published {published:d}, unchanged not published {unchanged:d}".format(**field_publisher.stats()))
+                current_day = datetime.now().timetuple().tm_yday
+
+            # sleep until there is work, or the nearest deadline
+            # the extra second past midnight makes sure the day number has changed when we wake up
+            wait_seconds = min(next_periodic_update, next_metrics_publish, next_shard_renew, next_config_check, next_snapshot) - time.monotonic()
+            wait_seconds = min(wait_seconds, seconds_until_midnight() + 1)
+            next_poll_seconds = services.unit_poller.next_due()
+            if ( next_poll_seconds is not None ) :
+                wait_seconds = min(wait_seconds, next_poll_seconds)
+            sweep_deadline_wait = sweep_deadline_seconds()
+            if ( sweep_deadline_wait is not None ) :
+                wait_seconds = min(wait_seconds, sweep_deadline_wait)
+            if ( services.shard_membership is not None and services.shard_membership.next_expiry() is not None ) :
+                wait_seconds = min(wait_seconds, services.shard_membership.next_expiry())
+            try :
+                unit_mac = services.queue_unit_request_update.get(timeout=max(0, wait_seconds))
+                my_logger.debug("queue request for :%s requesting update", unit_mac)
+                # the unit moved to another shard while it waited in the queue
+                if not owns_unit(unit_mac) :
+                    my_logger.debug("not polling unit another shard owns : %s", unit_mac)
+                    continue
+                # hand the fetch to the engine, this blocks only when api_max_concurrency requests are already in flight
+                services.fetch_engine.submit(fetch_unit_update, unit_mac)
+            except queue.Empty :
+                # woke up for a deadline, nothing in the queue
+                pass
+        # end loop forever
+
+    except KeyboardInterrupt :
+        services.fetch_engine.shutdown(wait=False)
+        services.command_dispatcher.shutdown(wait=False)
+        services.command_tracker.shutdown()
+        if ( settings.SNAPSHOT_FILE != "" ) :
+            save_snapshot()
+        if ( services.history_store is not None ) :
+            services.history_store.close()
+        if ( services.status_hedger is not None ) :
+            services.status_hedger.shutdown(wait=False)
+        services.api_pool.close()
+        if ( services.metrics_server is not None ) :
+            services.metrics_server.close()
+        message = {"timestamp": "{:d}".format(int(datetime.now().timestamp()))}
+        message["program_version"] = PROGRAM_NAME + " Version : " + VERSION_MAJOR + "." + VERSION_MINOR
+        message["status"] = "STOP"
+        publish_message(settings.MQTT_TOPIC_BASE + "$SYS/STATUS" + settings.SHARD_TOPIC_SUFFIX, json.dumps(message), "sys")
+        # hand this shard's units to the other shards straight away, rather than when the lease runs out
+        if ( services.shard_membership is not None ) :
+            publish_message(settings.MQTT_SHARD_TOPIC + settings.SHARD_ID, "", "sys", retain=True)
+        services.mqttc.disconnect()
+        services.mqttc.loop_stop()
+        my_logger.info("Keyboard interrupt.")
+        # sys.exit(0)
+
+    except :
+        my_logger.critical("Unhandled error : " + traceback.format_exc())
+        sys.exit(1)
+
+    # proper exit
+    my_logger.info("Program end : " + PROGRAM_NAME + " Version : " + VERSION_MAJOR + "." + VERSION_MINOR)
+    sys.exit(0)
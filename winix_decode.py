@@ -0,0 +1,168 @@
+#
+# winix_decode.py
+# 202610181300
+#
+# decode the attributes a winix unit uploads to the winix cloud
+#
+# each model has a declarative map of the attribute codes it reports. an attribute with a "values" table is an
+# enumeration, the cloud sends a code and we publish its text, any other attribute is a plain number sent as a string.
+# the lookup tables are built once per model, and a unit's attributes are decoded in one pass.
+# a code we don't know decodes to UNKNOWN instead of raising, and a model we don't know falls back to the C545 map
+#
+
+import threading
+
+STATUS_UNKNOWN = "UNKNOWN"
+
+# attribute map for the C545
+# A05 is also reported by the unit, we don't know what it is
+C545_ATTRIBUTES = {
+    "A02" : {"name" : "power", "values" : {"ON" : "1", "OFF" : "0"}},
+    "A03" : {"name" : "mode", "values" : {"AUTO" : "01", "MANUAL" : "02"}},
+    "A04" : {"name" : "fan_speed", "values" : {"100" : "05", "75" : "03", "50" : "02", "25" : "01", "SLEEP" : "06"}},
+    "A07" : {"name" : "plasmawave", "values" : {"ON" : "1", "OFF" : "0"}},
+    "A21" : {"name" : "filter_hours"},
+    "S07" : {"name" : "air_quality", "values" : {"GOOD" : "01", "FAIR" : "02", "POOR" : "03"}},
+    "S08" : {"name" : "air_quality_value"},
+    "S14" : {"name" : "ambient_light"},
+}
+
+# every model we know how to decode, keyed by the modelId the cloud reports
+# device characteristics are static from the spec sheet
+MODELS = {
+    "C545" : {
+        "attributes" : C545_ATTRIBUTES,
+        "specification" : {'manufacture' : ' WINIX', 'model' : 'C545', 'power' : '65 watts', 'room_size' : '360 sq. ft', 'weight' : '11.5 lbs'},
+    },
+}
+
+DEFAULT_MODEL = "C545"
+
+# lookup tables for one model, built from its attribute map
+class ModelDecoder :
+
+    def __init__(self, model, attributes) :
+        self.model = model
+        # cloud code -> (text, ordinal), for the enumerated attributes
+        self._decode = {}
+        for code, spec in attributes.items() :
+            values = spec.get("values")
+            if values :
+                self._decode[spec["name"]] = {value : (text, ordinal(value)) for text, value in values.items()}
+        # (code, name, decode table or None) in map order, what decode() walks
+        self._fields = tuple((code, spec["name"], self._decode.get(spec["name"])) for code, spec in attributes.items())
+
+    # decode all the attributes we know in one pass
+    # returns {name : (raw value, text, ordinal)}, a plain number's text is the raw value itself and its ordinal is None
+    # an attribute the unit did not send has a raw value of None
+    def decode(self, attributes) :
+        decoded = {}
+        for code, name, table in self._fields :
+            raw = attributes.get(code)
+            if table is None :
+                decoded[name] = (raw, raw, None)
+            else :
+                text_ordinal = table.get(raw)
+                if text_ordinal is None :
+                    decoded[name] = (raw, STATUS_UNKNOWN, ordinal(raw))
+                else :
+                    decoded[name] = (raw,) + text_ordinal
+        return decoded
+
+    # text for one raw attribute value, UNKNOWN if the code is not in the table
+    def text(self, name, raw) :
+        table = self._decode.get(name)
+        if table is None :
+            return raw
+        return table.get(raw, (STATUS_UNKNOWN,))[0]
+
+_decoders = {}
+_decoders_lock = threading.Lock()
+
+# decoder for a model, built the first time the model is seen
+# a model that is not in MODELS is decoded with the default model's map
+def get_decoder(model=None) :
+    model = model or DEFAULT_MODEL
+    decoder = _decoders.get(model)
+    if decoder is None :
+        with _decoders_lock :
+            decoder = _decoders.get(model)
+            if decoder is None :
+                definition = MODELS.get(model, MODELS[DEFAULT_MODEL])
+                decoder = ModelDecoder(model, definition["attributes"])
+                _decoders[model] = decoder
+    return decoder
+
+# is this model in MODELS, or decoded with the default map
+def is_known_model(model) :
+    return model in MODELS
+
+# a code like "02" published as the ordinal "2", -1 if the unit didn't send a number
+def ordinal(raw) :
+    try :
+        return str(int(raw))
+    except (TypeError, ValueError) :
+        return "-1"
+
+# decode the status fields published for a unit from one entry of the "data" list in the cloud response
+# the fields and their rules are the same as winix-02 has always published, all values are strings
+def decode_status(unit_data) :
+
+    decoder = get_decoder(unit_data.get("modelId"))
+    decoded = decoder.decode(unit_data.get("attributes") or {})
+
+    power_raw, power_text, power_ordinal = decoded["power"]
+
+    status = {}
+    status["unit_power_ordinal"] = power_ordinal
+    status["power_text"] = power_text
+
+    # if the unit is powered off, none of status is valid
+    if power_text == "OFF" :
+        status["unit_sleeping_text"] = STATUS_UNKNOWN
+        status["air_quality_ordinal"] = "-1"
+        status["air_quality_text"] = STATUS_UNKNOWN
+        status["air_quality_value"] = "-1"
+        status["unit_plasmawave_ordinal"] = "-1"
+        status["unit_plasmawave_text"] = STATUS_UNKNOWN
+        status["unit_mode_ordinal"] = "-1"
+        status["unit_mode_text"] = STATUS_UNKNOWN
+        status["unit_fan_speed_ordinal"] = "-1"
+        status["unit_fan_speed_text"] = STATUS_UNKNOWN
+        status["unit_filter_hours"] = "-1"
+        status["unit_ambient_light"] = "-1"
+    else :
+        fan_speed_raw, fan_speed_text, fan_speed_ordinal = decoded["fan_speed"]
+        # fan speed also signals the unit is sleeping
+        sleeping = fan_speed_text == "SLEEP"
+
+        air_quality_raw, air_quality_text, air_quality_ordinal = decoded["air_quality"]
+        status["unit_sleeping_text"] = "YES" if sleeping else "NO"
+        status["air_quality_ordinal"] = air_quality_ordinal
+        status["air_quality_text"] = air_quality_text
+        status["air_quality_value"] = decoded["air_quality_value"][0]
+
+        # if the unit is sleeping, plasmawave, mode and fan speed are not valid
+        if sleeping :
+            status["unit_plasmawave_ordinal"] = "-1"
+            status["unit_plasmawave_text"] = STATUS_UNKNOWN
+            status["unit_mode_ordinal"] = "-1"
+            status["unit_mode_text"] = STATUS_UNKNOWN
+            status["unit_fan_speed_ordinal"] = "-1"
+            status["unit_fan_speed_text"] = STATUS_UNKNOWN
+        else :
+            plasmawave_raw, plasmawave_text, plasmawave_ordinal = decoded["plasmawave"]
+            mode_raw, mode_text, mode_ordinal = decoded["mode"]
+            status["unit_plasmawave_ordinal"] = plasmawave_ordinal
+            status["unit_plasmawave_text"] = plasmawave_text
+            status["unit_mode_ordinal"] = mode_ordinal
+            status["unit_mode_text"] = mode_text
+            status["unit_fan_speed_ordinal"] = fan_speed_ordinal
+            status["unit_fan_speed_text"] = fan_speed_text
+
+        status["unit_filter_hours"] = decoded["filter_hours"][0]
+        status["unit_ambient_light"] = decoded["ambient_light"][0]
+
+    status["unit_rssi"] = unit_data.get("rssi")
+
+    return status
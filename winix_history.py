@@ -0,0 +1,139 @@
+#
+# winix_history.py
+# 202610181700
+#
+# local history of unit readings
+#
+# every decoded reading is appended to a small SQLite database as it is fetched, one row per unit per cloud upload,
+# with typed numeric columns, so history no longer depends on home assistant recording our MQTT messages into a
+# remote database and queries don't have to pull numbers back out of JSON strings. rows older than the retention
+# period are deleted as we go
+#
+# the table is WITHOUT ROWID, keyed by (unit_mac, ts), so a unit's readings are stored together in time order and
+# reading the same cloud upload twice does not add a second row
+#
+
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    unit_mac TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    power INTEGER,
+    sleeping INTEGER,
+    aq_value INTEGER,
+    aq_ordinal INTEGER,
+    fan INTEGER,
+    light INTEGER,
+    filter_hours INTEGER,
+    rssi INTEGER,
+    PRIMARY KEY (unit_mac, ts)
+) WITHOUT ROWID
+"""
+
+# closed rollups from winix_rollup.py, the summary is json
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    granularity TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    PRIMARY KEY (scope, key, granularity, start)
+) WITHOUT ROWID
+"""
+
+# columns of a reading, in table order
+COLUMNS = ("unit_mac", "ts", "power", "sleeping", "aq_value", "aq_ordinal", "fan", "light", "filter_hours", "rssi")
+
+# how often, in seconds, old rows are pruned
+PRUNE_INTERVAL_SECONDS = 3600
+
+# a published status value as a number, None for the "-1" and "UNKNOWN" the status uses for a value that isn't valid
+def _number(value) :
+    try :
+        number = int(value)
+    except (TypeError, ValueError) :
+        return None
+    return None if number == -1 else number
+
+# a reading row from the status message winix-02 publishes for a unit
+# fan is the fan speed in percent, None while the unit is sleeping or off
+def reading_from_status(unit_mac, message) :
+    sleeping = message.get("unit_sleeping_text")
+    return (
+        unit_mac,
+        int(message["unit_update_ts"]),
+        _number(message.get("unit_power_ordinal")),
+        1 if sleeping == "YES" else (0 if sleeping == "NO" else None),
+        _number(message.get("air_quality_value")),
+        _number(message.get("air_quality_ordinal")),
+        _number(message.get("unit_fan_speed_text")),
+        _number(message.get("unit_ambient_light")),
+        _number(message.get("unit_filter_hours")),
+        _number(message.get("unit_rssi")),
+    )
+
+class HistoryStore :
+
+    def __init__(self, path, retention_days=30) :
+        self.path = path
+        self.retention_seconds = int(retention_days * 86400)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(SCHEMA)
+        self._connection.execute(ROLLUP_SCHEMA)
+        self._last_prune = None
+        # counters
+        self.written = 0
+        self.duplicates = 0
+        self.pruned = 0
+
+    # append one reading, a tuple in COLUMNS order, returns False if we already had this unit's reading for that time
+    def append(self, reading) :
+        with self._lock :
+            cursor = self._connection.execute("INSERT OR IGNORE INTO readings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", reading)
+            added = cursor.rowcount == 1
+            if added :
+                self.written += 1
+            else :
+                self.duplicates += 1
+            if self.retention_seconds > 0 and (self._last_prune is None or time.monotonic() - self._last_prune >= PRUNE_INTERVAL_SECONDS) :
+                self._prune()
+        return added
+
+    # delete rows older than the retention period, caller holds the lock
+    def _prune(self) :
+        self._last_prune = time.monotonic()
+        cutoff = int(time.time()) - self.retention_seconds
+        cursor = self._connection.execute("DELETE FROM readings WHERE ts < ?", (cutoff,))
+        self.pruned += cursor.rowcount
+        self._connection.execute("DELETE FROM rollups WHERE start < ?", (cutoff,))
+
+    # store a closed rollup, replacing any saved before for the same bucket
+    def save_rollup(self, scope, key, granularity, summary) :
+        with self._lock :
+            self._connection.execute("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?)",
+                (scope, key, granularity, summary["start"], json.dumps(summary, separators=(",", ":"))))
+
+    # closed rollups for one unit or room overlapping start <= ts < end, in time order
+    def rollups(self, scope, key, granularity, start, end) :
+        with self._lock :
+            rows = self._connection.execute("SELECT summary FROM rollups WHERE scope = ? AND key = ? AND granularity = ? "
+                "AND start < ? AND start >= ? ORDER BY start", (scope, key, granularity, end, start - 90000)).fetchall()
+        summaries = [json.loads(row[0]) for row in rows]
+        return [summary for summary in summaries if summary["end"] > start]
+
+    # snapshot of the counters
+    def stats(self) :
+        with self._lock :
+            return {"written" : self.written, "duplicates" : self.duplicates, "pruned" : self.pruned}
+
+    def close(self) :
+        with self._lock :
+            self._connection.close()
@@ -0,0 +1,211 @@
+#
+# winix_metrics.py
+# 202610182100
+#
+# counters, gauges and histograms for winix-02, and the two ways they are read
+#   snapshot()        : a dictionary, published as JSON on winix/$SYS/METRICS
+#   prometheus_text() : the prometheus text exposition format, served by MetricsServer on /metrics
+#
+# a metric has a name and help text, and a value per set of labels, kind="status" for example. a counter or gauge
+# can also be given a function instead, called when the metrics are read, which returns {labels : value}, so the
+# counters the queue, pool and dispatcher already keep are read from their stats() rather than counted twice
+#
+# updating a metric takes a lock and a dictionary lookup, cheap enough for every cloud request and publish
+#
+
+import math
+import threading
+
+# histogram buckets, upper bounds in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SWEEP_BUCKETS = (0.25, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+CONFIRM_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# labels as a hashable, ordered key
+def _label_key(labels) :
+    return tuple(sorted(labels.items()))
+
+def _label_text(label_key, extra=()) :
+    pairs = list(label_key) + list(extra)
+    if not pairs :
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs) + "}"
+
+def _number_text(value) :
+    if value == math.inf :
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() :
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter :
+
+    type = "counter"
+
+    def __init__(self, name, help_text, function=None) :
+        self.name = name
+        self.help = help_text
+        self._function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels) :
+        key = _label_key(labels)
+        with self._lock :
+            self._values[key] = self._values.get(key, 0) + amount
+
+    # {label key : value}
+    def values(self) :
+        if self._function is not None :
+            return {_label_key(labels) : value for labels, value in self._function()}
+        with self._lock :
+            return dict(self._values)
+
+class Gauge(Counter) :
+
+    type = "gauge"
+
+    def set(self, value, **labels) :
+        key = _label_key(labels)
+        with self._lock :
+            self._values[key] = value
+
+    def remove(self, **labels) :
+        with self._lock :
+            self._values.pop(_label_key(labels), None)
+
+class Histogram :
+
+    type = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS) :
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label key -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels) :
+        key = _label_key(labels)
+        with self._lock :
+            counts = self._values.get(key)
+            if counts is None :
+                counts = [0] * (len(self.buckets) + 2)
+                self._values[key] = counts
+            for i, bound in enumerate(self.buckets) :
+                if value <= bound :
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    # {label key : (cumulative bucket counts, sum, count)}
+    def values(self) :
+        with self._lock :
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        values = {}
+        for key, counts in items :
+            cumulative = []
+            total = 0
+            for count in counts[:len(self.buckets)] :
+                total += count
+                cumulative.append(total)
+            values[key] = (cumulative, counts[-2], counts[-1])
+        return values
+
+class MetricsRegistry :
+
+    def __init__(self, prefix="winix_") :
+        self.prefix = prefix
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric) :
+        with self._lock :
+            self._metrics.append(metric)
+        return metric
+
+    # function, if given, returns an iterable of (labels dictionary, value) when the metrics are read
+    def counter(self, name, help_text, function=None) :
+        return self._add(Counter(self.prefix + name, help_text, function))
+
+    def gauge(self, name, help_text, function=None) :
+        return self._add(Gauge(self.prefix + name, help_text, function))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS) :
+        return self._add(Histogram(self.prefix + name, help_text, buckets))
+
+    def metrics(self) :
+        with self._lock :
+            return list(self._metrics)
+
+    # every metric as a dictionary, ready for json
+    def snapshot(self) :
+        snapshot = {}
+        for metric in self.metrics() :
+            values = []
+            for label_key, value in sorted(metric.values().items()) :
+                entry = {"labels" : dict(label_key)} if label_key else {}
+                if metric.type == "histogram" :
+                    cumulative, total, count = value
+                    entry["count"] = count
+                    entry["sum"] = round(total, 6)
+                    entry["buckets"] = {_number_text(bound) : bucket_count for bound, bucket_count in zip(metric.buckets, cumulative)}
+                else :
+                    entry["value"] = value
+                values.append(entry)
+            snapshot[metric.name] = {"type" : metric.type, "values" : values}
+        return snapshot
+
+    # every metric in the prometheus text format
+    def prometheus_text(self) :
+        lines = []
+        for metric in self.metrics() :
+            lines.append("# HELP " + metric.name + " " + metric.help)
+            lines.append("# TYPE " + metric.name + " " + metric.type)
+            for label_key, value in sorted(metric.values().items()) :
+                if metric.type == "histogram" :
+                    cumulative, total, count = value
+                    for bound, bucket_count in zip(metric.buckets, cumulative) :
+                        lines.append(metric.name + "_bucket" + _label_text(label_key, (("le", _number_text(bound)),)) + " " + str(bucket_count))
+                    lines.append(metric.name + "_sum" + _label_text(label_key) + " " + _number_text(total))
+                    lines.append(metric.name + "_count" + _label_text(label_key) + " " + str(count))
+                else :
+                    lines.append(metric.name + _label_text(label_key) + " " + _number_text(value))
+        return "\n".join(lines) + "\n"
+
+# serves the registry on http://<address>:<port>/metrics for prometheus, on a daemon thread
+# http.server is imported here, only when metrics_port asks for the server, it is slow to import
+class MetricsServer :
+
+    def __init__(self, registry, port, address="127.0.0.1") :
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler) :
+
+            def do_GET(self) :
+                if self.path.split("?")[0] != "/metrics" :
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # requests are not logged
+            def log_message(self, format, *args) :
+                pass
+
+        self._server = ThreadingHTTPServer((address, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="winix-metrics", daemon=True)
+        self._thread.start()
+
+    def close(self) :
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,99 @@
+#
+# winix_payload.py
+# 202610181900
+#
+# the shape of the unit status messages published to MQTT
+#
+# payload_profile in winix-02.yaml picks one of :
+#   full    : the status message as winix-02 has always published it, every value a string, plus the raw cloud
+#             response body in unit_body_json
+#   compact : the decoded fields only, numbers as JSON numbers, no unit_body_json, and update_age in seconds
+#             instead of update_age_text
+#   fields  : no status message, each field of the compact message on its own topic, winix/<mac>/state/<field>,
+#             published only when its value changes, retained like the status message with publish_retain
+#
+# full is the default, so existing home assistant sensors keep working. compact is about half the size of
+# full, and with fields a change of air quality publishes a few bytes, not the whole status
+#
+
+import threading
+
+PAYLOAD_FULL = "full"
+PAYLOAD_COMPACT = "compact"
+PAYLOAD_FIELDS = "fields"
+
+PAYLOAD_PROFILES = (PAYLOAD_FULL, PAYLOAD_COMPACT, PAYLOAD_FIELDS)
+
+# sub topic of the per field topics, winix/<mac>/state/<field>
+FIELD_TOPIC = "/state/"
+
+# fields of the full message left out of the compact message
+COMPACT_DROPPED_FIELDS = ("unit_body_json", "update_age_text")
+
+# fields of the compact message that are not given their own topic, they change on every fetch
+FIELD_TOPIC_SKIPPED_FIELDS = ("timestamp", "update_age")
+
+# a string holding a whole number as an int, anything else as it is
+def native(value) :
+    if isinstance(value, str) :
+        try :
+            return int(value)
+        except ValueError :
+            return value
+    return value
+
+# the compact message for a full status message
+def compact_message(message) :
+    compact = {field : native(value) for field, value in message.items() if field not in COMPACT_DROPPED_FIELDS}
+    if "timestamp" in compact and "unit_update_ts" in compact :
+        compact["update_age"] = compact["timestamp"] - compact["unit_update_ts"]
+    return compact
+
+# text published on a field topic
+def field_payload(value) :
+    return "" if value is None else str(value)
+
+# remembers the value last published on each field topic of each unit, so only changed fields are published
+class FieldPublisher :
+
+    def __init__(self) :
+        # unit_mac -> {field : payload}
+        self._published = {}
+        self._lock = threading.Lock()
+        # counters
+        self.published = 0
+        self.unchanged = 0
+
+    # the (field, payload) pairs of a compact message that differ from what was last published for the unit,
+    # recorded as published. force returns every field, for a heartbeat
+    def changes(self, unit_mac, compact, force=False) :
+        changed = []
+        with self._lock :
+            published = self._published.setdefault(unit_mac, {})
+            for field, value in compact.items() :
+                if field in FIELD_TOPIC_SKIPPED_FIELDS :
+                    continue
+                payload = field_payload(value)
+                if force or published.get(field) != payload :
+                    published[field] = payload
+                    changed.append((field, payload))
+                else :
+                    self.unchanged += 1
+            self.published += len(changed)
+        return changed
+
+    # the payloads last published on each field topic, for a snapshot
+    def export_state(self) :
+        with self._lock :
+            return {unit_mac : dict(published) for unit_mac, published in self._published.items()}
+
+    # carry on from a snapshot, so fields that have not changed since are not published again
+    def restore_state(self, states) :
+        with self._lock :
+            for unit_mac, published in states.items() :
+                self._published.setdefault(unit_mac, {}).update(published)
+
+    # snapshot of the counters
+    def stats(self) :
+        with self._lock :
+            return {"published" : self.published, "unchanged" : self.unchanged}
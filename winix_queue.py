@@ -0,0 +1,150 @@
+#
+# winix_queue.py
+# 202610181100
+#
+# work queue of units waiting for a status update from the winix cloud
+# a unit's MAC address is only ever in the queue once, asking again for a unit that is already
+# waiting is coalesced into the pending request, so a slow sweep or a burst of /control/update
+# messages can't make us fetch the same unit several times in a row
+#
+# there are two priority lanes. interactive requests, a refresh after a control message from home assistant,
+# are served before background requests from the periodic sweep. asking for an interactive update of a unit
+# that is waiting in the background lane moves it to the interactive lane. so that a steady stream of
+# interactive requests can't starve the sweep, a background request that has waited longer than max_wait
+# seconds is served next regardless. while the sweep is behind like that the two lanes take turns, so
+# interactive requests are never stuck behind the whole backlog either
+#
+
+import queue
+import threading
+import time
+from collections import deque
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# one queued request, the pending dictionary points at the live entry for each unit
+# entries left behind in a lane when a unit is promoted are skipped when they reach the head of the lane
+class _Entry :
+
+    __slots__ = ("unit_mac", "priority", "queued_at")
+
+    def __init__(self, unit_mac, priority, queued_at) :
+        self.unit_mac = unit_mac
+        self.priority = priority
+        self.queued_at = queued_at
+
+class UnitUpdateQueue :
+
+    def __init__(self, max_wait=None) :
+        # longest a background request waits behind interactive ones, None means interactive always goes first
+        self.max_wait = max_wait
+        self._lanes = (deque(), deque())
+        self._depth = [0, 0]
+        self._pending = {}
+        self._guarded_last = False
+        self._not_empty = threading.Condition(threading.Lock())
+        # counters
+        self.queued = 0
+        self.coalesced = 0
+        self.promoted = 0
+        self.dispatched = 0
+        self.starvation_guarded = 0
+
+    # queue an update for a unit, returns False if the unit was already waiting and the request was coalesced
+    def put(self, unit_mac, priority=PRIORITY_BACKGROUND) :
+        with self._not_empty :
+            entry = self._pending.get(unit_mac)
+            if entry is not None :
+                self.coalesced += 1
+                if priority < entry.priority :
+                    # move to the faster lane, the old entry is left behind and skipped later
+                    self._depth[entry.priority] -= 1
+                    self._add(unit_mac, priority, entry.queued_at)
+                    self.promoted += 1
+                return False
+            self._add(unit_mac, priority, time.monotonic())
+            self.queued += 1
+            self._not_empty.notify()
+            return True
+
+    # caller holds the lock
+    def _add(self, unit_mac, priority, queued_at) :
+        entry = _Entry(unit_mac, priority, queued_at)
+        self._pending[unit_mac] = entry
+        self._lanes[priority].append(entry)
+        self._depth[priority] += 1
+
+    # oldest live entry in a lane, dropping any stale entries in front of it, caller holds the lock
+    def _head(self, priority) :
+        lane = self._lanes[priority]
+        while lane and self._pending.get(lane[0].unit_mac) is not lane[0] :
+            lane.popleft()
+        return lane[0] if lane else None
+
+    # caller holds the lock and has checked the queue is not empty
+    def _take(self) :
+        interactive = self._head(PRIORITY_INTERACTIVE)
+        background = self._head(PRIORITY_BACKGROUND)
+        guarded = False
+        if interactive is not None :
+            if (background is not None and self.max_wait is not None and not self._guarded_last
+                    and time.monotonic() - background.queued_at >= self.max_wait) :
+                self.starvation_guarded += 1
+                guarded = True
+                entry = background
+            else :
+                entry = interactive
+        else :
+            entry = background
+        self._guarded_last = guarded
+        self._lanes[entry.priority].popleft()
+        self._depth[entry.priority] -= 1
+        del self._pending[entry.unit_mac]
+        self.dispatched += 1
+        return entry.unit_mac
+
+    # take the next unit off the queue, once taken the unit can be queued again
+    # blocks up to timeout seconds (forever if None) and raises queue.Empty if nothing arrives, like queue.SimpleQueue
+    def get(self, block=True, timeout=None) :
+        with self._not_empty :
+            if not block :
+                if not self._pending :
+                    raise queue.Empty
+            elif timeout is None :
+                while not self._pending :
+                    self._not_empty.wait()
+            else :
+                deadline = time.monotonic() + timeout
+                while not self._pending :
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 :
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+            return self._take()
+
+    def qsize(self) :
+        with self._not_empty :
+            return len(self._pending)
+
+    def empty(self) :
+        return self.qsize() == 0
+
+    # is an update for this unit already waiting
+    def __contains__(self, unit_mac) :
+        with self._not_empty :
+            return unit_mac in self._pending
+
+    # snapshot of the counters and current queue depth
+    def stats(self) :
+        with self._not_empty :
+            return {
+                "depth" : len(self._pending),
+                "depth_interactive" : self._depth[PRIORITY_INTERACTIVE],
+                "depth_background" : self._depth[PRIORITY_BACKGROUND],
+                "queued" : self.queued,
+                "coalesced" : self.coalesced,
+                "promoted" : self.promoted,
+                "dispatched" : self.dispatched,
+                "starvation_guarded" : self.starvation_guarded,
+            }
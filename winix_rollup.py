@@ -0,0 +1,240 @@
+#
+# winix_rollup.py
+# 202610181800
+#
+# windowed aggregates of unit readings, kept up to date as readings arrive
+#
+# for every unit and every room there is a rollup at 5 minute, hourly and daily granularity :
+#   air quality value min, max, mean and percentiles
+#   seconds spent in each air quality band (GOOD, FAIR, POOR)
+#   seconds at each fan speed, also as a fraction of the time, the fan duty cycle, and the mean fan speed
+#   rssi min, max and mean
+#
+# a reading's values count in the bucket holding its timestamp. the time between two readings of a unit is
+# credited to the band and fan speed of the first one, split across bucket boundaries, and capped at max_gap
+# seconds so a unit that stops uploading doesn't fill the gap with stale state. room rollups add up their
+# units, so room times are unit-seconds
+#
+# a bucket is closed once its end is more than max_gap seconds in the past, no later reading can add to it then.
+# closed buckets are handed to a save function, winix-02 stores them in the history database, and dashboards
+# query those instead of scanning the raw readings. buckets are aligned to local time, so a daily bucket runs
+# from local midnight to local midnight
+#
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from winix_decode import C545_ATTRIBUTES
+
+GRANULARITIES = {"5min" : 300, "hour" : 3600, "day" : 86400}
+
+SCOPE_UNIT = "unit"
+SCOPE_ROOM = "room"
+
+PERCENTILES = (50, 90, 95, 99)
+
+# air quality band text by ordinal, from the decoder's table
+AIR_QUALITY_BANDS = {int(code) : text for text, code in C545_ATTRIBUTES["S07"]["values"].items()}
+
+# start of the bucket holding ts, on local time
+def bucket_start(granularity, ts) :
+    if granularity == "day" :
+        day = datetime.fromtimestamp(ts).date()
+        return int(datetime.combine(day, datetime.min.time()).timestamp())
+    size = GRANULARITIES[granularity]
+    offset = datetime.fromtimestamp(ts).astimezone().utcoffset().total_seconds()
+    return int((ts + offset) // size * size - offset)
+
+# end of the bucket starting at start, a daily bucket is 23 or 25 hours on a daylight saving change
+def bucket_end(granularity, start) :
+    if granularity == "day" :
+        day = datetime.fromtimestamp(start).date() + timedelta(days=1)
+        return int(datetime.combine(day, datetime.min.time()).timestamp())
+    return start + GRANULARITIES[granularity]
+
+# the fan state a reading counts towards
+def fan_state(reading) :
+    if reading["power"] == 0 :
+        return "OFF"
+    if reading["sleeping"] == 1 :
+        return "SLEEP"
+    if reading["fan"] is None :
+        return "UNKNOWN"
+    return str(reading["fan"])
+
+# aggregate of the readings in one bucket
+class Bucket :
+
+    __slots__ = ("start", "end", "readings", "aq_counts", "band_seconds", "fan_seconds", "rssi_count", "rssi_sum", "rssi_min", "rssi_max")
+
+    def __init__(self, start, end) :
+        self.start = start
+        self.end = end
+        self.readings = 0
+        # air quality value -> number of readings, values are small integers so this gives exact percentiles
+        self.aq_counts = {}
+        self.band_seconds = {}
+        self.fan_seconds = {}
+        self.rssi_count = 0
+        self.rssi_sum = 0
+        self.rssi_min = None
+        self.rssi_max = None
+
+    def add_values(self, reading) :
+        self.readings += 1
+        aq_value = reading["aq_value"]
+        if aq_value is not None :
+            self.aq_counts[aq_value] = self.aq_counts.get(aq_value, 0) + 1
+        rssi = reading["rssi"]
+        if rssi is not None :
+            self.rssi_count += 1
+            self.rssi_sum += rssi
+            self.rssi_min = rssi if self.rssi_min is None else min(self.rssi_min, rssi)
+            self.rssi_max = rssi if self.rssi_max is None else max(self.rssi_max, rssi)
+
+    def add_duration(self, band, fan, seconds) :
+        if band is not None :
+            self.band_seconds[band] = self.band_seconds.get(band, 0) + seconds
+        self.fan_seconds[fan] = self.fan_seconds.get(fan, 0) + seconds
+
+    # the rollup as a dictionary, ready for json
+    def summary(self) :
+        summary = {"start" : self.start, "end" : self.end, "readings" : self.readings}
+
+        aq_total = sum(self.aq_counts.values())
+        if aq_total :
+            values = sorted(self.aq_counts)
+            air_quality = {"min" : values[0], "max" : values[-1],
+                "mean" : round(sum(value * count for value, count in self.aq_counts.items()) / aq_total, 2)}
+            for percentile in PERCENTILES :
+                # nearest rank
+                rank = max(1, -(-percentile * aq_total // 100))
+                seen = 0
+                for value in values :
+                    seen += self.aq_counts[value]
+                    if seen >= rank :
+                        air_quality["p" + str(percentile)] = value
+                        break
+            summary["air_quality_value"] = air_quality
+
+        summary["air_quality_band_seconds"] = dict(self.band_seconds)
+
+        fan_total = sum(self.fan_seconds.values())
+        summary["fan_speed_seconds"] = dict(self.fan_seconds)
+        summary["fan_duty_cycle"] = {fan : round(seconds / fan_total, 4) for fan, seconds in self.fan_seconds.items()} if fan_total else {}
+        running = {int(fan) : seconds for fan, seconds in self.fan_seconds.items() if fan.isdigit()}
+        running_total = sum(running.values())
+        if running_total :
+            summary["fan_mean_percent"] = round(sum(fan * seconds for fan, seconds in running.items()) / running_total, 1)
+
+        if self.rssi_count :
+            summary["rssi"] = {"min" : self.rssi_min, "max" : self.rssi_max, "mean" : round(self.rssi_sum / self.rssi_count, 1)}
+
+        return summary
+
+class RollupEngine :
+
+    # save(scope, key, granularity, summary) is called for every bucket that closes
+    def __init__(self, save=None, max_gap=3600) :
+        self._save = save
+        self.max_gap = max_gap
+        # (scope, key, granularity, start) -> Bucket, only buckets still open
+        self._buckets = {}
+        # unit_mac -> (room, previous reading)
+        self._previous = {}
+        self._lock = threading.Lock()
+        self.closed = 0
+
+    # bucket for the period holding ts, created if needed, caller holds the lock
+    def _bucket(self, scope, key, granularity, ts) :
+        start = bucket_start(granularity, ts)
+        bucket_key = (scope, key, granularity, start)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None :
+            bucket = Bucket(start, bucket_end(granularity, start))
+            self._buckets[bucket_key] = bucket
+        return bucket
+
+    # credit [start, start + seconds) to the band and fan of a reading, split at bucket boundaries, caller holds the lock
+    # a piece that falls in a bucket already closed is dropped rather than opening the bucket again
+    def _add_duration(self, scope, key, reading, start, seconds, now) :
+        band = AIR_QUALITY_BANDS.get(reading["aq_ordinal"]) if reading["power"] == 1 else None
+        fan = fan_state(reading)
+        for granularity in GRANULARITIES :
+            position = start
+            end = start + seconds
+            while position < end :
+                end_of_bucket = bucket_end(granularity, bucket_start(granularity, position))
+                piece_end = min(end, end_of_bucket)
+                if end_of_bucket + self.max_gap > now :
+                    self._bucket(scope, key, granularity, position).add_duration(band, fan, piece_end - position)
+                position = piece_end
+
+    # add one reading of a unit, a dictionary with the winix_history column names
+    def add(self, unit_mac, room, reading) :
+        ts = reading["ts"]
+        now = time.time()
+        with self._lock :
+            previous = self._previous.get(unit_mac)
+            if previous is not None and ts <= previous[1]["ts"] :
+                # the same cloud upload again, or an older one
+                return False
+            for scope, key in ((SCOPE_UNIT, unit_mac), (SCOPE_ROOM, room)) :
+                if previous is not None :
+                    seconds = min(ts - previous[1]["ts"], self.max_gap)
+                    self._add_duration(scope, key, previous[1], previous[1]["ts"], seconds, now)
+                for granularity in GRANULARITIES :
+                    if bucket_end(granularity, bucket_start(granularity, ts)) + self.max_gap > now :
+                        self._bucket(scope, key, granularity, ts).add_values(reading)
+            self._previous[unit_mac] = (room, reading)
+        return True
+
+    # close every bucket whose end is more than max_gap seconds before now, called from the main loop, not for every
+    # reading, as it looks at every open bucket
+    def flush(self, now=None) :
+        now = time.time() if now is None else now
+        closed = []
+        with self._lock :
+            for bucket_key, bucket in list(self._buckets.items()) :
+                if bucket.end + self.max_gap <= now :
+                    closed.append((bucket_key, bucket))
+                    del self._buckets[bucket_key]
+            self.closed += len(closed)
+        closed.sort(key=lambda item : (item[0][3], item[0][0], item[0][1], item[0][2]))
+        if self._save is not None :
+            for (scope, key, granularity, start), bucket in closed :
+                self._save(scope, key, granularity, bucket.summary())
+        return len(closed)
+
+    # rollups still open, for a query that reaches into the current period
+    def open_summaries(self, scope, key, granularity, start, end) :
+        with self._lock :
+            buckets = [bucket for (bucket_scope, bucket_key, bucket_granularity, bucket_start), bucket in self._buckets.items()
+                if bucket_scope == scope and bucket_key == key and bucket_granularity == granularity
+                and bucket_start < end and bucket.end > start]
+            return [bucket.summary() for bucket in sorted(buckets, key=lambda bucket : bucket.start)]
+
+    # snapshot of the counters
+    def stats(self) :
+        with self._lock :
+            return {"open" : len(self._buckets), "closed" : self.closed, "units" : len(self._previous)}
+
+# closed rollups kept in memory, when there is no history database to save them in
+# keeps the newest keep rollups for each scope, key and granularity
+class MemoryRollupStore :
+
+    def __init__(self, keep=288) :
+        self.keep = keep
+        self._rollups = {}
+        self._lock = threading.Lock()
+
+    def save_rollup(self, scope, key, granularity, summary) :
+        with self._lock :
+            rollups = self._rollups.setdefault((scope, key, granularity), [])
+            rollups.append(summary)
+            del rollups[:-self.keep]
+
+    def rollups(self, scope, key, granularity, start, end) :
+        with self._lock :
+            return [summary for summary in self._rollups.get((scope, key, granularity), []) if summary["start"] < end and summary["end"] > start]
@@ -0,0 +1,385 @@
+#
+# winix_schedule.py
+# 202610182200
+#
+# when to poll each unit's status from the winix cloud
+#
+# a unit uploads its status to the winix cloud on its own schedule, and polling it more often than that only
+# fetches the same utcTimestamp again. the adaptive scheduler learns each unit's upload period from the
+# utcTimestamp values it sees, and polls a unit lag seconds after its next upload is expected
+#   - the period is the median of the last few gaps between distinct uploads, so one late or missed upload
+#     doesn't throw it off. it can only be learned down to how often we poll, a unit that uploads more often
+#     than default_interval is polled every default_interval, as it was before
+#   - a poll that finds no new upload is tried again after a short wait, doubling each time it finds nothing,
+#     so a unit that is late is picked up soon after it does upload
+#   - a powered off unit is polled every default_interval, doubling while it stays off. turning it on from home
+#     assistant asks for an update straight away, so nothing waits on the back off
+#   - a failed poll is retried after min_interval, doubling while it keeps failing
+#   - a unit is never polled more often than min_interval, or less often than max_interval
+#
+# all the scheduled polls share a budget of budget_per_hour, the earliest due go first when there are more due
+# than the budget allows. polls asked for over MQTT don't count against it
+#
+# times are wall clock seconds, like utcTimestamp
+#
+# the time wheel polls every unit once per interval, each at its own fixed offset into the interval, so the polls
+# of a fleet are spread evenly instead of all going out at once. the interval is cut into slots and each unit is
+# hashed by its mac address to a slot, so its offset is the same every interval and across restarts. a unit whose
+# slot already holds its share of the fleet goes to the next slot with room, so the slots stay level however the
+# hashes fall. the adaptive scheduler uses the same offsets for the first poll of each unit
+#
+# the wheel runs on the monotonic clock
+#
+
+import heapq
+import itertools
+import math
+import statistics
+import threading
+import time
+import zlib
+from collections import deque
+
+from winix_cloud import TokenBucket
+
+# number of upload gaps the period is the median of
+PERIOD_SAMPLES = 8
+
+# what a unit's last poll found
+POLL_NEW = "new"
+POLL_STALE = "stale"
+POLL_OFF = "off"
+POLL_FAILED = "failed"
+
+# what we know about one unit
+class _Unit :
+
+    __slots__ = ("unit_mac", "due", "last_upload", "gaps", "period", "misses", "off_polls", "failures", "result", "in_flight", "scheduled_upload")
+
+    def __init__(self, unit_mac, due) :
+        self.unit_mac = unit_mac
+        self.due = due
+        self.last_upload = None
+        self.gaps = deque(maxlen=PERIOD_SAMPLES)
+        self.period = None
+        self.misses = 0
+        self.off_polls = 0
+        self.failures = 0
+        # what the poll in flight found, None until observe() or complete() is called for it
+        self.result = None
+        self.in_flight = False
+        # the newest upload known when the last scheduled poll completed, what the next one has to beat to be new
+        # a poll asked for over MQTT may see an upload first, the scheduled poll after it still finds it new
+        self.scheduled_upload = None
+
+class AdaptiveScheduler :
+
+    def __init__(self, default_interval=300, min_interval=60, max_interval=1800, lag=20, budget_per_hour=0, burst=None) :
+        self.default_interval = float(default_interval)
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.lag = float(lag)
+        self._units = {}
+        # (due, sequence, unit_mac), entries whose due no longer matches the unit are skipped
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._budget = None
+        self.set_budget(budget_per_hour, burst)
+        # counters
+        self.polls = {POLL_NEW : 0, POLL_STALE : 0, POLL_OFF : 0, POLL_FAILED : 0}
+        self.deferred = 0
+
+    # replace the poll budget, the new one starts full
+    def set_budget(self, budget_per_hour, burst=None) :
+        budget = None
+        if budget_per_hour > 0 :
+            budget = TokenBucket(budget_per_hour / 3600.0, burst if burst is not None else max(1, budget_per_hour / 60.0))
+        with self._lock :
+            self._budget = budget
+
+    # start scheduling a unit, first poll at due, now if not given
+    def add(self, unit_mac, due=None) :
+        with self._lock :
+            unit = _Unit(unit_mac, time.time() if due is None else due)
+            self._units[unit_mac] = unit
+            heapq.heappush(self._heap, (unit.due, next(self._sequence), unit_mac))
+
+    # stop scheduling a unit, a poll of it in flight is not scheduled again when it completes
+    def remove(self, unit_mac) :
+        with self._lock :
+            self._units.pop(unit_mac, None)
+
+    # units whose poll is due, within the budget, each is in flight until complete() is called for it
+    def pop_due(self, now=None) :
+        now = time.time() if now is None else now
+        due = []
+        with self._lock :
+            while self._heap and self._heap[0][0] <= now :
+                unit = self._units.get(self._heap[0][2])
+                if unit is None or unit.due != self._heap[0][0] or unit.in_flight :
+                    heapq.heappop(self._heap)
+                    continue
+                if self._budget is not None and not self._budget.try_acquire() :
+                    self.deferred += 1
+                    break
+                heapq.heappop(self._heap)
+                unit.in_flight = True
+                unit.result = None
+                due.append(unit.unit_mac)
+        return due
+
+    # seconds until pop_due has something to return, None if nothing is scheduled
+    def next_due(self, now=None) :
+        now = time.time() if now is None else now
+        with self._lock :
+            while self._heap :
+                unit = self._units.get(self._heap[0][2])
+                if unit is None or unit.due != self._heap[0][0] or unit.in_flight :
+                    heapq.heappop(self._heap)
+                    continue
+                wait = self._heap[0][0] - now
+                if wait <= 0 and self._budget is not None :
+                    # over budget, wait for the next token
+                    wait = 1.0 / self._budget.rate
+                return max(0.0, wait)
+        return None
+
+    # what a poll of a unit found, upload_ts is the utcTimestamp the cloud returned
+    def observe(self, unit_mac, upload_ts, powered=True) :
+        with self._lock :
+            unit = self._units.get(unit_mac)
+            if unit is None :
+                return
+            if unit.last_upload is None or upload_ts > unit.last_upload :
+                if unit.last_upload is not None :
+                    unit.gaps.append(upload_ts - unit.last_upload)
+                    unit.period = statistics.median(unit.gaps)
+                unit.last_upload = upload_ts
+            # only a scheduled poll has a result, any poll teaches the upload times
+            if not unit.in_flight :
+                return
+            if not powered :
+                unit.result = POLL_OFF
+            else :
+                unit.result = POLL_NEW if unit.scheduled_upload is None or upload_ts > unit.scheduled_upload else POLL_STALE
+
+    # a poll of a unit is done, successful or not, schedule its next poll
+    # only a poll pop_due handed out counts, a poll asked for over MQTT or to confirm a command is not scheduled, a stale
+    # one right after a command would otherwise count as a miss. returns None for those
+    def complete(self, unit_mac, now=None) :
+        now = time.time() if now is None else now
+        with self._lock :
+            unit = self._units.get(unit_mac)
+            if unit is None or not unit.in_flight :
+                return None
+            result = unit.result or POLL_FAILED
+            self.polls[result] += 1
+            if result == POLL_FAILED :
+                unit.failures += 1
+                delay = self.min_interval * 2 ** min(unit.failures - 1, 16)
+            else :
+                unit.failures = 0
+                if result == POLL_OFF :
+                    unit.off_polls += 1
+                    delay = self.default_interval * 2 ** min(unit.off_polls - 1, 16)
+                else :
+                    unit.off_polls = 0
+                    delay = self._next_poll_delay(unit, result, now)
+            delay = min(max(delay, self.min_interval), self.max_interval)
+            unit.due = now + delay
+            unit.result = None
+            unit.in_flight = False
+            unit.scheduled_upload = unit.last_upload
+            heapq.heappush(self._heap, (unit.due, next(self._sequence), unit_mac))
+            return delay
+
+    # seconds from now to the next poll of a powered on unit, caller holds the lock
+    def _next_poll_delay(self, unit, result, now) :
+        if result == POLL_STALE :
+            unit.misses += 1
+            # the upload is late, look again soon, then less and less often
+            return max(self.min_interval, (unit.period or self.default_interval) / 8) * 2 ** min(unit.misses - 1, 16)
+        unit.misses = 0
+        if unit.period is None :
+            return self.default_interval
+        # the first expected upload after now, and lag seconds for the cloud to have it
+        expected = unit.last_upload + unit.period
+        if expected <= now :
+            expected += unit.period * ((now - expected) // unit.period + 1)
+        return expected + self.lag - now
+
+    # what is known about each unit, for a snapshot, unit_mac -> {due, last_upload, gaps, ...}
+    def export_state(self) :
+        with self._lock :
+            return {unit_mac : {"due" : unit.due, "last_upload" : unit.last_upload, "gaps" : list(unit.gaps),
+                "misses" : unit.misses, "off_polls" : unit.off_polls, "failures" : unit.failures} for unit_mac, unit in self._units.items()}
+
+    # carry on from a snapshot, for the units being scheduled, the others are left as they are
+    # a poll that was in flight when the snapshot was taken is due straight away
+    def restore_state(self, states) :
+        restored = 0
+        with self._lock :
+            for unit_mac, state in states.items() :
+                unit = self._units.get(unit_mac)
+                if unit is None or unit.in_flight :
+                    continue
+                unit.due = float(state["due"])
+                unit.last_upload = state["last_upload"]
+                unit.scheduled_upload = unit.last_upload
+                unit.gaps = deque(state["gaps"], maxlen=PERIOD_SAMPLES)
+                unit.period = statistics.median(unit.gaps) if unit.gaps else None
+                unit.misses = state["misses"]
+                unit.off_polls = state["off_polls"]
+                unit.failures = state["failures"]
+                heapq.heappush(self._heap, (unit.due, next(self._sequence), unit_mac))
+                restored += 1
+        return restored
+
+    # the learned upload period of each unit, None while not known yet
+    def periods(self) :
+        with self._lock :
+            return {unit_mac : unit.period for unit_mac, unit in self._units.items()}
+
+    # snapshot of the counters
+    def stats(self) :
+        with self._lock :
+            stats = {"units" : len(self._units), "in_flight" : sum(1 for unit in self._units.values() if unit.in_flight),
+                "deferred" : self.deferred}
+            stats.update(("polls_" + result, count) for result, count in self.polls.items())
+            return stats
+
+# a stable hash of a unit's mac address, the same in every process, unlike hash()
+def unit_hash(unit_mac) :
+    return zlib.crc32(unit_mac.lower().encode("utf-8"))
+
+class TimeWheel :
+
+    def __init__(self, interval, slots=60, units=()) :
+        self.interval = float(interval)
+        self.slots = max(1, int(slots))
+        self.slot_seconds = self.interval / self.slots
+        self._slots = [[] for slot in range(self.slots)]
+        self._slot_of = {}
+        self._lock = threading.Lock()
+        # units are placed in hash order, so where each one lands doesn't depend on the order they are listed in
+        # first every slot is filled to the fleet's share rounded down, the rest then go one more per slot
+        overflow = []
+        with self._lock :
+            for unit_mac in sorted(set(units), key=unit_hash) :
+                if self._place(unit_mac, len(units) // self.slots) is None :
+                    overflow.append(unit_mac)
+            for unit_mac in overflow :
+                self._place(unit_mac, math.ceil(len(units) / self.slots))
+        self.start()
+
+    # (re)start turning, the first slot is due now
+    def start(self, now=None) :
+        with self._lock :
+            self._started = time.monotonic() if now is None else now
+            self._since = self._started
+            # the next tick to fire, counted from the start, tick n is slot n % slots
+            self._tick = 0
+            self.late = 0.0
+            self.skipped = 0
+
+    # change the interval, the units keep their slots, which are stretched or shrunk to fit
+    # the next slot is due now, the slots after it come round at the new pace
+    def set_interval(self, interval, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            self.interval = float(interval)
+            self.slot_seconds = self.interval / self.slots
+            self._started = now - self._tick * self.slot_seconds
+
+    # where the wheel is in its turn, (next tick, seconds since the turn started), for a snapshot
+    def position(self, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            tick = self._tick % self.slots
+            return tick, now - (self._started + (self._tick - tick) * self.slot_seconds)
+
+    # carry on from a position, the slots that came round since then are due now, each once
+    def resume(self, tick, elapsed, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            self._started = now - elapsed
+            # the slots that came round while the program was down are only due from now
+            self._since = now
+            self._tick = int(tick) % self.slots
+            self.late = 0.0
+            self.skipped = 0
+
+    # put a unit in the slot its hash picks, or the next one with fewer than capacity units
+    # returns the slot, None if every slot is full, caller holds the lock
+    def _place(self, unit_mac, capacity) :
+        slot = unit_hash(unit_mac) % self.slots
+        for probe in range(self.slots) :
+            candidate = (slot + probe) % self.slots
+            if len(self._slots[candidate]) < capacity :
+                self._slots[candidate].append(unit_mac)
+                self._slot_of[unit_mac] = candidate
+                return candidate
+        return None
+
+    # add one unit to a wheel already turning, in the first slot from its hash that is below the fleet's share
+    def add(self, unit_mac) :
+        with self._lock :
+            if unit_mac in self._slot_of :
+                return self._slot_of[unit_mac]
+            return self._place(unit_mac, math.ceil((len(self._slot_of) + 1) / self.slots))
+
+    def remove(self, unit_mac) :
+        with self._lock :
+            slot = self._slot_of.pop(unit_mac, None)
+            if slot is not None :
+                self._slots[slot].remove(unit_mac)
+
+    # seconds into the interval a unit is polled at
+    def phase(self, unit_mac) :
+        with self._lock :
+            slot = self._slot_of.get(unit_mac)
+        if slot is None :
+            slot = unit_hash(unit_mac) % self.slots
+        return slot * self.slot_seconds
+
+    # units of every slot that has come round since the last call
+    # a wheel more than a turn behind skips the missed turns rather than polling every unit twice
+    # with with_due, (unit_mac, monotonic time its slot came round) pairs, in slot order, no earlier than the wheel
+    # (re)started
+    def pop_due(self, now=None, with_due=False) :
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock :
+            current = int((now - self._started) // self.slot_seconds)
+            if current - self._tick >= self.slots :
+                self.skipped += current - self._tick - self.slots + 1
+                self._tick = current - self.slots + 1
+            while self._tick <= current :
+                slot_due = self._started + self._tick * self.slot_seconds
+                self.late = max(0.0, now - slot_due)
+                if with_due :
+                    due.extend((unit_mac, max(slot_due, self._since)) for unit_mac in self._slots[self._tick % self.slots])
+                else :
+                    due.extend(self._slots[self._tick % self.slots])
+                self._tick += 1
+        return due
+
+    # seconds until the next slot comes round
+    def next_due(self, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            return max(0.0, self._started + self._tick * self.slot_seconds - now)
+
+    # number of units in each slot
+    def occupancy(self) :
+        with self._lock :
+            return [len(units) for units in self._slots]
+
+    # snapshot of the counters and how evenly the units are spread
+    def stats(self) :
+        occupancy = self.occupancy()
+        with self._lock :
+            return {"slots" : self.slots, "slot_seconds" : self.slot_seconds, "units" : len(self._slot_of),
+                "slot_min" : min(occupancy), "slot_max" : max(occupancy), "slot_mean" : sum(occupancy) / self.slots,
+                "slot_stdev" : statistics.pstdev(occupancy), "late" : self.late, "skipped" : self.skipped}
@@ -0,0 +1,116 @@
+#
+# winix_shard.py
+# 202610190100
+#
+# split the units between several winix-02 instances, each with its own shard_id
+#
+# every instance holds a lease on the retained MQTT topic winix/$SYS/SHARDS/<shard_id>, a JSON message with the
+# number of seconds the lease lasts, which it publishes again well before that. the instances subscribed to
+# winix/$SYS/SHARDS/+ all see the same set of leases, the members, and give each unit to a member by consistent
+# hashing of its mac address, so every instance works out the same owner for every unit without talking to the others
+#   - an instance that stops cleanly clears its retained lease, one that dies has it cleared by its MQTT last will
+#   - one that hangs without its connection dropping stops renewing, and is dropped when its lease runs out, timed
+#     from when its last lease arrived on the local monotonic clock, so the instances' clocks don't need to agree
+#   - a member joining or leaving moves only the units whose owner changed, about 1 / members of them, each member
+#     is several points on the hash ring so the units are spread evenly
+#
+
+import bisect
+import hashlib
+import math
+import threading
+import time
+
+# points on the ring per member
+RING_REPLICAS = 64
+
+# position on the ring of a key, the same in every process
+def ring_hash(key) :
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+class HashRing :
+
+    def __init__(self, members=(), replicas=RING_REPLICAS) :
+        self.members = tuple(sorted(set(members)))
+        points = sorted((ring_hash(member + "#" + str(replica)), member) for member in self.members for replica in range(replicas))
+        self._hashes = [point for point, member in points]
+        self._owners = [member for point, member in points]
+
+    # the member that owns a key, the first point on the ring at or after the key's, None with no members
+    def owner(self, key) :
+        if not self._hashes :
+            return None
+        i = bisect.bisect_left(self._hashes, ring_hash(key.lower()))
+        return self._owners[i % len(self._owners)]
+
+class ShardMembership :
+
+    # on_change(members) is called, without the lock held, when a member joins or leaves
+    def __init__(self, shard_id, replicas=RING_REPLICAS, on_change=None) :
+        self.shard_id = shard_id
+        self.replicas = replicas
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        # member -> monotonic time its lease runs out, this instance's own never does
+        self._leases = {shard_id : math.inf}
+        self._ring = HashRing(self._leases, replicas)
+        # counters
+        self.changes = 0
+        self.expired = 0
+
+    # a lease arrived for a member, lease seconds from now
+    def update(self, member, lease, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            if member == self.shard_id :
+                return
+            joined = member not in self._leases
+            self._leases[member] = now + float(lease)
+        if joined :
+            self._changed()
+
+    # a member cleared its lease, or its last will did
+    def remove(self, member) :
+        with self._lock :
+            if member == self.shard_id or self._leases.pop(member, None) is None :
+                return
+        self._changed()
+
+    # drop the members whose lease has run out
+    def expire(self, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            expired = [member for member, until in self._leases.items() if until <= now]
+            for member in expired :
+                del self._leases[member]
+            self.expired += len(expired)
+        if expired :
+            self._changed()
+        return expired
+
+    # seconds until the next lease runs out, None if only this instance is a member
+    def next_expiry(self, now=None) :
+        now = time.monotonic() if now is None else now
+        with self._lock :
+            until = min(self._leases.values())
+        return None if until == math.inf else max(0.0, until - now)
+
+    def _changed(self) :
+        with self._lock :
+            self._ring = HashRing(self._leases, self.replicas)
+            self.changes += 1
+            members = self._ring.members
+        if self._on_change is not None :
+            self._on_change(members)
+
+    def members(self) :
+        with self._lock :
+            return self._ring.members
+
+    def owner(self, unit_mac) :
+        with self._lock :
+            ring = self._ring
+        return ring.owner(unit_mac)
+
+    def owns(self, unit_mac) :
+        return self.owner(unit_mac) == self.shard_id
@@ -0,0 +1,71 @@
+#
+# winix_snapshot.py
+# 202610190200
+#
+# snapshots of what winix-02 knows about each unit, so a restart carries on where the last run left off
+#
+# without one a restart knows nothing, every unit is polled again and every status published again, and home
+# assistant sees a wave of changes that are not changes. winix-02 writes a snapshot every so often and when it stops,
+# and reads it back at start : the last status read and published for each unit, its state, when the adaptive
+# scheduler has its next poll due and what it learned about its uploads, and where the poll wheel was in its turn
+#
+# the snapshot is one JSON file. it is written to a temporary file in the same directory, flushed to disk, and then
+# renamed over the old one, so a crash or a power cut at any point leaves either the old snapshot or the new one,
+# never a part written file. a snapshot of another version is not read
+#
+# times in the snapshot are wall clock seconds, the monotonic clock starts again with every run
+#
+
+import json
+import os
+import tempfile
+import time
+
+SNAPSHOT_VERSION = 1
+
+# write the state, a dictionary that json can write, to path, replacing the snapshot there
+# returns the number of bytes written
+def write_snapshot(path, state) :
+    data = json.dumps({"version" : SNAPSHOT_VERSION, "written" : time.time(), "state" : state}, separators=(",", ":")).encode("utf-8")
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try :
+        with os.fdopen(handle, "wb") as temporary_file :
+            temporary_file.write(data)
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException :
+        try :
+            os.unlink(temporary_path)
+        except OSError :
+            pass
+        raise
+    # the rename is only on disk once the directory is, not possible on every platform
+    try :
+        directory_handle = os.open(directory, os.O_RDONLY)
+    except OSError :
+        return len(data)
+    try :
+        os.fsync(directory_handle)
+    except OSError :
+        pass
+    finally :
+        os.close(directory_handle)
+    return len(data)
+
+# read the snapshot at path, returns (state, wall clock time it was written), None if there is no snapshot
+# raises ValueError for a snapshot that can't be read or is of another version
+def read_snapshot(path) :
+    try :
+        with open(path, "rb") as snapshot_file :
+            data = snapshot_file.read()
+    except FileNotFoundError :
+        return None
+    try :
+        snapshot = json.loads(data.decode("utf-8"))
+    except ValueError as e :
+        raise ValueError("snapshot is not valid JSON : " + str(e))
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION :
+        raise ValueError("snapshot version is not " + str(SNAPSHOT_VERSION))
+    return snapshot["state"], float(snapshot["written"])